@@ -0,0 +1,51 @@
+"""
+Measure how batching ready tasks with the same body (see the max_batch_size
+argument of the scheduler) affects the runtime of many fine-grained
+independent tasks, as produced by blocked kmeans or matmul decompositions.
+All tasks are made ready at once by a gate task.
+
+    PARLA_CPU_ARCHITECTURE=cores PARLA_CORES=4 python batching.py -tasks 4000 -work 100
+"""
+import argparse
+import time
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.tasks import spawn, TaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-tasks", type=int, default=4000, help="The number of tasks.")
+parser.add_argument("-work", type=float, default=100, help="The busy time of each task in microseconds.")
+parser.add_argument("-batch", type=int, nargs="+", default=[1, 4, 16, 64], help="The maximum batch sizes to try.")
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def fan_out(n, work):
+    T = TaskSpace("T")
+
+    @spawn(T[-1])
+    def gate():
+        pass
+
+    for i in range(n):
+        @spawn(T[i], [T[-1]], placement=cpu)
+        def task():
+            end = time.perf_counter() + work
+            while time.perf_counter() < end:
+                pass
+
+
+def elapsed(max_batch_size):
+    start_t = time.perf_counter()
+    with Parla(max_batch_size=max_batch_size):
+        fan_out(args.tasks, args.work * 1e-6)
+    return time.perf_counter() - start_t
+
+
+if __name__ == "__main__":
+    for max_batch_size in args.batch:
+        times = [elapsed(max_batch_size) for _ in range(args.trials)]
+        print("max_batch_size={}: best {:.3f}s over {} trials ({:.1f} us/task)".format(
+            max_batch_size, min(times), args.trials, min(times) / args.tasks * 1e6), flush=True)
@@ -0,0 +1,57 @@
+"""
+Measure how long it takes to spawn an index range of empty tasks with a
+loop of `spawn` and with `parallel_for`, and how long it takes until all
+of them have run.
+
+    python bulk_spawn.py -n 100000 -chunk 1 64
+"""
+import argparse
+import time
+
+from parla import Parla, parallel_for
+from parla.cpu import cpu
+from parla.tasks import spawn, TaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", type=int, default=20000, help="The number of indices.")
+parser.add_argument("-chunk", type=int, nargs="+", default=[1, 64], help="The chunk sizes of parallel_for to try.")
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def spawn_loop(T, out):
+    for i in range(args.n):
+        @spawn(T[i], placement=cpu)
+        def task():
+            out[i] = i
+
+
+def spawn_range(T, out, chunk, dynamic):
+    @parallel_for(T, range(args.n), placement=cpu, chunk=chunk, dynamic=dynamic)
+    def task(i):
+        out[i] = i
+
+
+def measure(spawner, *spawn_args):
+    out = [None] * args.n
+    with Parla():
+        start_t = time.perf_counter()
+        spawner(TaskSpace("T"), out, *spawn_args)
+        spawned_t = time.perf_counter()
+    end_t = time.perf_counter()
+    assert out == list(range(args.n))
+    return spawned_t - start_t, end_t - start_t
+
+
+def report(name, spawner, *spawn_args):
+    times = [measure(spawner, *spawn_args) for _ in range(args.trials)]
+    print("{}: best spawn {:.3f}s, best total {:.3f}s over {} trials".format(
+        name, min(t[0] for t in times), min(t[1] for t in times), args.trials), flush=True)
+
+
+if __name__ == "__main__":
+    report("spawn loop", spawn_loop)
+    for chunk in args.chunk:
+        report("parallel_for chunk={}".format(chunk), spawn_range, chunk, False)
+        report("parallel_for chunk={} dynamic".format(chunk), spawn_range, chunk, True)
@@ -0,0 +1,73 @@
+"""
+Compare the makespan of the default (FIFO) scheduler with the critical-path
+scheduler on the task graph of a blocked Cholesky factorization, whose task
+bodies only sleep for a duration proportional to their flop count.
+
+Run it with several CPU devices so that the order of ready tasks matters:
+
+    PARLA_CPU_ARCHITECTURE=cores PARLA_CORES=8 python critical_path.py -b 12
+"""
+import argparse
+import time
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.task_runtime import Scheduler, CriticalPathScheduler
+from parla.tasks import spawn, TaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-b", type=int, default=12, help="The number of blocks per matrix dimension.")
+parser.add_argument("-t", type=float, default=0.002, help="The duration (in seconds) of a GEMM task.")
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def cholesky_graph(n, t):
+    """Spawn the tasks of a blocked Cholesky factorization with n x n blocks
+       and return the time at which the last task finished.
+    """
+    syrk = TaskSpace("syrk")
+    subcholesky = TaskSpace("subcholesky")
+    gemm = TaskSpace("gemm")
+    solve = TaskSpace("solve")
+    end_t = []
+
+    # Relative costs of the block kernels, in units of a GEMM.
+    syrk_t, potrf_t, trsm_t = t / 2, t / 3, t / 2
+
+    for j in range(n):
+        for k in range(j):
+            @spawn(syrk[j, k], [solve[j, k], syrk[j, 0:k]], placement=cpu)
+            def syrk_task():
+                time.sleep(syrk_t)
+
+        @spawn(subcholesky[j], [syrk[j, 0:j]], placement=cpu)
+        def potrf():
+            time.sleep(potrf_t)
+            end_t.append(time.perf_counter())
+
+        for i in range(j + 1, n):
+            for k in range(j):
+                @spawn(gemm[i, j, k], [solve[j, k], solve[i, k], gemm[i, j, 0:k]], placement=cpu)
+                def gemm_task():
+                    time.sleep(t)
+
+            @spawn(solve[i, j], [gemm[i, j, 0:j], subcholesky[j]], placement=cpu)
+            def trsm_task():
+                time.sleep(trsm_t)
+    return end_t
+
+
+def makespan(scheduler_class):
+    with Parla(scheduler_class=scheduler_class):
+        start_t = time.perf_counter()
+        end_t = cholesky_graph(args.b, args.t)
+    return end_t[-1] - start_t
+
+
+if __name__ == "__main__":
+    for name, scheduler_class in (("fifo", Scheduler), ("critical-path", CriticalPathScheduler)):
+        times = [makespan(scheduler_class) for _ in range(args.trials)]
+        print("{}: best makespan {:.3f}s over {} trials".format(
+            name, min(times), args.trials), flush=True)
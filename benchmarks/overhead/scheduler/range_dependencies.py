@@ -0,0 +1,45 @@
+"""
+Measure the overhead of the "depends on all previous tasks" pattern,
+`@spawn(T[i], [T[0:i]])`, with a `TaskSpace` (one dependency per previous
+task, quadratic in total) and with a `DenseTaskSpace` (one range
+dependency per task).
+
+    python range_dependencies.py -n 500 2000
+"""
+import argparse
+import time
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.tasks import spawn, TaskSpace, DenseTaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", type=int, nargs="+", default=[500, 2000], help="The numbers of tasks to try.")
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def chain(T, n, out):
+    for i in range(n):
+        @spawn(T[i], [T[0:i]], placement=cpu)
+        def task():
+            out.append(i)
+
+
+def elapsed(space_type, n):
+    out = []
+    start_t = time.perf_counter()
+    with Parla():
+        chain(space_type("T"), n, out)
+    end_t = time.perf_counter()
+    assert out == list(range(n))
+    return end_t - start_t
+
+
+if __name__ == "__main__":
+    for n in args.n:
+        for space_type in (TaskSpace, DenseTaskSpace):
+            times = [elapsed(space_type, n) for _ in range(args.trials)]
+            print("{} n={}: best {:.3f}s over {} trials".format(
+                space_type.__name__, n, min(times), args.trials), flush=True)
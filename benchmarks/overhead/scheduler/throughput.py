@@ -0,0 +1,43 @@
+"""
+Measure the task throughput of the runtime on chains of empty tasks, with
+and without the per-worker local queues (work stealing).
+Every completed task makes the next task of its chain ready.
+
+    PARLA_CPU_ARCHITECTURE=cores PARLA_CORES=32 python throughput.py -chains 32 -length 200
+"""
+import argparse
+import time
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.tasks import spawn, TaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-chains", type=int, default=len(cpu.devices), help="The number of independent task chains.")
+parser.add_argument("-length", type=int, default=200, help="The number of tasks per chain.")
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def chains(n, length):
+    T = TaskSpace("T")
+    for i in range(length):
+        for c in range(n):
+            @spawn(T[c, i], [T[c, i - 1]] if i > 0 else [], placement=cpu)
+            def task():
+                pass
+
+
+def throughput(work_stealing):
+    with Parla(work_stealing=work_stealing):
+        start_t = time.perf_counter()
+        chains(args.chains, args.length)
+    return args.chains * args.length / (time.perf_counter() - start_t)
+
+
+if __name__ == "__main__":
+    for work_stealing in (False, True):
+        rates = [throughput(work_stealing) for _ in range(args.trials)]
+        print("work_stealing={}: best {:.0f} tasks/s over {} trials".format(
+            work_stealing, max(rates), args.trials), flush=True)
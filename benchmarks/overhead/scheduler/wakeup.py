@@ -0,0 +1,59 @@
+"""
+Measure the latency between spawning a task and the start of its body, and
+the CPU time the runtime burns while it has nothing to do.
+
+    python wakeup.py -n 1000 -idle 2
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.tasks import spawn
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", type=int, default=1000, help="The number of spawned tasks to time.")
+parser.add_argument("-idle", type=float, default=2.0, help="How long (in seconds) to leave the runtime idle.")
+parser.add_argument("-period", type=float, default=None, help="The scheduler's idle wakeup period in seconds.")
+args = parser.parse_args()
+
+
+def spawn_latency(n):
+    latencies = []
+    started = threading.Event()
+    for i in range(n):
+        started.clear()
+        start_t = time.perf_counter()
+
+        @spawn(placement=cpu)
+        def task():
+            latencies.append(time.perf_counter() - start_t)
+            started.set()
+
+        started.wait()
+    return latencies
+
+
+def idle_cpu(seconds):
+    wall_start_t = time.perf_counter()
+    cpu_start_t = time.process_time()
+    time.sleep(seconds)
+    return (time.process_time() - cpu_start_t) / (time.perf_counter() - wall_start_t)
+
+
+if __name__ == "__main__":
+    with Parla(period=args.period):
+        # Warm up the worker threads before measuring.
+        spawn_latency(10)
+        latencies = spawn_latency(args.n)
+        idle_fraction = idle_cpu(args.idle)
+
+    latencies.sort()
+    print("spawn-to-run latency (us): median={:.1f}, p99={:.1f}, max={:.1f}".format(
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+        latencies[-1] * 1e6), flush=True)
+    print("idle CPU utilization: {:.2%} of a core".format(idle_fraction), flush=True)
@@ -0,0 +1,70 @@
+"""
+Compare spawning the tasks of every timestep with replaying a captured
+timestep (see parla.tasks.capture). Each timestep updates a row of blocks;
+a block depends on itself and its neighbours in the previous timestep.
+
+    PARLA_CPU_ARCHITECTURE=cores PARLA_CORES=4 python replay.py -width 16 -steps 100
+"""
+import argparse
+import time
+
+import numpy as np
+
+from parla import Parla, parray, capture
+from parla.cpu import cpu
+from parla.tasks import spawn, TaskSpace
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-width", type=int, default=16, help="The number of blocks (tasks per timestep).")
+parser.add_argument("-steps", type=int, default=100)
+parser.add_argument("-trials", type=int, default=3)
+args = parser.parse_args()
+
+
+def timesteps(replay, times):
+    @spawn(placement=cpu)
+    async def main():
+        blocks = [parray.asarray(np.zeros(16)) for _ in range(args.width)]
+        T = TaskSpace("T")
+
+        def step(t):
+            for i in range(args.width):
+                neighbours = [T[t - 1, j] for j in (i - 1, i, i + 1) if t > 0 and 0 <= j < args.width]
+
+                @spawn(T[t, i], neighbours, placement=cpu, inout=[blocks[i]])
+                def update():
+                    blocks[i][:] += 1
+
+        step(0)
+        for i in range(args.width):
+            await T[0, i]
+
+        start_t = time.perf_counter()
+        if replay:
+            with capture() as graph:
+                step(1)
+            for t in range(2, args.steps):
+                graph.replay()
+            await graph
+        else:
+            for t in range(1, args.steps):
+                step(t)
+            for i in range(args.width):
+                await T[args.steps - 1, i]
+        times.append(time.perf_counter() - start_t)
+        assert all(float(b[0]) == args.steps for b in blocks)
+
+
+def run(replay):
+    times = []
+    with Parla():
+        timesteps(replay, times)
+    return times[0]
+
+
+if __name__ == "__main__":
+    for replay in (False, True):
+        times = [run(replay) for _ in range(args.trials)]
+        print("{}: best {:.3f}s for {} timesteps over {} trials".format(
+            "replay" if replay else "spawn", min(times), args.steps, args.trials), flush=True)
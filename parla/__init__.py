@@ -9,7 +9,7 @@ from parla import task_runtime
 from parla.device import get_all_devices
 from parla.environments import TaskEnvironment
 
-__all__ = ["Parla", "TaskEnvironment", "spawn", "TaskSpace"]
+__all__ = ["Parla", "TaskEnvironment", "spawn", "TaskSpace", "capture", "parallel_for", "DenseTaskSpace"]
 
 
 class Parla:
@@ -34,4 +34,4 @@ class Parla:
         finally:
             del self._sched
 
-from parla.tasks import spawn, TaskSpace
+from parla.tasks import spawn, TaskSpace, capture, parallel_for, DenseTaskSpace
@@ -0,0 +1,138 @@
+"""
+A persistent history of task execution times.
+
+Completed tasks are recorded by task body, size of their input data, and
+the architecture they ran on. The history is saved to a JSON file when the
+scheduler exits and loaded again when the next one starts, so the cost
+models of the runtime (see `parla.mapping.PerformanceModel` and
+`parla.task_runtime.TaskCostModel`) start from the measurements of earlier runs.
+
+Enable it with `Parla(history="path/to/history.json")` or by setting the
+environment variable `PARLA_TASK_HISTORY` to a path.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+__all__ = ["TaskHistory", "get_task_history"]
+
+logger = logging.getLogger(__name__)
+
+_FORMAT_VERSION = 1
+
+
+class TaskHistory:
+    """
+    Mean execution times keyed by (task body, input size bucket, architecture id).
+    Input sizes are bucketed by powers of two.
+    """
+
+    # Bound the weight of old measurements so the history follows changes in the code or machine.
+    max_samples: int = 100
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._monitor = threading.Lock()
+        # (body, bucket, architecture id) -> (mean execution time in seconds, number of samples)
+        self._times: Dict[Tuple[str, int, str], Tuple[float, int]] = {}
+        # (body, architecture id or None) -> (mean execution time over all input sizes, number of samples)
+        self._body_times: Dict[Tuple[str, Optional[str]], Tuple[float, int]] = {}
+        self._body_names = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _body(self, task) -> str:
+        # Code objects identify bodies within a run; their location identifies them across runs.
+        code = task.code
+        with self._monitor:
+            name = self._body_names.get(code)
+            if name is None:
+                if hasattr(code, "co_filename"):
+                    name = "{}:{}:{}".format(code.co_filename, code.co_firstlineno,
+                                             getattr(code, "co_qualname", code.co_name))
+                else:
+                    name = getattr(code, "__qualname__", repr(code))
+                self._body_names[code] = name
+        return name
+
+    @staticmethod
+    def _bucket(task) -> int:
+        dataflow = task.dataflow
+        if dataflow is None:
+            return 0
+        return int(sum(parray.nbytes for parray in dataflow.input + dataflow.inout)).bit_length()
+
+    def _add(self, table, key, seconds, samples=1):
+        mean, n = table.get(key, (0.0, 0))
+        n = min(n + samples, self.max_samples)
+        table[key] = (mean + (seconds - mean) * samples / n if n else seconds, n)
+
+    def record(self, task, architecture_id: str, seconds: float):
+        body = self._body(task)
+        key = (body, self._bucket(task), architecture_id)
+        with self._monitor:
+            self._add(self._times, key, seconds)
+            self._add(self._body_times, (body, architecture_id), seconds)
+            self._add(self._body_times, (body, None), seconds)
+
+    def lookup(self, task, architecture_id: Optional[str] = None) -> Optional[float]:
+        """
+        :return: The mean execution time of tasks with the same body (and architecture, if given),
+                 preferring those with a similar input size, or None if there is none.
+        """
+        body = self._body(task)
+        if architecture_id is not None:
+            time = self._times.get((body, self._bucket(task), architecture_id))
+            if time is not None:
+                return time[0]
+        time = self._body_times.get((body, architecture_id))
+        return None if time is None else time[0]
+
+    def load(self, path: str):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != _FORMAT_VERSION:
+                raise ValueError("unsupported version {!r}".format(data.get("version")))
+            entries = [((e["task"], e["bucket"], e["architecture"]), float(e["mean"]), int(e["count"]))
+                       for e in data["entries"]]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring the task history in %s: %s", path, e)
+            return
+        with self._monitor:
+            for key, mean, count in entries:
+                body, _, architecture_id = key
+                self._add(self._times, key, mean, count)
+                self._add(self._body_times, (body, architecture_id), mean, count)
+                self._add(self._body_times, (body, None), mean, count)
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with self._monitor:
+            entries = [dict(task=body, bucket=bucket, architecture=architecture_id, mean=mean, count=count)
+                       for (body, bucket, architecture_id), (mean, count) in self._times.items()]
+        # Write a new file and rename it so an interrupted save keeps the old history.
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(dict(version=_FORMAT_VERSION, entries=entries), f)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self._times)
+
+    def __repr__(self):
+        return "TaskHistory({!r}, {} entries)".format(self.path, len(self))
+
+
+def get_task_history(history) -> Optional[TaskHistory]:
+    """
+    :param history: A TaskHistory, a path, or None to use the path in `PARLA_TASK_HISTORY` if it is set.
+    """
+    if isinstance(history, TaskHistory):
+        return history
+    history = history or os.environ.get("PARLA_TASK_HISTORY")
+    if history:
+        return TaskHistory(history)
+    return None
@@ -0,0 +1,355 @@
+"""
+Mapping policies decide on which device a spawned task runs.
+
+The scheduler describes every candidate device of a task with a `MappingView`
+and asks its policy for a suitability score per device. It then tries the
+devices from the most suitable one and maps the task to the first one with
+enough resources for it.
+
+Select a policy with `Parla(policy=...)`, either by name or as an instance:
+
+>>> with Parla(policy=LeastLoadedPolicy(nonlocal_data_weight=10.0)):
+...
+"""
+import random
+import threading
+from abc import abstractmethod, ABCMeta
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import numpy as np
+
+__all__ = ["MappingView", "MappingPolicy", "LocalityPolicy", "RoundRobinPolicy", "LeastLoadedPolicy",
+           "RandomPolicy", "PerformanceModel", "EarliestFinishTimePolicy", "get_mapping_policy"]
+
+
+class MappingView:
+    """
+    What the scheduler knows about the candidate devices of a task.
+    All arrays are indexed like `devices`.
+    """
+    # The task being mapped.
+    task: "ComputeTask"
+    devices: Sequence["Device"]
+    # Bytes of the task's input operands which are (not) on each device
+    local_data: np.ndarray
+    nonlocal_data: np.ndarray
+    # Memory size of each device
+    memory: np.ndarray
+    # Number of mapped compute and data movement tasks on each device
+    load: np.ndarray
+    # Positions of the devices in the device list given to MappingPolicy.set_devices
+    positions: Optional[np.ndarray]
+
+    def __init__(self, task, devices, local_data, nonlocal_data, memory, load,
+                 positions=None, resource_pool=None):
+        self.task = task
+        self.devices = devices
+        self.local_data = local_data
+        self.nonlocal_data = nonlocal_data
+        self.memory = memory
+        self.load = load
+        self.positions = positions
+        self._resource_pool = resource_pool
+
+    def operand_locations(self) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """The size of each input operand of the task, and a bitmap of the
+           devices (by position) which hold it, or None if it is not tracked.
+        """
+        return self._resource_pool.parray_locations(self.task.dataflow.input + self.task.dataflow.inout)
+
+    def owns_dependency(self) -> np.ndarray:
+        """Whether a dependency of the task is mapped to each device."""
+        dependency_devices = set()
+        for dependency in self.task.dependencies:
+            dependency_devices.update(dependency.req.devices)
+        return np.fromiter((d in dependency_devices for d in self.devices), dtype=float, count=len(self.devices))
+
+
+class MappingPolicy(metaclass=ABCMeta):
+    """
+    A mapping policy scores the candidate devices of tasks.
+    Policies may be called from several threads at once.
+    """
+
+    @abstractmethod
+    def suitability(self, view: MappingView) -> np.ndarray:
+        """
+        :return: A score for each device of `view`. Devices with higher scores are tried first.
+        """
+        raise NotImplementedError()
+
+    def set_devices(self, devices: Sequence["Device"]):
+        """Called by the scheduler with all its devices, in position order."""
+        pass
+
+    def set_history(self, history: Optional["TaskHistory"]):
+        """Called by the scheduler with its task history (see parla.history), if any."""
+        pass
+
+    def task_mapped(self, task: "ComputeTask", device: "Device", position: int):
+        """Called when `task` is mapped to `device`, once for each of its devices."""
+        pass
+
+    def task_finished(self, task: "ComputeTask", seconds: Optional[float]):
+        """Called when a mapped task finishes. `seconds` is the time its body took,
+           or None if it did not complete.
+        """
+        pass
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,
+                               ", ".join("{}={!r}".format(k, v) for k, v in vars(self).items()
+                                         if not k.startswith("_")))
+
+
+class LocalityPolicy(MappingPolicy):
+    """
+    Prefer devices which hold the task's data and avoid loaded devices.
+    Data sizes are normalized to the device memory size and loads to the
+    total load of the candidate devices. Devices with less than their fair
+    share of the load get a constant bonus.
+    This is the default policy.
+    """
+
+    def __init__(self, local_data_weight: float = 30.0, nonlocal_data_weight: float = 30.0,
+                 load_weight: float = 1.0, dependency_weight: float = 0.0):
+        self.local_data_weight = local_data_weight
+        self.nonlocal_data_weight = nonlocal_data_weight
+        self.load_weight = load_weight
+        self.dependency_weight = dependency_weight
+
+    def suitability(self, view: MappingView) -> np.ndarray:
+        ndevices = len(view.devices)
+        total_load = view.load.sum()
+        if total_load > 0:
+            norm_load = view.load / total_load
+        else:
+            norm_load = np.zeros(ndevices)
+        load_penalty = np.where(norm_load < 1 / ndevices, -1, norm_load)
+
+        suitability = self.local_data_weight * view.local_data / view.memory \
+            - self.nonlocal_data_weight * view.nonlocal_data / view.memory \
+            - self.load_weight * load_penalty
+        if self.dependency_weight:
+            suitability += self.dependency_weight * view.owns_dependency()
+        return suitability
+
+
+class RoundRobinPolicy(MappingPolicy):
+    """
+    Map successive tasks to successive devices, skipping devices without
+    enough resources.
+    """
+
+    def __init__(self):
+        self._next = 0
+        self._monitor = threading.Lock()
+
+    def suitability(self, view: MappingView) -> np.ndarray:
+        ndevices = len(view.devices)
+        with self._monitor:
+            start = self._next % ndevices
+            self._next += 1
+        # The device at `start` scores highest, then the following ones.
+        return -((np.arange(ndevices) - start) % ndevices).astype(float)
+
+
+class LeastLoadedPolicy(MappingPolicy):
+    """
+    Prefer the device with the fewest mapped tasks. Ties are broken by the
+    amount of data to move to the device, normalized to its memory size.
+    """
+
+    def __init__(self, load_weight: float = 1.0, nonlocal_data_weight: float = 1e-3):
+        self.load_weight = load_weight
+        self.nonlocal_data_weight = nonlocal_data_weight
+
+    def suitability(self, view: MappingView) -> np.ndarray:
+        return -self.load_weight * view.load \
+            - self.nonlocal_data_weight * view.nonlocal_data / view.memory
+
+
+class RandomPolicy(MappingPolicy):
+    """
+    Map tasks to random devices (with enough resources).
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._monitor = threading.Lock()
+
+    def suitability(self, view: MappingView) -> np.ndarray:
+        with self._monitor:
+            return np.array([self._random.random() for _ in view.devices])
+
+
+class PerformanceModel:
+    """
+    Predicts the execution time of tasks on each architecture from the
+    times measured so far, tracks the predicted work mapped to each device,
+    and the time to move data between devices.
+
+    Execution times are running averages keyed by task body and architecture.
+    A task which has not run on an architecture yet is predicted from the
+    task history of earlier runs, or else to take the mean time of the tasks
+    measured on the architecture, or `default_task_time`.
+
+    :param bandwidths: Bytes per second, keyed by pairs of devices or of architecture ids,
+                       e.g. `{("cpu", "gpu"): 12e9, (gpu(0), gpu(1)): 50e9}`.
+    :param default_bandwidth: The bandwidth between devices not in `bandwidths`.
+    """
+
+    def __init__(self, bandwidths: Dict[Tuple[Any, Any], float] = None,
+                 default_bandwidth: float = 10e9, default_task_time: float = 1e-3):
+        self.bandwidths = dict(bandwidths or {})
+        self.default_bandwidth = default_bandwidth
+        self.default_task_time = default_task_time
+        self.history = None
+        self._monitor = threading.Lock()
+        # (body, architecture id) -> (mean execution time in seconds, number of samples)
+        self._times: Dict[Tuple[Any, str], Tuple[float, int]] = {}
+        # architecture id -> [sum of the mean times, number of bodies]
+        self._architecture_times: Dict[str, List] = {}
+        # task -> (device position, predicted execution time) for each of its devices
+        self._pending: Dict["ComputeTask", List[Tuple[int, float]]] = {}
+        self.set_devices([])
+
+    def set_devices(self, devices: Sequence["Device"]):
+        self.devices = list(devices)
+        # The predicted time each device needs to run the tasks mapped to it
+        self.pending_work = np.zeros(len(self.devices))
+        self.bandwidth_matrix = np.array(
+            [[np.inf if src == dst else self.bandwidth(src, dst) for dst in self.devices]
+             for src in self.devices]).reshape(len(self.devices), len(self.devices))
+
+    def bandwidth(self, src: "Device", dst: "Device") -> float:
+        for key in ((src, dst), (src.architecture.id, dst.architecture.id)):
+            if key in self.bandwidths:
+                return self.bandwidths[key]
+        return self.default_bandwidth
+
+    @staticmethod
+    def _key(task):
+        return task.code
+
+    def predict(self, task: "ComputeTask", architecture_id: str) -> float:
+        time = self._times.get((self._key(task), architecture_id))
+        if time is not None:
+            return time[0]
+        if self.history is not None:
+            time = self.history.lookup(task, architecture_id)
+            if time is not None:
+                return time
+        total = self._architecture_times.get(architecture_id)
+        if total is not None:
+            return total[0] / total[1]
+        return self.default_task_time
+
+    def record(self, task: "ComputeTask", architecture_id: str, seconds: float):
+        key = (self._key(task), architecture_id)
+        with self._monitor:
+            mean, n = self._times.get(key, (0.0, 0))
+            new_mean = mean + (seconds - mean) / (n + 1)
+            self._times[key] = (new_mean, n + 1)
+            total = self._architecture_times.setdefault(architecture_id, [0.0, 0])
+            total[0] += new_mean - mean
+            total[1] += n == 0
+
+    def execution_times(self, task: "ComputeTask", devices: Sequence["Device"]) -> np.ndarray:
+        predictions = {}
+        for d in devices:
+            if d.architecture.id not in predictions:
+                predictions[d.architecture.id] = self.predict(task, d.architecture.id)
+        return np.array([predictions[d.architecture.id] for d in devices])
+
+    def transfer_times(self, operands: List[Tuple[int, Optional[np.ndarray]]], positions: np.ndarray) -> np.ndarray:
+        """The time to move the operands which are not on each device from the fastest device holding them."""
+        times = np.zeros(len(positions))
+        for nbytes, locations in operands:
+            if locations is None or not locations.any():
+                times += nbytes / self.default_bandwidth
+                continue
+            bandwidth = self.bandwidth_matrix[locations][:, positions].max(axis=0)
+            times += nbytes / bandwidth
+        return times
+
+    def task_mapped(self, task: "ComputeTask", device: "Device", position: int):
+        predicted = self.predict(task, device.architecture.id)
+        with self._monitor:
+            self._pending.setdefault(task, []).append((position, predicted))
+            self.pending_work[position] += predicted
+
+    def task_finished(self, task: "ComputeTask", seconds: Optional[float]):
+        with self._monitor:
+            pending = self._pending.pop(task, None)
+            if pending is None:
+                return
+            for position, predicted in pending:
+                self.pending_work[position] = max(self.pending_work[position] - predicted, 0.0)
+        if seconds is not None:
+            # Like the task history, attribute the time to the first device.
+            self.record(task, self.devices[pending[0][0]].architecture.id, seconds)
+
+
+class EarliestFinishTimePolicy(MappingPolicy):
+    """
+    Prefer the device on which the task is estimated to finish first:
+    the predicted work already mapped to the device, plus the time to move the
+    task's non-resident data to it, plus the predicted execution time on it
+    (see `PerformanceModel`).
+    """
+
+    def __init__(self, model: PerformanceModel = None, wait_weight: float = 1.0,
+                 transfer_weight: float = 1.0, execution_weight: float = 1.0):
+        self.model = model or PerformanceModel()
+        self.wait_weight = wait_weight
+        self.transfer_weight = transfer_weight
+        self.execution_weight = execution_weight
+
+    def finish_time(self, view: MappingView) -> np.ndarray:
+        finish_time = self.wait_weight * self.model.pending_work[view.positions] \
+            + self.execution_weight * self.model.execution_times(view.task, view.devices)
+        if view.nonlocal_data.any():
+            finish_time += self.transfer_weight * \
+                self.model.transfer_times(view.operand_locations(), view.positions)
+        return finish_time
+
+    def suitability(self, view: MappingView) -> np.ndarray:
+        return -self.finish_time(view)
+
+    def set_devices(self, devices: Sequence["Device"]):
+        self.model.set_devices(devices)
+
+    def set_history(self, history: Optional["TaskHistory"]):
+        self.model.history = history
+
+    def task_mapped(self, task: "ComputeTask", device: "Device", position: int):
+        self.model.task_mapped(task, device, position)
+
+    def task_finished(self, task: "ComputeTask", seconds: Optional[float]):
+        self.model.task_finished(task, seconds)
+
+
+mapping_policies: Dict[str, Type[MappingPolicy]] = {
+    "locality": LocalityPolicy,
+    "round_robin": RoundRobinPolicy,
+    "least_loaded": LeastLoadedPolicy,
+    "random": RandomPolicy,
+    "eft": EarliestFinishTimePolicy,
+}
+
+
+def get_mapping_policy(policy: Union[str, MappingPolicy, None]) -> MappingPolicy:
+    """
+    :param policy: A policy, the name of a built-in policy (see `mapping_policies`), or None for the default.
+    """
+    if policy is None:
+        return LocalityPolicy()
+    if isinstance(policy, MappingPolicy):
+        return policy
+    try:
+        return mapping_policies[policy]()
+    except (KeyError, TypeError):
+        raise ValueError("Unknown mapping policy {!r}; use one of {} or a MappingPolicy.".format(
+            policy, ", ".join(mapping_policies)))
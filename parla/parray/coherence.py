@@ -213,6 +213,35 @@ class Coherence:
         return [MemoryOperation.load(device_id, t, on_different_device=on_different_device) for t in target] \
                + [MemoryOperation.evict(t) for t in evict_list]
 
+    def is_current(self, device_id: int, do_write: bool, slices_hash: int = None) -> bool:
+        """ Tell whether a read (or write) on this device would be a NOOP,
+        i.e. the device already has a valid (or modified) copy.
+
+        Args:
+            device_id: id of this device
+            do_write: True to check for a write rather than a read
+            slices_hash: hash code of the slices of the subarray to be manipulated
+                         by default equals to None, which means the whole array is manipulated
+
+        Return:
+            True if `read` (or `write`) would only return a NOOP and not change any state.
+
+        Note: the caller should hold the lock
+        """
+        if slices_hash is not None and self._is_complete[device_id] is not True:
+            local_states = self._local_states[device_id]
+            if not isinstance(local_states, dict):
+                return False
+            state = local_states.get(slices_hash, self.INVALID)
+        elif self._is_complete[device_id] is not True:
+            return False
+        else:
+            state = self._local_states[device_id]
+
+        if do_write:
+            return state == self.MODIFIED
+        return state != self.INVALID
+
     def read(self, device_id: int, slices_hash: int = None) -> List[MemoryOperation]:
         """ Tell the protocol that this device read from the copy.
 
@@ -468,6 +468,16 @@ class PArray:
         else:
             self._coherence_read(device_id, slices)
 
+    def _is_current_on(self, device_id: int, do_write: bool = False) -> bool:
+        """ True if `_auto_move` to this device would not move any data.
+
+        Args:
+            device_id: id of the device. CPU use CPU_INDEX as id
+            do_write: True if the device will write to the array
+        """
+        with self._coherence._lock:
+            return self._coherence.is_current(device_id, do_write, self._slices_hash)
+
     def _on_same_device(self, other: "PArray") -> bool:
         """
         Return True if the two PArrays are in the same device.
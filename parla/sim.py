@@ -0,0 +1,441 @@
+"""
+A discrete-event simulator for Parla task graphs.
+
+A `Simulator` is a scheduler context which captures the tasks spawned in it
+(their dependencies, dataflow PArrays and placement) instead of running them.
+`Simulator.run` then replays the captured graph on virtual devices: tasks are
+mapped with the scheduler's mapping policies (see `parla.mapping`), ordered
+with its task queues and priorities, and take modeled compute and transfer
+times. Task bodies never run, so graphs for multi-GPU machines can be studied
+on any machine, and the results are deterministic for deterministic policies.
+
+>>> sim = Simulator(gpus=4)
+>>> with sim:
+...     @spawn(T[0], placement=sim.gpu, inout=[a])
+...     def t():
+...         ...
+>>> print(sim.run(policy="eft"))
+
+Placements are resolved to the virtual devices: a virtual architecture or
+device places the task on it, a real architecture (e.g. `cpu`) on the
+virtual devices with the same architecture id, and no placement (or all
+real devices) on any virtual device. Since the only real devices of a CPU
+machine are CPUs, use the architectures of the simulator (`sim.cpu` and
+`sim.gpu`) to pin tasks to virtual CPUs there.
+
+The model is simple by design:
+
+* A device runs `slots` tasks at a time (the number of CPU cores for a
+  virtual CPU and one for a GPU).
+* A task occupies its device while its missing operands are copied to the
+  device and while its body runs. Operands are copied from the device with
+  the highest bandwidth to the target among those holding them.
+* PArrays start on the first CPU device (or the first device if there is
+  none) and, like in the scheduler, their location is updated when a task
+  using them is mapped.
+* Like the scheduler, at most `mapping_limit` mapped tasks are in flight.
+* Memory capacities are not enforced and tasks spawned by task bodies are
+  not captured.
+"""
+import heapq
+import threading
+from collections import defaultdict
+from itertools import count
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from parla.device import Architecture, Device, get_all_devices
+from parla.history import TaskHistory, get_task_history
+from parla.mapping import MappingPolicy, MappingView, PerformanceModel, get_mapping_policy
+from parla.task_runtime import SchedulerContext, Scheduler, CriticalPathScheduler, DeviceSetRequirements, \
+    TaskCostModel, TaskID, TaskQueue, TaskWaiting
+
+__all__ = ["VirtualArchitecture", "VirtualDevice", "SimulatedTask", "SimulationReport", "Simulator"]
+
+
+class VirtualArchitecture(Architecture):
+    """An architecture of virtual devices. Its id matches the real architecture it models."""
+
+    def __init__(self, name, id):
+        super().__init__(name, id)
+        self._devices = []
+
+    @property
+    def devices(self):
+        return list(self._devices)
+
+    def __repr__(self):
+        return "VirtualArchitecture({!r})".format(self.id)
+
+
+class VirtualDevice(Device):
+    def __init__(self, architecture: VirtualArchitecture, index, *, memory: float, slots: int = 1):
+        super().__init__(architecture, index, memory=memory, slots=slots)
+        self.slots = slots
+        self._memory = memory
+
+    @property
+    def resources(self) -> Dict[str, float]:
+        return dict(memory=self._memory, vcus=1)
+
+    @property
+    def default_components(self):
+        return []
+
+    def __repr__(self):
+        return "<Virtual {} {}>".format(self.architecture.id, self.index)
+
+
+class SimulatedTask:
+    """
+    A captured task. It has the attributes of `ComputeTask` which the
+    mapping policies and cost models use.
+    """
+
+    def __init__(self, taskid: TaskID, name: Optional[str], code, dependencies: List,
+                 req: DeviceSetRequirements, dataflow, priority: int, serial: int):
+        self._mutex = threading.Lock()
+        self._taskid = taskid
+        self.name = name
+        self.code = code
+        # Tasks and, until the graph is complete, the ids of unspawned tasks
+        self._dependencies = dependencies
+        self.req = req
+        self.dataflow = dataflow
+        self.priority = priority
+        self.rank = 0.0
+        self.serial = serial
+        self._state = TaskWaiting()
+        # Set by Simulator.run
+        self.device: Optional[VirtualDevice] = None
+        self.start_time = None
+        self.finish_time = None
+
+    @property
+    def taskid(self) -> TaskID:
+        return self._taskid
+
+    @property
+    def dependencies(self) -> Tuple["SimulatedTask", ...]:
+        return tuple(d.task if isinstance(d, TaskID) else d for d in self._dependencies)
+
+    def __repr__(self):
+        return "<SimulatedTask {}>".format(self._taskid.full_name)
+
+
+class SimulationReport:
+    """The outcome of a simulation. Times are in seconds."""
+
+    def __init__(self, makespan: float, busy_time: Dict[VirtualDevice, float],
+                 bytes_moved: Dict[VirtualDevice, int], tasks: List[SimulatedTask]):
+        self.makespan = makespan
+        # The time each device spent copying data and running tasks
+        self.busy_time = busy_time
+        # The number of bytes copied to each device
+        self.bytes_moved_to = bytes_moved
+        self.tasks = tasks
+
+    @property
+    def bytes_moved(self) -> int:
+        return sum(self.bytes_moved_to.values())
+
+    @property
+    def utilization(self) -> Dict[VirtualDevice, float]:
+        """The fraction of the makespan each device (all its slots) was busy."""
+        return {d: busy / (self.makespan * d.slots) if self.makespan else 0.0
+                for d, busy in self.busy_time.items()}
+
+    @property
+    def placements(self) -> Dict[str, VirtualDevice]:
+        return {t.taskid.full_name: t.device for t in self.tasks}
+
+    def __str__(self):
+        lines = ["makespan: {:.6f}s, bytes moved: {}".format(self.makespan, self.bytes_moved)]
+        utilization = self.utilization
+        for d in self.busy_time:
+            lines.append("  {!r}: utilization {:.1%}, {} bytes moved in".format(
+                d, utilization[d], self.bytes_moved_to[d]))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "SimulationReport(makespan={}, bytes_moved={})".format(self.makespan, self.bytes_moved)
+
+
+class _Residency:
+    """Where the simulated PArrays are, in the interface of ResourcePool which MappingView uses."""
+
+    def __init__(self, ndevices: int, home: int):
+        self.ndevices = ndevices
+        self.home = home
+        # PArray parent id -> bitmap of the devices holding it
+        self.locations: Dict[int, np.ndarray] = {}
+
+    def _locations(self, parray) -> np.ndarray:
+        locations = self.locations.get(parray.parent_ID)
+        if locations is None:
+            locations = np.zeros(self.ndevices, dtype=bool)
+            locations[self.home] = True
+            self.locations[parray.parent_ID] = locations
+        return locations
+
+    def local_parray_nbytes(self, parrays, positions: np.ndarray) -> Tuple[np.ndarray, int]:
+        local = np.zeros(len(positions))
+        total = 0
+        for parray in parrays:
+            total += parray.nbytes
+            local += self._locations(parray)[positions] * parray.nbytes
+        return local, total
+
+    def parray_locations(self, parrays) -> List[Tuple[int, Optional[np.ndarray]]]:
+        return [(parray.nbytes, self._locations(parray).copy()) for parray in parrays]
+
+    # PArrays register themselves when they are created. They start at home.
+
+    def track_parray(self, parray):
+        pass
+
+    def untrack_parray(self, parray):
+        pass
+
+
+class Simulator(SchedulerContext):
+    """
+    Captures the tasks spawned in its context and simulates their execution.
+
+    :param cpus: The number of virtual CPU devices.
+    :param gpus: The number of virtual GPU devices.
+    :param cores: The number of tasks a virtual CPU runs at a time.
+    :param cpu_memory: The memory size of a virtual CPU in bytes.
+    :param gpu_memory: The memory size of a virtual GPU in bytes.
+    :param bandwidths: Bytes per second between devices, keyed like the bandwidths of `PerformanceModel`.
+    :param task_time: The execution time of tasks in seconds: a number, or a function of the task
+                      and the virtual device, or None to predict it from the task history
+                      (or `PerformanceModel.default_task_time`).
+    :param history: A TaskHistory or its path (see `parla.history`), used by the policies and `task_time`.
+    """
+
+    # The maximum number of mapped tasks which have not finished (as in Scheduler.map_tasks_callback)
+    mapping_limit: int = 60
+
+    def __init__(self, cpus: int = 1, gpus: int = 0, cores: int = 1,
+                 cpu_memory: float = 64e9, gpu_memory: float = 16e9,
+                 bandwidths: Dict[Tuple, float] = None,
+                 task_time: Union[float, Callable[[SimulatedTask, VirtualDevice], float], None] = None,
+                 history: Union[str, TaskHistory, None] = None):
+        self.cpu = VirtualArchitecture("Virtual CPU", "cpu")
+        self.gpu = VirtualArchitecture("Virtual GPU", "gpu")
+        self.cpu._devices = [VirtualDevice(self.cpu, i, memory=cpu_memory, slots=cores) for i in range(cpus)]
+        self.gpu._devices = [VirtualDevice(self.gpu, i, memory=gpu_memory, slots=1) for i in range(gpus)]
+        self.devices: List[VirtualDevice] = self.cpu._devices + self.gpu._devices
+        if not self.devices:
+            raise ValueError("A simulator needs at least one device.")
+        self.bandwidths = bandwidths
+        self.task_time = task_time
+        self.history = get_task_history(history)
+        self._model = PerformanceModel(bandwidths)
+        self._model.history = self.history
+        self._model.set_devices(self.devices)
+        self._home = next((i for i, d in enumerate(self.devices) if d.architecture.id == "cpu"), 0)
+        self._available_resources = _Residency(len(self.devices), self._home)
+        self.tasks: List[SimulatedTask] = []
+        self._serials = count()
+
+    # Capture
+
+    @property
+    def scheduler(self):
+        return self
+
+    def spawn_task(self, function, args, dependencies, taskid, req, dataflow, name=None, priority=0,
+                   batchable=True):
+        body = args[0] if args else function
+        code = getattr(body, "__code__", None) or getattr(body, "cr_code", None) or body
+        task = SimulatedTask(taskid, name, code, list(dependencies), self._virtual_requirements(req),
+                             dataflow, priority, next(self._serials))
+        taskid.task = task
+        self.tasks.append(task)
+        return task
+
+    def _virtual_requirements(self, req: DeviceSetRequirements) -> DeviceSetRequirements:
+        devices = set(req.devices)
+        virtual = {d for d in devices if d in self.devices}
+        if not virtual:
+            if devices == set(get_all_devices()):
+                virtual = set(self.devices)
+            else:
+                architectures = {d.architecture.id for d in devices}
+                virtual = {d for d in self.devices if d.architecture.id in architectures}
+        if not virtual:
+            raise ValueError("No virtual device matches the placement {}".format(req.devices))
+        return DeviceSetRequirements(req.resources, req.ndevices, virtual, req.tags)
+
+    def start_scheduler_callbacks(self):
+        pass
+
+    def enqueue_task(self, task):
+        raise RuntimeError("Simulated tasks are not run")
+
+    def enqueue_spawned_task(self, task):
+        raise RuntimeError("Simulated tasks are not run")
+
+    def incr_active_tasks(self):
+        pass
+
+    def decr_active_tasks(self):
+        pass
+
+    # Simulation
+
+    def _execution_time(self, task: SimulatedTask, device: VirtualDevice) -> float:
+        if self.task_time is None:
+            return self._model.predict(task, device.architecture.id)
+        if callable(self.task_time):
+            return self.task_time(task, device)
+        return self.task_time
+
+    def run(self, policy: Union[str, MappingPolicy, None] = None,
+            scheduler_class=Scheduler) -> SimulationReport:
+        """
+        Simulate the captured tasks.
+
+        :param policy: The mapping policy, as for `Parla(policy=...)`.
+        :param scheduler_class: The scheduler whose task priorities order the queues,
+                                e.g. CriticalPathScheduler. Its default policy is used if `policy` is None.
+        """
+        if policy is None and issubclass(scheduler_class, CriticalPathScheduler):
+            policy = "eft"
+        policy = get_mapping_policy(policy)
+        policy.set_devices(self.devices)
+        policy.set_history(self.history)
+        positions = {d: i for i, d in enumerate(self.devices)}
+        memory = np.array([d.resources["memory"] for d in self.devices], dtype=float)
+        residency = _Residency(len(self.devices), self._home)
+
+        tasks = self.tasks
+        for task in tasks:
+            task.device = task.start_time = task.finish_time = None
+            task.rank = 0.0
+            for d in task.dependencies:
+                if d is None:
+                    raise ValueError("{!r} depends on a task which was not spawned".format(task))
+        if issubclass(scheduler_class, CriticalPathScheduler):
+            # Rank the tasks as the scheduler does when they are spawned.
+            cost_model = TaskCostModel(history=self.history)
+            for task in tasks:
+                cost_model.update_ranks(task)
+        dependents = defaultdict(list)
+        remaining = {}
+        for task in tasks:
+            deps = set(task.dependencies)
+            remaining[task] = len(deps)
+            for d in deps:
+                dependents[d].append(task)
+        # Like the scheduler, only map tasks after their dependencies,
+        # otherwise in spawn order.
+        mapping_order = []
+        unmapped = dict(remaining)
+        mappable = [(t.serial, t) for t in tasks if unmapped[t] == 0]
+        heapq.heapify(mappable)
+        while mappable:
+            _, task = heapq.heappop(mappable)
+            mapping_order.append(task)
+            for dependent in dependents[task]:
+                unmapped[dependent] -= 1
+                if unmapped[dependent] == 0:
+                    heapq.heappush(mappable, (dependent.serial, dependent))
+        if len(mapping_order) < len(tasks):
+            raise ValueError("The dependencies of the tasks form a cycle.")
+
+        queues = [TaskQueue(scheduler_class._task_priority) for _ in self.devices]
+        free_slots = [d.slots for d in self.devices]
+        load = np.zeros(len(self.devices), dtype=np.int64)
+        busy_time = [0.0] * len(self.devices)
+        bytes_moved = [0] * len(self.devices)
+        transfer_times: Dict[SimulatedTask, float] = {}
+        placement_positions = {}
+
+        # (time, sequence number, task): task finishes at time
+        events = []
+        sequence = count()
+        now = 0.0
+        next_to_map = 0
+        in_flight = 0
+
+        def map_task(task):
+            devices = tuple(sorted(task.req.devices, key=positions.get))
+            task_positions = placement_positions.get(devices)
+            if task_positions is None:
+                task_positions = placement_positions[devices] = np.fromiter(
+                    (positions[d] for d in devices), dtype=np.intp)
+            operands = task.dataflow.input + task.dataflow.inout
+            local_data, total_data = residency.local_parray_nbytes(operands, task_positions)
+            view = MappingView(task, devices, local_data, total_data - local_data,
+                               memory[task_positions], load[task_positions], task_positions, residency)
+            device = devices[int(np.argsort(-policy.suitability(view), kind="stable")[0])]
+            position = positions[device]
+            task.device = device
+            task.req = DeviceSetRequirements(task.req.resources, 1, [device], task.req.tags)
+            load[position] += 1
+            policy.task_mapped(task, device, position)
+
+            # Copy the missing operands and update their locations.
+            transfer_time = 0.0
+            for parrays, read, write in ((task.dataflow.input, True, False),
+                                         (task.dataflow.inout, True, True),
+                                         (task.dataflow.output, False, True)):
+                for parray in parrays:
+                    locations = residency._locations(parray)
+                    if read and not locations[position]:
+                        sources = np.flatnonzero(locations)
+                        bandwidth = self._model.bandwidth_matrix[sources, position].max()
+                        transfer_time += parray.nbytes / bandwidth
+                        bytes_moved[position] += parray.nbytes
+                    if write:
+                        locations[:] = False
+                    locations[position] = True
+            transfer_times[task] = transfer_time
+
+        def launch(position):
+            queue = queues[position]
+            while free_slots[position] and len(queue):
+                task = queue.pop()
+                free_slots[position] -= 1
+                task.start_time = now
+                duration = transfer_times[task] + self._execution_time(task, task.device)
+                busy_time[position] += duration
+                heapq.heappush(events, (now + duration, next(sequence), task))
+
+        def make_ready(task):
+            position = positions[task.device]
+            queues[position].push(task)
+
+        while True:
+            while next_to_map < len(tasks) and in_flight < self.mapping_limit:
+                task = mapping_order[next_to_map]
+                map_task(task)
+                next_to_map += 1
+                in_flight += 1
+                if remaining[task] == 0:
+                    make_ready(task)
+            for position in range(len(self.devices)):
+                launch(position)
+            if not events:
+                break
+            now, _, task = heapq.heappop(events)
+            task.finish_time = now
+            position = positions[task.device]
+            free_slots[position] += 1
+            load[position] -= 1
+            in_flight -= 1
+            policy.task_finished(task, self._execution_time(task, task.device))
+            for dependent in dependents[task]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0 and dependent.device is not None:
+                    make_ready(dependent)
+
+        return SimulationReport(now, dict(zip(self.devices, busy_time)),
+                                dict(zip(self.devices, bytes_moved)), list(tasks))
+
+    def __repr__(self):
+        return "Simulator({}, {} tasks)".format(self.devices, len(self.tasks))
@@ -3,19 +3,27 @@ from functools import lru_cache
 import logging
 import random
 from abc import abstractmethod, ABCMeta
+import concurrent.futures
 from collections import deque, namedtuple, defaultdict
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext, ExitStack
 from enum import Enum
 import threading
 import time
-from itertools import combinations
-from typing import Optional, Collection, Union, Dict, List, Any, Tuple, FrozenSet, Iterable, TypeVar, Deque
+import heapq
+import weakref
+import numpy as np
+from itertools import combinations, count
+from typing import Optional, Collection, Union, Dict, List, Any, Tuple, FrozenSet, Iterable, TypeVar, Deque, Callable
 
 # Parla imports
-from parla.device import get_all_devices, Device
+from parla.device import get_all_devices, Device, Architecture
 from parla.environments import EnvironmentComponentInstance, TaskEnvironmentRegistry, TaskEnvironment
 from parla.cpu_impl import cpu
 from parla.dataflow import Dataflow
+from parla.history import TaskHistory, get_task_history
+from parla.mapping import MappingPolicy, MappingView, get_mapping_policy
+from parla import tracing
+from parla.tracing import Tracer, get_tracer, event_recorder
 
 # Logger configuration (uncomment and adjust level if needed)
 #logging.basicConfig(level=logging.DEBUG)
@@ -31,6 +39,17 @@ __all__ = ["Task", "SchedulerContext", "DeviceSetRequirements", "OptionsRequirem
 
 TaskAwaitTasks = namedtuple("AwaitTasks", ("dependencies", "value_task"))
 
+# Serial numbers identify tasks in the records of the event recorder.
+_task_serials = count()
+
+# Ids of the tasks spawned without a TaskID and of the data movement tasks.
+# (next() on a count is atomic in CPython.)
+_anonymous_task_ids = count()
+
+
+def next_anonymous_task_id() -> int:
+    return next(_anonymous_task_ids)
+
 
 class UnspawnedDependencies:
     """ Collection of dependencies where the upstream tasks ("dependencies") are not spawned yet
@@ -59,9 +78,10 @@ class UnspawnedDependencies:
         with self._mutex:
             self._dependencies[dependency].append(dependent)
 
-    def get_dependents(self, tid: 'TaskID') -> List['TaskID']:
+    def pop_dependents(self, tid: 'TaskID') -> List['TaskID']:
+        """Remove and return the dependents waiting for `tid`."""
         with self._mutex:
-            return self._dependencies[tid]
+            return self._dependencies.pop(tid, [])
 
 
 unspawned_dependencies = UnspawnedDependencies()
@@ -156,6 +176,14 @@ class TaskException(TaskState):
 ResourceDict = Dict[str, Union[float, int]]
 
 
+# Event recorder codes of the task states
+_state_events = {
+    TaskRunning: tracing.TASK_RUNNING,
+    TaskCompleted: tracing.TASK_COMPLETED,
+    TaskException: tracing.TASK_EXCEPTION,
+}
+
+
 class ResourceRequirements(object, metaclass=ABCMeta):
     """
     When a task spawns, it has a set of requirements based on parameters
@@ -274,17 +302,27 @@ class Task:
     __slots__ = [
         '_mutex', '_name', '_taskid', '_state', '_dependents', '_dependencies',
         '_req', '_assigned', '_dependent_events', '_num_blocking_dependencies',
-        '__dict__'
+        'priority', 'rank', '_execution_time', 'serial', '__dict__', '__weakref__'
     ]
 
     def __init__(self, dependencies: Collection["Task"], taskid,
                  req: ResourceRequirements, name: Optional[str] = None,
                  init_state: TaskState = TaskWaiting(),
-                 init_assigned: bool = False):
+                 init_assigned: bool = False,
+                 priority: int = 0):
         self._mutex = threading.Lock()
         with self._mutex:
             # This is the name of the task, which is distinct from the TaskID. It inherits its name from the func.
             self._name = name
+            # Ready tasks with a higher priority are launched first.
+            self.priority = priority
+            # The upward rank of the task, i.e. the estimated length of the
+            # longest path from the start of this task to the end of the graph.
+            # It is only maintained by the CriticalPathScheduler.
+            self.rank = 0.0
+            # Wall time of the last execution of the task body in seconds.
+            self._execution_time = None
+            self.serial = next(_task_serials)
             self._dependents: List[Task] = []
             self._taskid = taskid
             self._state = init_state
@@ -353,57 +391,97 @@ class Task:
         """Cleanup works after executing the task."""
         raise NotImplementedError()
 
+    @property
+    def slots(self) -> List[Tuple[Device, str]]:
+        """The concurrency slots (device, kind) the task holds while it runs
+           (see ResourcePool.acquire_slots).
+        """
+        return [(device, "compute") for device in self.req.devices]
+
 
-    def run(self):
+    def run(self, batch: Collection["Task"] = ()):
+        """
+        Run the task, and then the tasks of `batch` (see Scheduler._take_batch),
+        which have the same environment, without leaving it in between.
+        """
+        if not batch:
+            self._run(True)
+            return
+        env = self.req.environment
+        with ExitStack() as env_scope:
+            try:
+                env_scope.enter_context(_scheduler_locals._environment_scope(env))
+                env_scope.enter_context(env)
+            except Exception:
+                env_scope.close()
+                # Let each task handle the failure.
+                for task in (self, *batch):
+                    task._run(True)
+                return
+            for task in (self, *batch):
+                task._run(False)
+
+    def _run(self, enter_environment: bool):
         assert self._assigned, "Task was not assigned before running."
         assert isinstance(self.req, EnvironmentRequirements), \
             "Task was not assigned a specific environment requirement before running."
         try:
-            with self._mutex:
-                # A default state to avoid exceptions during catch
-                task_state = TaskException(RuntimeError("Unknown fatal error"))
-                # Run the task and assign the new task state
-                try:
-                    assert isinstance(self._state, TaskRunning), " Task is not running state: {} on task: {}".format(self._state, self.taskid)
-                    # TODO(lhc): This assumes Parla only has two devices.
-                    #            The reason why I am trying to do is importing
-                    #            Parla's cuda.py is expensive.
-                    #            Whenever we import cuda.py, cupy compilation
-                    #            is invoked. We should remove or avoid that.
-
-                    # First, create device/stream/event instances.
-                    # Second, gets the created event instance.
-                    # Third, it scatters the event to dependents who wait for
-                    # the current task.
-                    env = self.req.environment
-                    with _scheduler_locals._environment_scope(env), env:
-                        events = env.get_events_from_components()
-                        self._wait_for_dependency_events(env)
-                        task_state = self._execute_task()
-                        # Events could be multiple for multiple devices task.
-                        env.record_events()
-                        if len(events) > 0:
-                            # If any event created by the current task exist,
-                            # notify dependents and make them wait for that event,
-                            # not Parla task completion.
-                            if not isinstance(task_state, TaskRunning):
-                                self._notify_dependents(events)
-                        env.sync_events()
-                    task_state = task_state or TaskCompleted(None)
-                except Exception as e:
-                    task_state = TaskException(e)
-                    logger.exception("Exception in task")
-                finally:
-                    logger.info("Finally for task %r", self)
-
-                    ctx = get_scheduler_context()
-
-                    # Regardless of the previous notification,
-                    # (So, before leaving the current run(), the above)
-                    # it should notify dependents since
-                    # new dependents could be added after the above
-                    # notifications, while other devices are running
-                    # their kernels asynchronously.
+            # A default state to avoid exceptions during catch
+            task_state = TaskException(RuntimeError("Unknown fatal error"))
+            start_t = None
+            # Run the task and assign the new task state.
+            # The mutex is not held while the body runs, so that the mapper
+            # and spawning threads can add dependents to the task meanwhile.
+            try:
+                # TODO(lhc): This assumes Parla only has two devices.
+                #            The reason why I am trying to do is importing
+                #            Parla's cuda.py is expensive.
+                #            Whenever we import cuda.py, cupy compilation
+                #            is invoked. We should remove or avoid that.
+
+                # First, create device/stream/event instances.
+                # Second, gets the created event instance.
+                # Third, it scatters the event to dependents who wait for
+                # the current task.
+                env = self.req.environment
+                with (_scheduler_locals._environment_scope(env) if enter_environment else nullcontext()), \
+                        (env if enter_environment else nullcontext()):
+                    events = env.get_events_from_components()
+                    self._wait_for_dependency_events(env)
+                    if event_recorder.enabled:
+                        event_recorder.record(tracing.TASK_START, self.serial)
+                    start_t = time.perf_counter()
+                    task_state = self._execute_task()
+                    self._execution_time = time.perf_counter() - start_t
+                    # Events could be multiple for multiple devices task.
+                    env.record_events()
+                    if len(events) > 0:
+                        # If any event created by the current task exist,
+                        # notify dependents and make them wait for that event,
+                        # not Parla task completion.
+                        if not isinstance(task_state, TaskRunning):
+                            self._notify_dependents_mutex(events)
+                    env.sync_events()
+                task_state = task_state or TaskCompleted(None)
+            except Exception as e:
+                task_state = TaskException(e)
+                logger.exception("Exception in task")
+            finally:
+                if event_recorder.enabled:
+                    event_recorder.record(tracing.TASK_FINISH, self.serial)
+
+                ctx = get_scheduler_context()
+                tracer = ctx.scheduler.tracer
+                if tracer is not None and start_t is not None:
+                    tracer.task_ran(self, start_t, time.perf_counter())
+
+                # Regardless of the previous notification,
+                # (So, before leaving the current run(), the above)
+                # it should notify dependents since
+                # new dependents could be added after the above
+                # notifications, while other devices are running
+                # their kernels asynchronously.
+                with self._mutex:
                     if not isinstance(task_state, TaskRunning):
                         self._notify_dependents()
                     self._set_state(task_state)
@@ -518,15 +596,14 @@ class Task:
             #  be possible to have multiple events)
             if events is not None:
                 self._dependency_events.append(events)
-            logger.info(f"[Task %s] Task dependency completed. \
-                (remaining: %d)", self.name, self._num_blocking_dependencies)
+            if event_recorder.enabled:
+                event_recorder.record(tracing.DEPENDENCY_DONE, self.serial)
             if self._is_schedulable():
                 self._enqueue_to_scheduler()
 
     def _set_state(self, new_state: TaskState):
-        # old_state = self._state
-        logger.info("[Task] %r: %r -> %r", str(self._taskid),
-                    self._state, new_state)
+        if event_recorder.enabled:
+            event_recorder.record(_state_events[type(new_state)], self.serial)
         self._state = new_state
         ctx = get_scheduler_context()
         if isinstance(new_state, TaskException):
@@ -537,6 +614,16 @@ class Task:
                 self._enqueue_to_scheduler()
             new_state.clear_dependencies()
         if new_state.is_terminal:
+            # Drop the references to other tasks, which would keep whole
+            # chains of completed tasks alive: the dependencies, the task
+            # awaited last (see tasks._task_callback) and the dependencies
+            # the TaskID was spawned with. Data movement tasks share the
+            # TaskID of their computation task, which they do not complete.
+            self._dependencies = []
+            self.__dict__.pop("value_task", None)
+            if self._taskid.task is self:
+                self._taskid.dependencies = ()
+                self._taskid._task_completed()
             ctx.decr_active_tasks()
 
     def __await__(self):
@@ -550,17 +637,36 @@ class Task:
 
 class ComputeTask(Task):
     __slots__ = [
-        '_func', '_args', 'events', 'dataflow', 'num_unspawned_dependencies'
+        '_func', '_args', 'events', 'dataflow', 'num_unspawned_dependencies', '_graph_node',
+        'batchable', '_data_accesses', '_operand_moves'
     ]
 
     def __init__(self, func, args, dependencies: Collection["Task"], taskid: 'TaskID',
                  req: ResourceRequirements, dataflow: "Dataflow",
                  name: Optional[str] = None,
-                 num_unspawned_dependencies: int = 0):
+                 num_unspawned_dependencies: int = 0,
+                 priority: int = 0,
+                 graph_node: Optional["GraphNode"] = None,
+                 premapped: bool = False,
+                 batchable: bool = True):
         super(ComputeTask, self).__init__(
-            dependencies, taskid, req, name, init_state=TaskWaiting()
+            dependencies, taskid, req, name, init_state=TaskWaiting(),
+            priority=priority
         )
         with self._mutex:
+            # The record of this task if it is spawned in a capture block
+            # (see parla.tasks.capture). The mapper completes it.
+            self._graph_node = graph_node
+            # Whether the task may run in a batch with similar tasks
+            # (see Scheduler._take_batch).
+            self.batchable = batchable
+            # The keys of the DataAccessRecords which name this task
+            self._data_accesses: List[int] = []
+            # (PArray, OperandType) moved by the task itself (see Scheduler._fold_datamove)
+            self._operand_moves: List[Tuple[Any, OperandType]] = []
+            # The devices of a multi-device task which its operands are moved to,
+            # keyed by PArray ID (see Scheduler._assign_device_set)
+            self._operand_devices: Dict[int, Device] = {}
             # This task could be spawend when it is ready.
             # To set its state Running when it is running later,
             # store functions and arguments as member variables.
@@ -580,7 +686,12 @@ class ComputeTask(Task):
             # If this task is not waiting for any dependent tasks,
             # enqueue onto the spawned queue.
             if self.num_unspawned_dependencies == 0:
-                self._ready_to_map()
+                if premapped:
+                    # The caller maps the task (see Scheduler._replay_task).
+                    self._state = TaskRunning(self._func, self._args, None)
+                    get_scheduler_context().incr_active_tasks()
+                else:
+                    self._ready_to_map()
                 get_scheduler_context().scheduler.incr_active_compute_tasks()
             logger.debug("Task %r: Creating", self)
 
@@ -589,7 +700,7 @@ class ComputeTask(Task):
         PRIVATE USE ONLY. Not thread-safe and should be called WITH ITS MUTEX.
         """
         # Get the list of all waiting dependents from the global collection.
-        dependents = unspawned_dependencies.get_dependents(self.taskid)
+        dependents = unspawned_dependencies.pop_dependents(self.taskid)
         for d_tid in dependents:
             dt = d_tid.task
             assert isinstance(dt, ComputeTask), type(dt)
@@ -612,15 +723,55 @@ class ComputeTask(Task):
                 self._ready_to_map()
 
     def _execute_task(self):
+        if self._operand_moves:
+            self._move_operands()
         return self._state.func(self, *self._state.args)
 
+    def _move_operands(self):
+        for target_data, operand_type in self._operand_moves:
+            target_data._auto_move(device_id=_parray_device_index(self._operand_device(target_data)),
+                                   do_write=operand_type is not OperandType.IN)
+        self._operand_moves = []
+
+    def _operand_device(self, target_data) -> Device:
+        return _operand_device(self.req, self._operand_devices, target_data)
+
+    def _set_state(self, new_state: TaskState):
+        # Replays of a captured task graph need the data accesses of its tasks
+        # (see Scheduler._construct_datamove_task).
+        if new_state.is_terminal and self._data_accesses and self._graph_node is None:
+            get_scheduler_context().scheduler._forget_data_accesses(self)
+        super()._set_state(new_state)
+
+    @property
+    def code(self):
+        """The code object of the body of the task (the function passed to
+           spawn rather than the runtime's callback). Cost models key on it.
+        """
+        for body in (self._args[0] if self._args else None, self._func):
+            code = getattr(body, "__code__", None) or getattr(body, "cr_code", None)
+            if code is not None:
+                return code
+        return self._func
+
     def cleanup(self):
         self._func = None
         self._args = None
         self.dataflow = None
 
     def _finish(self, ctx):
-        # Deallocate resources
+        # Each launch of the task, including those of its continuations,
+        # takes slots and counts as launched (see Scheduler._launch_tasks).
+        for d in self.req.devices:
+            ctx.scheduler.update_launched_task_count_mutex(self, d, -1)
+        ctx.scheduler._available_resources.release_slots(self.slots)
+
+        ctx.scheduler._record_task_duration(self, self._execution_time)
+
+        # A continuation keeps the resources and the operands the task was
+        # mapped with: they are released only once, when the task ends.
+        if not self._state.is_terminal:
+            return
         for d in self.req.devices:
             for resource, amount in self.req.resources.items():
                 logger.debug(
@@ -628,16 +779,15 @@ class ComputeTask(Task):
             ctx.scheduler._available_resources.deallocate_resources(
                 d, self.req.resources)
             ctx.scheduler.update_mapped_task_count_mutex(self, d, -1)
-            ctx.scheduler.update_launched_task_count_mutex(self, d, -1)
-
 
-        # _finish() can be called more than once on global task.
-        if (self.dataflow != None):
-            # Update OUT parrays which may have changed size from 0 to something
-            # We assume all IN and INOUT params don't change size
-            for parray in (self.dataflow.output):
-                ctx.scheduler._available_resources.update_parray_nbytes(
-                    parray, self.req.devices)
+        # Update OUT parrays which may have changed size from 0 to something
+        # We assume all IN and INOUT params don't change size
+        for parray in (self.dataflow.output):
+            ctx.scheduler._available_resources.update_parray_nbytes(
+                parray, [self._operand_device(parray)])
+        for parray in (self.dataflow.input + self.dataflow.inout + self.dataflow.output):
+            ctx.scheduler._available_resources.unpin_parrays(
+                [parray], self._operand_device(parray))
         ctx.scheduler.decr_active_compute_tasks()
         self.cleanup()
 
@@ -648,36 +798,243 @@ class OperandType(Enum):
     INOUT = 2
 
 
+class GraphNode:
+    """The record of a task spawned in a capture block (see parla.tasks.capture):
+       how it was spawned and, once the mapper has mapped it, where it was
+       mapped and which data movement tasks it got.
+    """
+    __slots__ = ["function", "args", "dependencies", "req", "dataflow", "name", "priority", "batchable",
+                 "graph", "task", "rank", "mapped_req", "operand_devices", "datamoves"]
+
+    def __init__(self, function, args, dependencies, req, dataflow, name, priority, batchable,
+                 graph: List["GraphNode"]):
+        self.function = function
+        self.args = args
+        # Tasks and the ids of tasks which were not spawned yet
+        self.dependencies = list(dependencies)
+        self.req = req
+        self.dataflow = dataflow
+        self.name = name
+        self.priority = priority
+        self.batchable = batchable
+        # The nodes of the graph, including this one
+        self.graph = graph
+        # The captured task, until the capture block ends
+        self.task: Optional[ComputeTask] = None
+        self.rank = 0.0
+        # The EnvironmentRequirements the task was mapped to, or None
+        self.mapped_req: Optional[EnvironmentRequirements] = None
+        self.operand_devices: Dict[int, Device] = {}
+        # (target data, operand type, nodes of the graph and whether tasks
+        # outside of it which the data movement waits for)
+        self.datamoves: List[Tuple[Any, OperandType, List["GraphNode"], bool]] = []
+
+    @property
+    def is_mapped(self) -> bool:
+        return self.mapped_req is not None
+
+    def split_dependencies(self, tasks: Iterable[Task]) -> Tuple[List["GraphNode"], bool]:
+        """The nodes of the graph of this node which captured some of `tasks`,
+           and whether the others are outside of the graph. Unlike the tasks,
+           the nodes are not released when the graph is.
+        """
+        internal, external = [], False
+        for task in tasks:
+            node = getattr(task, "_graph_node", None)
+            if node is not None and node.graph is self.graph:
+                internal.append(node)
+            else:
+                external = True
+        return internal, external
+
+
+def _parray_device_index(device: Device) -> int:
+    """The index of `device` in the coherence protocol of PArrays (-1 for the CPU)."""
+    if device.architecture is cpu:
+        return -1
+    return device.index
+
+
+def _operand_device(req: EnvironmentRequirements, operand_devices: Dict[int, Device], target_data) -> Device:
+    """The device of a mapped task which `target_data` is moved to: the one the
+       mapper chose if the task has several devices, or else the first one.
+    """
+    device = operand_devices.get(target_data.parent_ID)
+    if device is None:
+        device = next(iter(req.environment.placement))
+    return device
+
+
+def _move_operands(operands: List[Tuple[Any, "OperandType"]], device_index: int):
+    for target_data, operand_type in operands:
+        target_data._auto_move(device_id=device_index, do_write=operand_type is not OperandType.IN)
+
+
+def _move_operands_in(env: TaskEnvironment, operands: List[Tuple[Any, "OperandType"]], device_index: int):
+    """Move `operands` on a transfer thread, in the environment of their task."""
+    with _scheduler_locals._environment_scope(env), env:
+        _move_operands(operands, device_index)
+
+
+def _evict_parrays(parrays: List[Any], device_index: int):
+    """Drop the copies of `parrays` on a device, writing the last valid ones back to the host."""
+    for parray in parrays:
+        try:
+            parray.evict(device_index, keep_one_copy=True)
+        except Exception:
+            logger.exception("Failed to evict parray with ID %d", parray.parent_ID)
+
+
+class DataAccessRecord:
+    """The tasks which were mapped with a PArray (or a subarray) as an operand
+       and may not have completed: those whose writes are the latest ones and
+       those which read it since. Data movement tasks wait for them (see
+       Scheduler._construct_datamove_task).
+    """
+    __slots__ = ["writers", "readers"]
+
+    def __init__(self):
+        # Dictionaries as ordered sets
+        self.writers: Dict[Task, None] = {}
+        self.readers: Dict[Task, None] = {}
+
+
 class DataMovementTask(Task):
+    """Moves the operands of a computation task to the device it is mapped to
+       (or, for a multi-device task, each to the device the mapper chose for it).
+       Operands of different PArrays are copied in parallel on the transfer
+       threads of the scheduler; those of the same PArray are copied in order.
+       While the task waits for its dependencies, the scheduler may prefetch
+       the operands which are ready (see prefetch).
+    """
     def __init__(self, computation_task: ComputeTask, taskid,
-                 req: ResourceRequirements, target_data,
-                 operand_type: OperandType, name: Optional[str] = None):
+                 req: ResourceRequirements,
+                 operands: List[Tuple[Any, OperandType]], name: Optional[str] = None,
+                 operand_dependencies: Optional[List[List[Task]]] = None,
+                 operand_devices: Optional[Dict[int, Device]] = None,
+                 source_devices: Collection[Device] = ()):
         super(DataMovementTask, self).__init__([], taskid, req, name,
                                                # TODO(lhc): temporary task running state.
                                                #            This would be a data movement kernel.
                                                init_state=TaskRunning(None, None, None),
-                                               init_assigned=True
+                                               init_assigned=True,
+                                               # Data movement is on the path of the
+                                               # computation task, so it is as urgent.
+                                               priority=computation_task.priority
                                                )
+        self.rank = computation_task.rank
         with self._mutex:
             # A data movement task is created after mapping phase.
             # Therefore, this class is already assigned to devices.
-            self._target_data = target_data
-            self._operand_type = operand_type
+            # (PArray, OperandType) in the order of the dataflow
+            self._operands = operands
+            # The tasks each operand waits for if the operands may be
+            # prefetched, or None
+            self._operand_dependencies = operand_dependencies
+            # PArray ID -> (future, device, reserved bytes) of a prefetch
+            self._prefetches: Dict[int, Tuple[concurrent.futures.Future, Device, int]] = {}
+            # See ComputeTask._operand_devices
+            self._operand_devices = operand_devices or {}
+            # The other devices which had copies of the operands when the task was mapped
+            self._source_devices = source_devices
+
+    @property
+    def slots(self) -> List[Tuple[Device, str]]:
+        """A copy_in slot of each device the task moves data to and a
+           copy_out slot of each device it may move the data from.
+        """
+        return [(device, "copy_in") for device in self.req.devices] + \
+            [(device, "copy_out") for device in self._source_devices]
+
+    def _operand_groups(self) -> List[List[int]]:
+        """The indices of the operands by PArray. Each move depends on the coherence
+           state left by the previous moves of the same PArray, so they are moved in order.
+        """
+        groups = {}
+        for i, (target_data, _) in enumerate(self._operands):
+            groups.setdefault(target_data.parent_ID, []).append(i)
+        return list(groups.values())
+
+    def prefetch(self, scheduler: "Scheduler") -> Tuple[bool, bool]:
+        """
+        Start moving the operands of each PArray whose conflicting accesses have
+        all completed, while this task still waits for other dependencies. A move
+        starts only if no data movement task is moving data to the device and the
+        device's prefetch budget allows it (see ResourcePool.reserve_prefetch).
+
+        The moves do not replace the ones of the task, which finds the data in
+        place unless another task moved it since.
+
+        :return: Whether a move started, and whether operands are left to prefetch.
+        """
+        if not self._mutex.acquire(blocking=False):
+            # Another thread is updating the task. Try again on the next pass.
+            return False, True
+        try:
+            if self._operand_dependencies is None or not self.is_blocked_by_dependencies():
+                return False, False
+            started = pending = False
+            for indices in self._operand_groups():
+                key = self._operands[indices[0]][0].parent_ID
+                if key in self._prefetches:
+                    continue
+                if not all(dependency._state.is_terminal
+                           for i in indices for dependency in self._operand_dependencies[i]):
+                    pending = True
+                    continue
+                group = [self._operands[i] for i in indices]
+                device = _operand_device(self.req, self._operand_devices, group[0][0])
+                nbytes = sum(target_data.subarray_nbytes for target_data, _ in group)
+                if not scheduler._available_resources.reserve_prefetch(device, nbytes):
+                    pending = True
+                    break
+                future = scheduler._transfer_pool.submit(
+                    _move_operands_in, self.req.environment, group, _parray_device_index(device))
+                self._prefetches[key] = (future, device, nbytes)
+                started = True
+            if not pending:
+                self._operand_dependencies = None
+            return started, pending
+        finally:
+            self._mutex.release()
 
     def _execute_task(self):
-        write_flag = True
-        if (self._operand_type == OperandType.IN):
-            write_flag = False
-        # Move data to current device
-        dev_type = get_current_devices()[0]
-        dev_no = -1
-        if (dev_type.architecture is not cpu):
-            dev_no = dev_type.index
-        self._target_data._auto_move(device_id=dev_no, do_write=write_flag)
+        groups = [[self._operands[i] for i in indices] for indices in self._operand_groups()]
+        device_indices = [_parray_device_index(_operand_device(self.req, self._operand_devices, group[0][0]))
+                          for group in groups]
+        scheduler = get_scheduler_context().scheduler
+        resources = scheduler._available_resources
+        transfers = scheduler._transfer_pool
+        prefetches = list(self._prefetches.values())
+        self._prefetches = {}
+        futures = []
+        for device in self.req.devices:
+            resources.begin_transfer(device)
+        try:
+            # Failed prefetches are moved again like the others.
+            concurrent.futures.wait([future for future, _, _ in prefetches])
+            if transfers is not None and len(groups) > 1:
+                env = self.req.environment
+                futures = [transfers.submit(_move_operands_in, env, group, dev_no)
+                           for group, dev_no in zip(groups[1:], device_indices[1:])]
+                groups = groups[:1]
+            try:
+                for group, dev_no in zip(groups, device_indices):
+                    _move_operands(group, dev_no)
+            finally:
+                concurrent.futures.wait(futures)
+        finally:
+            for device in self.req.devices:
+                resources.end_transfer(device)
+            for _, device, nbytes in prefetches:
+                resources.release_prefetch(device, nbytes)
+        for future in futures:
+            future.result()
         return TaskCompleted(None)
 
     def cleanup(self):
-        self._target_data = None
+        self._operands = None
+        self._operand_dependencies = None
 
     def _finish(self, ctx):
         # DON'T deallocate resources!
@@ -693,13 +1050,113 @@ class DataMovementTask(Task):
         for d in self.req.devices:
             ctx.scheduler.update_mapped_task_count_mutex(self, d, -1)
             ctx.scheduler.update_launched_task_count_mutex(self, d, -1)
+        ctx.scheduler._available_resources.release_slots(self.slots)
         self.cleanup()
 
 
+# The requirements of tasks which are never mapped (see RangeBarrier)
+_NoRequirements = namedtuple("NoRequirements", ("devices",))
+
+
+class RangeBarrier(Task):
+    """A dependency on all tasks of a range of a dense task space (see
+       RangeCompletion). It is never mapped or run; it completes when the
+       last task of the range does, and releases its dependents.
+    """
+    # Read by the cost models through the dependencies of tasks
+    code = None
+    dataflow = None
+
+    def __init__(self, taskid: "TaskID"):
+        super().__init__([], taskid, _NoRequirements(frozenset()), name=taskid.full_name,
+                         init_state=TaskRunning(None, None, None))
+
+    def complete(self):
+        with self._mutex:
+            self._state = TaskCompleted(None)
+            # Tasks are only mapped once their dependencies are.
+            self._assigned = True
+            self._notify_dependents()
+
+
+class RangeCompletion:
+    """Tracks which indices of a dense task space (see parla.tasks.DenseTaskSpace)
+       have completed tasks, to resolve dependencies on whole ranges of it with
+       a few counters instead of one dependency per task.
+
+       Completed indices are linked to the next index in a union-find forest
+       (with path compression), so the first incomplete index at or after any
+       index is found in nearly constant amortized time. A range waits at its
+       first incomplete index and moves on when the task there completes.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        # All indices below it are complete; they are dropped from _next.
+        self._complete_prefix = 0
+        # Completed index -> a later index (incomplete indices are absent)
+        self._next: Dict[int, int] = {}
+        # Incomplete index -> (barrier, end of its range) waiting at it
+        self._waiters: Dict[int, List[Tuple[RangeBarrier, int]]] = {}
+
+    def _first_incomplete(self, index: int) -> int:
+        nxt = self._next
+        index = max(index, self._complete_prefix)
+        root = index
+        while root in nxt:
+            root = nxt[root]
+        while index != root:
+            nxt[index], index = root, nxt[index]
+        return root
+
+    def barrier(self, taskid: "TaskID", start: int, stop: int) -> Optional[RangeBarrier]:
+        """
+        :return: A task which completes once the tasks of the indices from `start` to `stop`
+                 have completed, or None if they have.
+        """
+        with self._mutex:
+            first = self._first_incomplete(start)
+            if first >= stop:
+                return None
+            barrier = RangeBarrier(taskid)
+            self._waiters.setdefault(first, []).append((barrier, stop))
+        return barrier
+
+    def complete(self, index: int):
+        """Record that the task of `index` completed."""
+        completed = []
+        with self._mutex:
+            if index < self._complete_prefix or index in self._next:
+                return
+            self._next[index] = index + 1
+            waiters = self._waiters.pop(index, None)
+            if waiters:
+                first = self._first_incomplete(index)
+                for barrier, stop in waiters:
+                    if first >= stop:
+                        completed.append(barrier)
+                    else:
+                        self._waiters.setdefault(first, []).append((barrier, stop))
+            if index == self._complete_prefix:
+                end = self._first_incomplete(index)
+                for i in range(index, end):
+                    del self._next[i]
+                self._complete_prefix = end
+        # Notify outside the lock since the dependents take their own mutexes.
+        for barrier in completed:
+            barrier.complete()
+
+    def __repr__(self):
+        return "RangeCompletion(complete below {}, {} more complete)".format(self._complete_prefix, len(self._next))
+
+
 class _TaskLocals(threading.local):
     def __init__(self):
         super(_TaskLocals, self).__init__()
         self.task_scopes: List[List[ComputeTask]] = []
+        self.capture_scopes: List[List[GraphNode]] = []
+        # The tasks spawned by this thread in Scheduler.deferred_spawns, or None
+        self.deferred_spawns: Optional[List[Task]] = None
 
     @property
     def ctx(self):
@@ -709,14 +1166,6 @@ class _TaskLocals(threading.local):
     def ctx(self, v):
         self._ctx = v
 
-    @property
-    def global_tasks(self):
-        return getattr(self, "_global_tasks", [])
-
-    @global_tasks.setter
-    def global_tasks(self, v):
-        self._global_tasks = v
-
 
 task_locals = _TaskLocals()
 
@@ -728,8 +1177,13 @@ class TaskID:
     object is assigned by `spawn`. This can be used in place of the
     task object in most places.
 
+    Once the task completes, the ID only refers to it weakly, so a task
+    space does not keep every completed task (and its result) alive.
+    The ID still stands for a completed task as a dependency.
+
     """
     _task: Optional[Task]
+    _completed_task: Optional[weakref.ref]
     _id: Iterable[int]
 
     def __init__(self, name, id: Iterable[int]):
@@ -737,24 +1191,31 @@ class TaskID:
         self._name = name
         self._id = id
         self._task = None
+        self._completed_task = None
+        self._dependencies = ()
 
     @property
     def task(self):
         """Get the `Task` associated with this ID.
 
-        :raises ValueError: if there is no such task.
+        :return: None if the task is not yet spawned, or if it completed and
+            is no longer referenced elsewhere (see `completed`).
         """
-        if not self._task:
-            # If its task is not yet spawned,
-            # return None.
-            return None
-        return self._task
+        task = self._task
+        if task is None and self._completed_task is not None:
+            task = self._completed_task()
+        return task
 
     @task.setter
     def task(self, v):
         assert not self._task
         self._task = v
 
+    @property
+    def completed(self) -> bool:
+        """Whether the task of this ID reached a terminal state."""
+        return self._completed_task is not None
+
     @property
     def id(self):
         """Get the ID object.
@@ -781,6 +1242,13 @@ class TaskID:
     def dependencies(self, v: Collection):
         self._dependencies = v
 
+    def _task_completed(self):
+        """Called when the task of this ID reaches a terminal state."""
+        # Publish the weak reference before dropping the strong one, so that
+        # a concurrent `task` always finds one of them.
+        self._completed_task = weakref.ref(self._task)
+        self._task = None
+
     def __hash__(self):
         return hash(self._id)
 
@@ -791,7 +1259,11 @@ class TaskID:
         return "<TaskID {}>".format(self.full_name)
 
     def __await__(self):
-        return (yield TaskAwaitTasks([self.task], self.task))
+        task = self.task
+        if task is None and self.completed:
+            # The task completed and was released along with its result.
+            return (yield TaskAwaitTasks([], None))
+        return (yield TaskAwaitTasks([task], task))
 
 
 class InvalidSchedulerAccessException(RuntimeError):
@@ -808,6 +1280,8 @@ class SchedulerContext(metaclass=ABCMeta):
         req,
         dataflow,
         name: Optional[str] = None,
+        priority: int = 0,
+        batchable: bool = True,
     ):
         # _flat_tasks (tasks.py) appends two types of objects to dependencies.
         # If a task corresponding to a task id listed on the dependencies
@@ -829,10 +1303,20 @@ class SchedulerContext(metaclass=ABCMeta):
         num_unspawned_dependencies = len(
             dependencies) - len(spawned_dependencies)
 
-        return ComputeTask(
+        # Record the task in the innermost capture block, if any.
+        graph_node = None
+        if task_locals.capture_scopes:
+            graph = task_locals.capture_scopes[-1]
+            graph_node = GraphNode(function, args, dependencies, req, dataflow, name, priority, batchable, graph)
+            graph.append(graph_node)
+
+        task = ComputeTask(
             function, args, spawned_dependencies, taskid, req, dataflow, name,
-            num_unspawned_dependencies
+            num_unspawned_dependencies, priority, graph_node, batchable=batchable
         )
+        if graph_node is not None:
+            graph_node.task = task
+        return task
 
     @abstractmethod
     def enqueue_task(self, Task):
@@ -952,7 +1436,14 @@ class WorkerThread(ControllableThread, SchedulerContext):
         self.index = index
         self._scheduler = scheduler
         self.task = None
+        # Tasks to run right after the task in the same environment
+        # (see Scheduler._take_batch)
+        self.batch = []
         self._status = "Initializing"
+        # Tasks made ready by the tasks of this worker, in the same order
+        # as the scheduler's queues. Idle workers steal from it.
+        self._local_queue = TaskQueue(scheduler._task_priority)
+        self._local_queue_monitor = threading.Lock()
 
     @property
     def scheduler(self) -> "Scheduler":
@@ -970,25 +1461,51 @@ class WorkerThread(ControllableThread, SchedulerContext):
     def enqueue_task(self, task: Task):
         """Push a task on the queue tail.
         """
-        # For the moment, bypass the local queue and put the task in the global scheduler queue
-        self.scheduler.enqueue_task(task)
-        # Allowing local resource of tasks (probably only when it comes to the front of the queue) would allow threads
-        # to make progress even if the global scheduler is blocked by other assignment tasks. However, it would also
-        # require that the workers do some degree of resource assignment which complicates things and could break
-        # correctness or efficiency guarantees. That said a local, "fast assignment" algorithm to supplement the
-        # out-of-band assignment of the scheduler would probably allow Parla to efficiently run programs with
-        # significantly finer-grained tasks.
+        # Resources of a ready task are already allocated by the mapper, so a
+        # task which can run on any worker does not need the scheduler.
+        # Keep it local to run it right after the current task (or to let an
+        # idle worker steal it); otherwise fail over to the global queue.
+        if self.scheduler._can_launch_locally(task):
+            if self.scheduler.tracer is not None:
+                self.scheduler.tracer.task_stage(task, "schedule")
+            if event_recorder.enabled:
+                event_recorder.record(tracing.SCHEDULE, task.serial)
+            with self._local_queue_monitor:
+                self._local_queue.push(task)
+        else:
+            self.scheduler.enqueue_task(task)
 
-        # For tasks that are already assigned it may be as simple as:
-        #     self._push_task(task)
-        # This would need to fail over to the scheduler level enqueue if the resources is not available for assignment.
+    def _pop_local_task(self) -> Optional[Task]:
+        with self._local_queue_monitor:
+            if len(self._local_queue):
+                return self._local_queue.pop()
+            return None
 
-    def assign_task(self, task: Task):
+    def _next_local_task(self) -> Tuple[Optional[Task], List[Task]]:
+        """Get the next task of this worker, along with a batch of tasks to
+           run after it, or steal one from other workers.
+        """
+        while True:
+            task, batch = None, []
+            with self._local_queue_monitor:
+                if len(self._local_queue):
+                    task = self._local_queue.pop()
+                    if not isinstance(task._state, TaskCompleted):
+                        batch = self.scheduler._take_batch(
+                            task, self._local_queue, len(self.scheduler._free_worker_threads) + 1)
+            if task is None:
+                task = self.scheduler._steal_task(self)
+            # See the comment on completed tasks in Scheduler._launch_task.
+            if task is None or not isinstance(task._state, TaskCompleted):
+                return task, batch
+
+    def assign_task(self, task: Task, batch: List[Task] = ()):
         with self._monitor:
             if self.task:
                 raise WorkerThreadException(
                     "Tried to assign task to WorkerThread that already had one.")
             self.task = task
+            self.batch = batch
             self._monitor.notify()
 
     def _remove_task(self):
@@ -997,39 +1514,54 @@ class WorkerThread(ControllableThread, SchedulerContext):
                 raise WorkerThreadException(
                     "Tried to remove a nonexistent task.")
             self.task = None
+            self.batch = []
 
     def run(self) -> None:
         try:
             with self:
                 for component in self.scheduler.components:
                     component.initialize_thread()
-                self.scheduler.append_free_thread(self)
+                self.scheduler._worker_started(self)
                 while self._should_run:
                     self._status = "Getting Task"
                     with self._monitor:
                         logger.debug(
                             "[%r] Blocking for a task: (%s)", self, self._monitor)
                         if not self.task:
-                            self._monitor.wait()
+                            self._monitor.wait(self.scheduler.idle_timeout)
                         logger.debug(
                             "[WorkerThread %d] Waking up.", self.index)
 
                     # Thread wakes up with a task
                     if self.task:
-                        logger.debug(
-                            f"[WorkerThread %d] Starting: %s", self.index, self.task.name)
-                        self._status = "Running Task {}".format(self.task)
-                        self.task.run()
-                        self.scheduler.decr_running_tasks()
+                        while self.task:
+                            logger.debug(
+                                f"[WorkerThread %d] Starting: %s", self.index, self.task.name)
+                            self._status = "Running Task {}".format(self.task)
+                            self.task.run(self.batch)
+                            self.scheduler.decr_running_tasks(1 + len(self.batch))
+                            self._remove_task()
+                            # Run local or stolen tasks before going back
+                            # to the pool.
+                            task, batch = self._next_local_task()
+                            if task is not None:
+                                self.scheduler._mark_launched(task)
+                                for batched_task in batch:
+                                    self.scheduler._mark_launched(batched_task)
+                                self.assign_task(task, batch)
                         # Free self back to worker pool
-                        self._remove_task()
                         self.scheduler.append_free_thread(self)
                         # Activate scheduler
                         self.scheduler.start_scheduler_callbacks()
-                    # Thread wakes up without a task (should only happen at end of program)
+                    # Thread wakes up without a task after being idle for the
+                    # idle timeout of the scheduler (otherwise, it should only
+                    # happen at end of program)
                     elif not self.task and self._should_run:
-                        raise WorkerThreadException(
-                            "%r woke up without a valid task.", self)
+                        if self.scheduler.idle_timeout is None:
+                            raise WorkerThreadException(
+                                "%r woke up without a valid task.", self)
+                        if self.scheduler._retire_worker(self):
+                            break
         except Exception:
             logger.exception("Unexpected exception in Task handling")
             self.scheduler.stop()
@@ -1041,6 +1573,84 @@ class WorkerThread(ControllableThread, SchedulerContext):
         return "<{} {} {}>".format(type(self).__name__, self.index, self._status)
 
 
+class TaskQueue:
+    """
+    A heap-backed queue of tasks.
+
+    Tasks with a larger key are dequeued first and tasks with equal keys are
+    dequeued in the order they were enqueued.
+    The key is a tuple of numbers computed from the task when it is enqueued,
+    or when the task is re-keyed after its key changed (see `rekey`).
+    This class is not thread-safe; callers hold the lock of the queue.
+    """
+
+    def __init__(self, key: Callable[[Task], Tuple]):
+        self._key = key
+        # [negated key, counter, task] entries. Re-keyed tasks leave stale
+        # entries behind, with the task replaced by None, which are dropped
+        # when they reach the top of the heap.
+        self._heap = []
+        # The current entry of each queued task
+        self._entries: Dict[Task, list] = {}
+        # Breaks ties between equal keys in FIFO order
+        self._counter = count()
+
+    def push(self, task: Task):
+        entry = [tuple(-k for k in self._key(task)), next(self._counter), task]
+        old = self._entries.get(task)
+        if old is not None:
+            old[-1] = None
+        self._entries[task] = entry
+        heapq.heappush(self._heap, entry)
+
+    def rekey(self, task: Task) -> bool:
+        """Move a queued task to the place of its current key.
+
+        :return: False if the task is not in the queue.
+        """
+        entry = self._entries.get(task)
+        if entry is None:
+            return False
+        if entry[0] != tuple(-k for k in self._key(task)):
+            self.push(task)
+            if len(self._heap) > 2 * len(self._entries) + 16:
+                self._heap = [e for e in self._heap if e[-1] is not None]
+                heapq.heapify(self._heap)
+        return True
+
+    def _drop_stale_entries(self):
+        heap = self._heap
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+
+    def pop(self) -> Task:
+        """Remove and return the most urgent task.
+
+        :raises IndexError: if the queue is empty.
+        """
+        self._drop_stale_entries()
+        task = heapq.heappop(self._heap)[-1]
+        del self._entries[task]
+        return task
+
+    def peek(self) -> Task:
+        """Return the most urgent task without removing it.
+
+        :raises IndexError: if the queue is empty.
+        """
+        self._drop_stale_entries()
+        return self._heap[0][-1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (entry[-1] for entry in sorted(self._heap) if entry[-1] is not None)
+
+    def __repr__(self):
+        return "TaskQueue({})".format(list(self))
+
+
 class ParrayTracker():
     """
     The ResourcePool (below) tracks the location of all Parla-managed data,
@@ -1052,48 +1662,176 @@ class ParrayTracker():
     managed by the ResourcePool.
     """
     nbytes: int
-    locations: Dict[Device, bool]
+    # A residency bitmap indexed by the position of devices in the ResourcePool
+    locations: np.ndarray
+    # The bytes of memory allocated for the copy on each device. A copy may
+    # be resident without memory if none was free when it was registered.
+    reserved: np.ndarray
 
-    def __init__(self):
+    def __init__(self, ndevices: int):
         self.nbytes = 0
-        self.locations = {}
+        self.locations = np.zeros(ndevices, dtype=bool)
+        self.reserved = np.zeros(ndevices, dtype=np.int64)
+
+
+class EvictionManager():
+    """
+    Tracks the PArrays the mapper placed on each device, in the order they
+    were last used, and how many mapped or running tasks use each of them
+    (their pins). Copies without pins are the candidates for eviction when
+    the mapper needs memory on a device (see ResourcePool.evict_for).
+
+    Like ParrayTracker, it is managed by the ResourcePool, which holds its
+    monitor while calling it.
+    """
+    # For each device, [parray, pins] keyed by parent_ID, least recently used first
+    _residents: Dict[Device, Dict[int, list]]
+
+    def __init__(self, devices: Iterable[Device]):
+        self._residents = {dev: {} for dev in devices}
+
+    def _touch(self, parray, device) -> list:
+        residents = self._residents[device]
+        entry = residents.pop(parray.parent_ID, None) or [parray, 0]
+        # Prefer the complete array to evict the copy through
+        if parray.ID == parray.parent_ID:
+            entry[0] = parray
+        residents[parray.parent_ID] = entry
+        return entry
+
+    def use(self, parray, device):
+        """A task which uses `parray` was mapped to `device`."""
+        self._touch(parray, device)[1] += 1
+
+    def release(self, parray, device):
+        """A task which used `parray` on `device` finished."""
+        if parray.parent_ID in self._residents[device]:
+            self._touch(parray, device)[1] -= 1
+
+    def discard(self, parray, device):
+        self._residents[device].pop(parray.parent_ID, None)
+
+    def forget(self, parray):
+        for residents in self._residents.values():
+            residents.pop(parray.parent_ID, None)
+
+    def victims(self, device) -> List:
+        """The PArrays on `device` which no mapped or running task uses, least recently used first."""
+        return [parray for parray, pins in self._residents[device].values() if pins == 0]
+
 
+# The kinds of concurrency slots of devices (see ResourcePool.acquire_slots)
+SLOT_KINDS = ("compute", "copy_in", "copy_out")
 
-# Two major TODO (ses) items:
-# 1) Fix the mutexes here. There are places where if the GIL switched, stuff could break
-# 2) Provide a way for the mapper to evict if the resourcepool shows a task can't be mapped anywhere and we need to clear space
+# The slots of the devices of architectures other than the CPU unless the
+# scheduler is configured otherwise: up to 3 computation tasks and 3 data
+# movement tasks in each direction run on such a device at a time. CPU
+# devices have no slots, so only the number of workers bounds their tasks.
+DEFAULT_DEVICE_SLOTS = dict(compute=3, copy_in=3, copy_out=3)
+
+SlotsConfig = Dict[Union[Architecture, Device], Dict[str, Optional[int]]]
+
+# The resource pool stores resource amounts as integers in units of
+# 1 / RESOURCE_SCALE, so fractional amounts (e.g. vcus) which are
+# allocated and deallocated again add up exactly.
+RESOURCE_SCALE = 1 << 16
+
+
+def _to_units(amount: Union[float, int]) -> int:
+    return int(round(amount * RESOURCE_SCALE))
+
+
+# TODO (ses): Fix the mutexes here. There are places where if the GIL switched, stuff could break
 # TODO: Add per-device resource locks (from lhc PR). Assume the # of keys and which keys exist does not change from initialization..?
 class ResourcePool:
     # Importing this at the top of the file breaks due to circular dependencies
     from parla.parray.core import CPU_INDEX, PArray
 
     _monitor: threading.Condition
-    _devices: Dict[Device, Dict[str, float]]
+    _devices: List[Device]
     _device_indices: List[int]
     _managed_parrays: Dict[int, ParrayTracker]
 
     # Resource pools track device resources. Environments are a separate issue and are not tracked here. Instead,
     # tasks will consume resources based on their devices even though those devices are bundled into an environment.
 
-    def __init__(self):
-        self._monitor = threading.Condition(threading.Lock())
-
-        # Devices are stored in a dict keyed by the device.
-        # Each entry stores a dict with cores, memory, etc. info based on the architecture
-        self._devices = self._initial_resources()
+    def __init__(self, slots: Optional[SlotsConfig] = None):
+        """
+        :param slots: The concurrency slots of each kind (see SLOT_KINDS) of the devices of an architecture
+                      or of a single device, which override DEFAULT_DEVICE_SLOTS. None means no limit.
+        """
+        # Reentrant, since evict_for holds it while it removes PArrays from devices
+        self._monitor = threading.Condition(threading.RLock())
+
+        # The cores, memory, etc. of each device based on the architecture
+        initial_resources = self._initial_resources()
+        # and the concurrency slots of each kind which the device limits
+        self._slot_kinds = set()
+        for dev, dres in initial_resources.items():
+            for kind, n in self._initial_slots(dev, slots or {}).items():
+                if n is not None:
+                    dres[kind + "_slots"] = n
+                    self._slot_kinds.add(kind)
+
+        # Devices are numbered, in the order of get_resources(), to index the
+        # resource arrays, the PArray residency bitmaps and the scheduler's
+        # load counters.
+        self._devices = list(initial_resources)
+        self._device_positions = {dev: i for i, dev in enumerate(self._devices)}
+
+        # The resources of all devices are stored in arrays with a row per
+        # device and a column per resource name, in fixed point (see
+        # RESOURCE_SCALE): the capacity of the devices and the amounts which
+        # are not allocated. _provided tells which devices have a resource;
+        # the others have none of it.
+        self._resource_columns = {}
+        for dres in initial_resources.values():
+            for name in dres:
+                self._resource_columns.setdefault(name, len(self._resource_columns))
+        self._memory_column = self._resource_columns.get('memory')
+        shape = (len(self._devices), len(self._resource_columns))
+        self._capacity = np.zeros(shape, dtype=np.int64)
+        self._provided = np.zeros(shape, dtype=bool)
+        for position, dres in enumerate(initial_resources.values()):
+            for name, amount in dres.items():
+                self._capacity[position, self._resource_columns[name]] = _to_units(amount)
+                self._provided[position, self._resource_columns[name]] = True
+        self._available = self._capacity.copy()
 
         self._device_resource_monitor = {dev: threading.Condition(
-            threading.Lock()) for dev in self._devices.keys()}
+            threading.Lock()) for dev in self._devices}
 
         # Parla tracks managed PArrays' locations
         # Index into dict with id(array), then with device. True means the array is present there
         # We use the unique id of the array as the key because PArray is an unhashable class
         self._managed_parrays = {}
+        # The last uses of the PArrays on each device, to pick copies to evict
+        self._eviction = EvictionManager(self._devices)
+        # The executor which writes evicted copies back to the host, or None
+        # to write them back on the thread which evicts them (see evict_for)
+        self.write_back_pool: Optional[concurrent.futures.Executor] = None
+
+        # The bytes of operands which may be prefetched to each device ahead of
+        # their tasks (see DataMovementTask.prefetch), and the bytes in flight.
+        self.prefetch_budget = 0
+        self._prefetched_bytes = {dev: 0 for dev in self._devices}
+        # The number of data movement tasks moving data to each device
+        self._demand_transfers = {dev: 0 for dev in self._devices}
 
     @staticmethod
     def _initial_resources():
         return {dev: {name: amt for name, amt in dev.resources.items()} for dev in get_all_devices()}
 
+    @staticmethod
+    def _initial_slots(dev: Device, slots: SlotsConfig) -> Dict[str, Optional[int]]:
+        dev_slots = dict(DEFAULT_DEVICE_SLOTS) if dev.architecture is not cpu else {}
+        dev_slots.update(slots.get(dev.architecture, {}))
+        dev_slots.update(slots.get(dev, {}))
+        for kind in dev_slots:
+            if kind not in SLOT_KINDS:
+                raise ValueError("Unknown kind of slots {!r} for {!r}; expected one of {}".format(kind, dev, SLOT_KINDS))
+        return dev_slots
+
     ### RESOURCE ALLOCATION CALLS ###
     # These may be over-engineered, by I (Sean) haven't touched them.
     # They basically can add or reduce a resource amount (which is just memory right now)
@@ -1128,92 +1866,204 @@ class ResourcePool:
         :param d: The device on which resources exist.
         :param resources: The resources to deallocate.
         """
-        logger.debug(
-            "[ResourcePool] Acquiring monitor in check_resources_availability()")
+        position = self._device_positions[d]
+        is_available = bool((self._available[position] >= self._resource_units(resources)).all())
+        logger.debug("Resource check for %r on device %r: %s",
+                     resources, d, "Passed" if is_available else "Failed")
+        return is_available
 
-        status = self._device_resource_monitor[d].acquire()
+    def fitting_devices(self, positions: np.ndarray, resources: ResourceDict,
+                        extra_memory: Optional[np.ndarray] = None, *, except_memory: bool = False) -> np.ndarray:
+        """Check which of the devices at `positions` (see device_positions) have
+           `resources` available, in one operation.
 
-        is_available = True
+        :param extra_memory: The bytes of memory which each of the devices needs on top of `resources`.
+        :param except_memory: If True, ignore memory, e.g. to find the devices where
+                              evicting PArrays (see evict_for) may make room for a task.
+        :return: A boolean array, True for the devices which have the resources.
+        """
+        needed = np.broadcast_to(self._resource_units(resources), (len(positions), len(self._resource_columns)))
+        if extra_memory is not None:
+            needed = needed.copy()
+            needed[:, self._memory_column] += np.rint(extra_memory * RESOURCE_SCALE).astype(np.int64)
+        fits = self._available[positions] >= needed
+        if except_memory:
+            fits[:, self._memory_column] = True
+        return fits.all(axis=1)
+
+    def available_resources(self, d: Device) -> ResourceDict:
+        """The amounts of the resources of `d` which are not allocated."""
+        position = self._device_positions[d]
+        return {name: self._available[position, column] / RESOURCE_SCALE
+                for name, column in self._resource_columns.items() if self._provided[position, column]}
+
+    def _resource_units(self, resources: ResourceDict) -> np.ndarray:
+        units = np.zeros(len(self._resource_columns), dtype=np.int64)
         for name, amount in resources.items():
-            dres = self._devices[d]
-
-            if amount > dres[name]:
-                is_available = False
-            logger.debug("Resource check for %d %s on device %r: %s",
-                         amount, name, d, "Passed" if is_available else "Failed")
-        logger.debug(
-            "[ResourcePool] Releasing monitor in check_resources_availability()")
-
-        self._device_resource_monitor[d].release()
-        return is_available
+            try:
+                units[self._resource_columns[name]] = _to_units(amount)
+            except KeyError:
+                raise ValueError("Resource {} does not exist".format(name))
+        return units
 
-    # TODO (wlr): Make this sane. Check before instead of trying and unwinding...
     def _atomically_update_resources(self, d: Device, resources: ResourceDict, multiplier, block: bool):
-        logger.debug(
-            "[ResourcePool] Acquiring monitor in atomically_update_resources()")
-
-        status = self._device_resource_monitor[d].acquire()
-        to_release = []
-        success = True
-        for name, v in resources.items():
-            if not self._update_resource(d, name, v * multiplier, block):
-                success = False
-                break
+        position = self._device_positions[d]
+        units = self._resource_units(resources)
+        missing = (units != 0) & ~self._provided[position]
+        if missing.any():
+            name = next(name for name, column in self._resource_columns.items() if missing[column])
+            raise ValueError("Resource {}.{} does not exist".format(d, name))
+        monitor = self._device_resource_monitor[d]
+        with monitor:
+            if multiplier > 0:
+                self._available[position] += units
+                # The amounts are exact, so this does not drift.
+                assert (self._available[position] <= self._capacity[position]).all(), \
+                    "{} was over deallocated".format(d)
+                monitor.notify_all()
+                success = True
             else:
-                to_release.append((name, v))
-        else:
-            to_release.clear()
+                while True:
+                    success = bool((self._available[position] >= units).all())
+                    if success or not block:
+                        break
+                    logger.info(
+                        "If you're seeing this message, you probably have an issue.")
+                    logger.info(
+                        "The current mapper should never try to allocate resources that aren't actually available")
+                    monitor.wait()
+                if success:
+                    self._available[position] -= units
 
-        logger.info("[ResourcePool] Attempted to allocate %s * %r (blocking %s) => %s",
-                    multiplier, (d, resources), block, "success" if success else "fail")
+            if event_recorder.enabled:
+                event_recorder.record(
+                    (tracing.ALLOCATE if multiplier > 0 else tracing.DEALLOCATE) if success else tracing.ALLOCATE_FAILED,
+                    -1, position)
 
-        if to_release:
-            logger.info(
-                "[ResourcePool] Releasing resources due to failure: %r", to_release)
+        return success
 
-        for name, v in to_release:
-            ret = self._update_resource(d, name, -v * multiplier, block)
-            assert ret
+    ### CONCURRENCY SLOT CALLS ###
+    # A launched task holds slots of its devices until it finishes (see Task.slots),
+    # so a device only runs as many tasks of a kind at a time as it has slots.
 
-        # success implies to_release empty
-        assert not success or len(to_release) == 0
-        logger.debug(
-            "[ResourcePool] Releasing monitor in atomically_update_resources()")
+    def _provides(self, d: Device, name: str) -> bool:
+        column = self._resource_columns.get(name)
+        return column is not None and bool(self._provided[self._device_positions[d], column])
 
-        self._device_resource_monitor[d].release()
+    def limits_slots(self, kind: str) -> bool:
+        """Whether any device has slots of `kind`."""
+        return kind in self._slot_kinds
 
-        return success
+    def limits_any_slot(self, slots: Iterable[Tuple[Device, str]]) -> bool:
+        """Whether the device of any of the (device, kind) slots has slots of that kind."""
+        return any(self._provides(d, kind + "_slots") for d, kind in slots)
 
-    def _update_resource(self, dev: Device, res: str, amount: float, block: bool):
-        # Workaround stupid vcus (I'm getting rid of these at some point)
-        # if dev.architecture.id == 'gpu' and res == 'vcus':
-        #    return True
-        try:
-            while True:  # contains return
-                logger.debug("Trying to allocate %d %s on %r",
-                             amount, res, dev)
-                dres = self._devices[dev]
-                if -amount <= dres[res]:
-                    dres[res] += amount
-                    if amount > 0:
-                        self._device_resource_monitor[dev].notify_all()
-                    # TODO: Temporarily remove assertions due to floating point problems (need to fix VCU implementation)
-                    # assert dres[res] <= dev.resources[res], "{}.{} was over deallocated".format(
-                    #    dev, res)
-                    # assert dres[res] >= 0, "{}.{} was over allocated".format(
-                    #    dev, res)
-                    return True
-                else:
-                    logger.info(
-                        "If you're seeing this message, you probably have an issue.")
-                    logger.info(
-                        "The current mapper should never try to allocate resources that aren't actually available")
-                    if block:
-                        self._device_resource_monitor[dev].wait()
-                    else:
-                        return False
-        except KeyError:
-            raise ValueError("Resource {}.{} does not exist".format(dev, res))
+    def acquire_slots(self, slots: Iterable[Tuple[Device, str]]) -> bool:
+        """Allocate the (device, kind) slots which the devices limit, all or none.
+
+        :return: True iff the slots were free.
+        """
+        slots = [(d, {kind + "_slots": 1}) for d, kind in slots if self._provides(d, kind + "_slots")]
+        if not all(self.check_resources_availability(d, slot) for d, slot in slots):
+            return False
+        for i, (d, slot) in enumerate(slots):
+            if not self.allocate_resources(d, slot):
+                for d, slot in slots[:i]:
+                    self.deallocate_resources(d, slot)
+                return False
+        return True
+
+    def release_slots(self, slots: Iterable[Tuple[Device, str]]):
+        for d, kind in slots:
+            if self._provides(d, kind + "_slots"):
+                self.deallocate_resources(d, {kind + "_slots": 1})
+
+    ### PREFETCH TRACKING CALLS ###
+
+    def reserve_prefetch(self, device: Device, nbytes: int) -> bool:
+        """Reserve `nbytes` of the prefetch budget of `device`.
+
+        :return: False if the budget does not allow it or data movement tasks are
+                 moving data to the device, which have priority; True otherwise.
+        """
+        with self._monitor:
+            if self._demand_transfers[device] > 0 or \
+                    self._prefetched_bytes[device] + nbytes > self.prefetch_budget:
+                return False
+            self._prefetched_bytes[device] += nbytes
+            return True
+
+    def release_prefetch(self, device: Device, nbytes: int):
+        with self._monitor:
+            self._prefetched_bytes[device] -= nbytes
+
+    def begin_transfer(self, device: Device):
+        with self._monitor:
+            self._demand_transfers[device] += 1
+
+    def end_transfer(self, device: Device):
+        with self._monitor:
+            self._demand_transfers[device] -= 1
+
+    ### EVICTION CALLS ###
+
+    def pin_parrays(self, parrays, device: Device):
+        """Keep `parrays` on `device` for a task mapped there until `unpin_parrays`."""
+        with self._monitor:
+            for parray in parrays:
+                self._eviction.use(parray, device)
+
+    def unpin_parrays(self, parrays, device: Device):
+        with self._monitor:
+            for parray in parrays:
+                self._eviction.release(parray, device)
+
+    def evict_for(self, device: Device, nbytes: int) -> bool:
+        """Evict copies of PArrays which no mapped or running task uses from
+           `device` until `nbytes` of its memory are free. Copies which are
+           also valid on the host go first, since they need no write back,
+           then the others, least recently used first.
+
+           The copies are chosen and their memory is freed at once. Modified
+           copies are written back to the host afterwards, on write_back_pool
+           if it is set, and the copies are dropped from the device then.
+
+        :return: True iff `nbytes` of memory are free on the device.
+        """
+        position = self._device_positions[device]
+        needed = _to_units(nbytes)
+        if self._available[position, self._memory_column] >= needed:
+            return True
+        # Evicted copies are written back to the host, so host copies cannot be spilled.
+        if device.architecture == cpu:
+            return False
+        device_id = self._to_parray_index(device)
+        # Choose the victims and free their memory under the monitor, so that
+        # concurrent calls neither pick the same copies nor pin them meanwhile.
+        evicted = []
+        with self._monitor:
+            victims = [parray for parray in self._eviction.victims(device)
+                       if self._managed_parrays[parray.parent_ID].locations[position]]
+            victims.sort(key=lambda parray: not parray._is_current_on(self.CPU_INDEX))
+            if self._available[position, self._memory_column] + \
+                    sum(_to_units(self._managed_parrays[parray.parent_ID].reserved[position])
+                        for parray in victims) < needed:
+                return False
+            for parray in victims:
+                if self._available[position, self._memory_column] >= needed:
+                    break
+                logger.debug("[ResourcePool] Evicting parray with ID %d from device %r", parray.parent_ID, device)
+                self.remove_parray_from_device(parray, device)
+                self._eviction.discard(parray, device)
+                evicted.append(parray)
+            # Allocations which do not evict may have taken the memory meanwhile.
+            enough = self._available[position, self._memory_column] >= needed
+        # Copying to the host takes long, so it is done without the monitor.
+        if self.write_back_pool is not None:
+            self.write_back_pool.submit(_evict_parrays, evicted, device_id)
+        else:
+            _evict_parrays(evicted, device_id)
+        return enough
 
     ### PARRAY MEMORY TRACKING CALLS ###
 
@@ -1233,23 +2083,22 @@ class ResourcePool:
         logger.debug(
             f"[ResourcePool] Tracking parray with ID %d in these locations:", parray.parent_ID)
 
-        parray_tracker = ParrayTracker()
+        parray_tracker = ParrayTracker(len(self._devices))
         parray_tracker.nbytes = parray.nbytes  # maxium bytes
 
         # Figure out all the locations where a parray exists
         for device in self._devices:
             device_id = self._to_parray_index(device)
             if parray.exists_on_device(device_id):
-                parray_tracker.locations[device] = True
+                parray_tracker.locations[self._device_positions[device]] = True
 
                 logger.debug(f"[ResourcePool]   - %r", device)
 
                 # Update the resource usage at this location
                 # subarrays has smaller size
-                self.allocate_resources(
-                    device, {'memory': parray.nbytes_at(device_id)})
-            else:
-                parray_tracker.locations[device] = False
+                nbytes = parray.nbytes_at(device_id)
+                if self.allocate_resources(device, {'memory': nbytes}):
+                    parray_tracker.reserved[self._device_positions[device]] = nbytes
 
         # Insert the location map into our dict, keyed by the parray itself
         logger.debug("[ResourcePool] Acquiring monitor in track_parray()")
@@ -1262,17 +2111,17 @@ class ResourcePool:
         logger.debug(
             f"[ResourcePool] Untracking parray with ID %d from these locations:", parray.parent_ID)
         # Return resources to the devices
-        for device, parray_exists in self._managed_parrays[parray.parent_ID].items():
-            if parray_exists:
-                parray_tracker = self._managed_parrays[parray.parent_ID]
-                self.deallocate_resources(
-                    device, {'memory': parray_tracker.nbytes_at(self._to_parray_index(device))})
+        parray_tracker = self._managed_parrays[parray.parent_ID]
+        for device, position in self._device_positions.items():
+            if parray_tracker.reserved[position]:
+                self.deallocate_resources(device, {'memory': parray_tracker.reserved[position]})
                 logger.debug(f"[ResourcePool]   - %r", device)
 
         # Delete the dictionary entry
         logger.debug("[ResourcePool] Acquiring monitor in untrack_parray()")
         with self._monitor:
             del self._managed_parrays[parray.parent_ID]
+            self._eviction.forget(parray)
             logger.debug(
                 "[ResourcePool] Releasing monitor in untrack_parray()")
 
@@ -1280,42 +2129,55 @@ class ResourcePool:
     def add_parray_to_device(self, parray, device):
         logger.debug(
             f"[ResourcePool] Adding parray with ID %d to device %r", parray.parent_ID, device)
-        if self._managed_parrays[parray.parent_ID].locations[device] == True:
+        position = self._device_positions[device]
+        if self._managed_parrays[parray.parent_ID].locations[position]:
             # raise ValueError("Tried to register a parray on a device where it already existed")
             logger.debug(f"[ResourcePool]   (It was already there...)")
             return
+        nbytes = parray.nbytes_at(self._to_parray_index(device))
+        allocated = self.allocate_resources(device, {'memory': nbytes}) or \
+            (self.evict_for(device, nbytes) and self.allocate_resources(device, {'memory': nbytes}))
+        if not allocated:
+            # The move happens anyway. Its memory is not counted, and so not
+            # given back when the copy is removed.
+            logger.debug("[ResourcePool] No memory for parray with ID %d on device %r",
+                         parray.parent_ID, device)
         logger.debug(
             "[ResourcePool] Acquiring monitor in add_parray_to_device()")
         with self._monitor:
-            self._managed_parrays[parray.parent_ID].locations[device] = True
+            parray_tracker = self._managed_parrays[parray.parent_ID]
+            parray_tracker.locations[position] = True
+            parray_tracker.reserved[position] = nbytes if allocated else 0
             logger.debug(
                 "[ResourcePool] Releasing monitor in add_parray_to_device()")
-        self.allocate_resources(
-            device, {'memory': parray.nbytes_at(self._to_parray_index(device))})
 
     # Notify the resource pool that an instantiation of an array has been deleted
     def remove_parray_from_device(self, parray, device):
         logger.debug(
             f"[ResourcePool] Removing parray with ID %d from device %r", parray.parent_ID, device)
-        if self._managed_parrays[parray.parent_ID].locations[device] == False:
+        position = self._device_positions[device]
+        if not self._managed_parrays[parray.parent_ID].locations[position]:
             # raise ValueError("Tried to remove a parray from a device where it didn't exist")
             logger.debug(f"[ResourcePool]   (It wasn't there...)")
             return
         logger.debug(
             "[ResourcePool] Acquiring monitor in remove_parray_from_device()")
         with self._monitor:
-            self._managed_parrays[parray.parent_ID].locations[device] = False
+            parray_tracker = self._managed_parrays[parray.parent_ID]
+            parray_tracker.locations[position] = False
+            reserved = parray_tracker.reserved[position]
+            parray_tracker.reserved[position] = 0
             logger.debug(
                 "[ResourcePool] Releasing monitor in remove_parray_from_device()")
-        self.deallocate_resources(
-            device, {'memory': parray.nbytes_at(self._to_parray_index(device))})
+        if reserved:
+            self.deallocate_resources(device, {'memory': reserved})
 
     # On a parray move, call this to start tracking the parray (if necessary) and update its location
     def register_parray_move(self, parray, device):
         if parray.parent_ID not in self._managed_parrays:
             self.track_parray(parray)
             # If this new array originates on the dest device, skip the next step
-            if self._managed_parrays[parray.parent_ID].locations[device]:
+            if self._managed_parrays[parray.parent_ID].locations[self._device_positions[device]]:
                 return
         self.add_parray_to_device(parray, device)
 
@@ -1323,12 +2185,54 @@ class ResourcePool:
         logger.debug(
             "[ResourcePool] Acquiring monitor in parray_is_on_device()")
         with self._monitor:
-            ret_bool = (parray.parent_ID in self._managed_parrays) and (
-                self._managed_parrays[parray.parent_ID].locations[device])
+            ret_bool = (parray.parent_ID in self._managed_parrays) and bool(
+                self._managed_parrays[parray.parent_ID].locations[self._device_positions[device]])
             logger.debug(
                 "[ResourcePool] Releasing monitor in parray_is_on_device()")
             return ret_bool
 
+    def local_parray_nbytes(self, parrays, positions: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Compute how many bytes of `parrays` are on each of the devices
+           at `positions` (see device_positions).
+
+        :return: The local bytes for each device and the total bytes.
+        """
+        local = np.zeros(len(positions))
+        total = 0
+        with self._monitor:
+            for parray in parrays:
+                nbytes = parray.nbytes
+                total += nbytes
+                parray_tracker = self._managed_parrays.get(parray.parent_ID)
+                if parray_tracker is not None:
+                    local += parray_tracker.locations[positions] * nbytes
+        return local, total
+
+    def parray_locations(self, parrays) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """The size of each of `parrays` and a copy of its residency bitmap,
+           or None if it is not tracked.
+        """
+        with self._monitor:
+            locations = []
+            for parray in parrays:
+                parray_tracker = self._managed_parrays.get(parray.parent_ID)
+                locations.append((parray.nbytes,
+                                  None if parray_tracker is None else parray_tracker.locations.copy()))
+            return locations
+
+    def parray_holders(self, parrays, exclude: Collection[Device]) -> List[Device]:
+        """The devices other than `exclude` where any of `parrays` is."""
+        held = np.zeros(len(self._devices), dtype=bool)
+        with self._monitor:
+            for parray in parrays:
+                parray_tracker = self._managed_parrays.get(parray.parent_ID)
+                if parray_tracker is not None:
+                    held |= parray_tracker.locations
+        return [dev for dev, position in self._device_positions.items() if held[position] and dev not in exclude]
+
+    def device_positions(self, devices: Iterable[Device]) -> np.ndarray:
+        return np.fromiter((self._device_positions[d] for d in devices), dtype=np.intp)
+
     def update_parray_nbytes(self, parray, devices):
         parray_tracker = self._managed_parrays[parray.parent_ID]
         if parray_tracker.nbytes == 0:
@@ -1342,14 +2246,16 @@ class ResourcePool:
             # This assumes the parray is valid on every the device ran on
             # TODO: Revisit this when we actually support multidevice
             for device in devices:
-                self.allocate_resources(
-                    device, {'memory': parray.nbytes_at(self._to_parray_index(device))})
+                nbytes = parray.nbytes_at(self._to_parray_index(device))
+                if self.allocate_resources(device, {'memory': nbytes}):
+                    with self._monitor:
+                        parray_tracker.reserved[self._device_positions[device]] += nbytes
 
     def __repr__(self):
-        return "ResourcePool(devices={})".format(self._devices)
+        return "ResourcePool(devices={})".format({dev: self.available_resources(dev) for dev in self._devices})
 
     def get_resources(self):
-        return [dev for dev in self._devices]
+        return list(self._devices)
 
 
 class AssignmentFailed(Exception):
@@ -1376,18 +2282,29 @@ class Scheduler(ControllableThread, SchedulerContext):
     _device_mapped_datamove_task_counts: Dict[Device, int]
     _device_launched_compute_task_counts: Dict[Device, int]
     _device_launched_datamove_task_counts: Dict[Device, int]
-    _num_colocatable_tasks: int
-    period: float
-
-    def __init__(self, environments: Collection[TaskEnvironment], n_threads: Optional[int] = None, period: float = 1.4012985e-20):
+    period: Optional[float]
+
+    def __init__(self, environments: Collection[TaskEnvironment], n_threads: Optional[int] = None, period: Optional[float] = None,
+                 work_stealing: bool = True, policy: Union[str, MappingPolicy, None] = None,
+                 history: Union[str, TaskHistory, None] = None,
+                 trace: Union[str, Tracer, None] = None,
+                 max_batch_size: int = 1, transfer_threads: int = 4, prefetch_budget: int = 0,
+                 slots: Optional[SlotsConfig] = None, min_threads: int = 1, idle_timeout: Optional[float] = 5.0):
         # ControllableThread: __init__ sets it to run
         # SchedulerContext: No __init__
         super().__init__()
 
-        # TODO(lhc): for now, assume that n_threads is always None.
-        #            Each device needs a dedicated thread.
-        n_threads = int(sum(d.resources.get("cores", 1)
-                            for e in environments for d in e.placement))
+        # The worker pool starts with min_threads workers and grows up to
+        # n_threads workers (by default, one per core of the devices) while
+        # ready tasks wait for workers. Workers which stay idle for
+        # idle_timeout seconds retire until min_threads are left.
+        # None keeps idle workers.
+        if n_threads is None:
+            n_threads = int(sum(d.resources.get("cores", 1)
+                                for e in environments for d in e.placement))
+        self.max_threads = n_threads
+        self.min_threads = max(1, min(min_threads, n_threads))
+        self.idle_timeout = idle_timeout
 
         self._environments = TaskEnvironmentRegistry(*environments)
 
@@ -1403,20 +2320,61 @@ class Scheduler(ControllableThread, SchedulerContext):
         # For load-balancing purposes
         self._active_compute_task_count = 0
 
-        # Period scheduler sleeps between loops (see run function)
+        # The longest time the scheduler thread sleeps without being woken up
+        # before it runs its phases again (see run function).
+        # None means that it only wakes up on scheduler events.
         self.period = period
 
-        # The number of tasks allowed to be colocated (= 2)
-        self._num_colocatable_tasks = 2
+        # Execution times of earlier runs (see parla.history), or None
+        self.task_history = get_task_history(history)
+
+        # Records a timeline of the tasks and phases (see parla.tracing), or None
+        self.tracer = get_tracer(trace)
+
+        # Scores the candidate devices of tasks (see parla.mapping)
+        self.policy = get_mapping_policy(policy)
+        self.policy.set_history(self.task_history)
+
+        # If true, workers run the CPU tasks made ready by their own tasks
+        # and steal them from each other, bypassing the scheduler thread.
+        self.work_stealing = work_stealing
+
+        # The largest number of ready tasks with the same body and environment
+        # which a worker runs back-to-back in one launch (see _take_batch).
+        # 1 disables batching.
+        self.max_batch_size = max_batch_size
+
+        # The threads which copy the operands of data movement tasks in
+        # parallel (see DataMovementTask), or None to copy them in order.
+        self._transfer_pool = concurrent.futures.ThreadPoolExecutor(
+            transfer_threads, thread_name_prefix="parla-transfer") if transfer_threads > 0 else None
 
-        # Track, allocate, and deallocate resources (devices)
-        self._available_resources = ResourcePool()
+        # Track, allocate, and deallocate resources (devices), including the
+        # concurrency slots which bound the tasks running on each device,
+        # e.g. slots={gpu: dict(compute=4, copy_in=2), gpu(1): dict(copy_out=1)}
+        self._available_resources = ResourcePool(slots)
+
+        # The bytes of operands per device which may be moved ahead of their
+        # tasks, while the tasks wait for other dependencies. 0 disables
+        # prefetching. The data movement tasks which may prefetch are queued
+        # here (see DataMovementTask.prefetch).
+        self._available_resources.prefetch_budget = prefetch_budget if self._transfer_pool is not None else 0
+        # Write evicted copies back on the transfer threads, rather than on the mapper.
+        self._available_resources.write_back_pool = self._transfer_pool
+        self._prefetch_candidates: Deque[DataMovementTask] = deque()
 
         # All of the mutexs needed in the scheduler
 
         # Class level mutex for the scheduler
         self._monitor = threading.Condition(threading.Lock())
 
+        # The scheduler thread sleeps on this condition until a task is
+        # spawned, a task becomes ready, or a worker thread becomes free.
+        # The flag records wakeups which happen while the thread is busy
+        # so that none of them is lost.
+        self._wakeup_monitor = threading.Condition(threading.Lock())
+        self._wakeup_pending = False
+
         # Queue protection
 
         self._spawned_queue_monitor = threading.Condition(threading.Lock())
@@ -1442,6 +2400,7 @@ class Scheduler(ControllableThread, SchedulerContext):
         self._mapping_phase_monitor = threading.Condition(threading.Lock())
         self._scheduling_phase_monitor = threading.Condition(threading.Lock())
         self._launching_phase_monitor = threading.Condition(threading.Lock())
+        self._prefetching_phase_monitor = threading.Lock()
 
         # Spawned task queues
         # Tasks that have been spawned but not mapped are stored here.
@@ -1459,13 +2418,14 @@ class Scheduler(ControllableThread, SchedulerContext):
 
         # This is where tasks go when they have been mapped and their
         # dependencies are complete, but they have not been scheduled.
-        self._ready_queue = deque()
+        # This and the device queues are ordered by _task_priority.
+        self._ready_queue = TaskQueue(self._task_priority)
 
         # The device queues where scheduled tasks go to be launched from
         self._compute_task_dev_queues = {
-            dev: deque() for dev in self._available_resources.get_resources()}
+            dev: TaskQueue(self._task_priority) for dev in self._available_resources.get_resources()}
         self._datamove_task_dev_queues = {
-            dev: deque() for dev in self._available_resources.get_resources()}
+            dev: TaskQueue(self._task_priority) for dev in self._available_resources.get_resources()}
 # self._datamove_task_to_dev_queues = {dev: deque() for dev in self._available_resources.get_resources()}
 # self._datamove_task_from_dev_queues = {dev: deque() for dev in self._available_resources.get_resources()}
 
@@ -1479,21 +2439,39 @@ class Scheduler(ControllableThread, SchedulerContext):
         self._device_launched_datamove_task_counts = {
             dev: 0 for dev in self._available_resources.get_resources()}
 
-        # Dictionary mapping data block to task lists.
-        self._datablock_dict = defaultdict(list)
+        # The mapper's view of the devices, indexed by the device positions
+        # of the resource pool: the number of mapped (compute and data
+        # movement) tasks, and the memory size used to normalize data sizes.
+        devices = self._available_resources.get_resources()
+        self._device_positions = {dev: i for i, dev in enumerate(devices)}
+        self._mapped_task_loads = np.zeros(len(devices), dtype=np.int64)
+        self._device_memory = np.array(
+            [dev.resources['memory'] for dev in devices], dtype=float)
+        # Placement (a frozenset of devices) -> (devices, device positions)
+        self._placement_positions = {}
+        # (devices, ndevices, tags) -> the candidate environments of multi-device tasks
+        self._device_set_environments = {}
+        self.policy.set_devices(devices)
+
+        # PArray or subarray ID -> the tasks accessing it
+        self._access_records: Dict[int, DataAccessRecord] = {}
+        self._access_records_mutex = threading.Lock()
 
         self._free_worker_threads = deque()
-        self._worker_threads = [WorkerThread(
-            self, i) for i in range(n_threads)]
-        for t in self._worker_threads:
-            t.start()
+        # The list is replaced rather than modified when workers are added or
+        # retire, so that it can be iterated over without the pool monitor.
+        self._worker_threads = []
+        self._worker_pool_monitor = threading.Lock()
+        self._worker_indices = count()
+        # The number of workers which are initializing
+        self._starting_worker_count = 0
+        self._add_worker_threads(self.min_threads)
         # Before starting a scheduler thread,
         # any free thread should be appended.
         # Otherwise, no work is proceeded.
-        while True:
-            with self._thread_queue_monitor:
-                if len(self._free_worker_threads) > 0:
-                    break
+        with self._thread_queue_monitor:
+            while len(self._free_worker_threads) == 0:
+                self._thread_queue_monitor.wait()
         # Start the scheduler thread (likely to change later)
         self.start()
 
@@ -1521,21 +2499,87 @@ class Scheduler(ControllableThread, SchedulerContext):
         for t in self._worker_threads:
             # t.stop() # This is needed to gracefully end the threads without throwing missing task exceptions
             t.join()  # This is what actually rejoins the threads
+        if self._transfer_pool is not None:
+            self._transfer_pool.shutdown()
+        if self.task_history is not None and self.task_history.path is not None:
+            try:
+                self.task_history.save()
+            except OSError as e:
+                logger.warning("Failed to save the task history: %s", e)
+        if self.tracer is not None and self.tracer.path is not None:
+            try:
+                self.tracer.save()
+            except OSError as e:
+                logger.warning("Failed to save the trace: %s", e)
         if self._exceptions:
             # TODO: Should combine all of them into a single exception.
             raise self._exceptions[0]
 
+    def has_idle_workers(self) -> bool:
+        """Whether a worker thread is waiting for a task."""
+        with self._thread_queue_monitor:
+            return len(self._free_worker_threads) > 0
+
     def append_free_thread(self, thread: WorkerThread):
         with self._thread_queue_monitor:
             self._free_worker_threads.append(thread)
+            self._thread_queue_monitor.notify_all()
+        self.wake_scheduler()
+
+    def _add_worker_threads(self, waiting: int) -> int:
+        """Start workers for `waiting` ready tasks, counting the workers which
+           are initializing, up to max_threads workers.
+
+        :return: The number of workers started.
+        """
+        with self._worker_pool_monitor:
+            n = min(waiting - self._starting_worker_count, self.max_threads - len(self._worker_threads))
+            if n <= 0 or not self._should_run:
+                return 0
+            workers = [WorkerThread(self, next(self._worker_indices)) for _ in range(n)]
+            self._starting_worker_count += n
+            self._worker_threads = self._worker_threads + workers
+            for t in workers:
+                t.start()
+        logger.debug("[Scheduler] Started %d workers for %d waiting tasks.", n, waiting)
+        return n
+
+    def _worker_started(self, thread: WorkerThread):
+        with self._worker_pool_monitor:
+            self._starting_worker_count -= 1
+        self.append_free_thread(thread)
+
+    def _retire_worker(self, thread: WorkerThread) -> bool:
+        """Remove an idle worker from the pool unless only min_threads workers are left.
+
+        :return: True if the worker was removed and should exit.
+        """
+        with self._worker_pool_monitor:
+            with self._thread_queue_monitor:
+                # A worker which is not free has just been given a task.
+                if len(self._worker_threads) <= self.min_threads or \
+                        thread not in self._free_worker_threads or len(thread._local_queue):
+                    return False
+                self._free_worker_threads.remove(thread)
+            self._worker_threads = [t for t in self._worker_threads if t is not thread]
+        logger.debug("[Scheduler] Retired %r.", thread)
+        return True
+
+    def wake_scheduler(self):
+        """Wake up the scheduler thread to run the mapping, scheduling
+           and launching phases.
+        """
+        with self._wakeup_monitor:
+            self._wakeup_pending = True
+            self._wakeup_monitor.notify()
 
     def incr_running_tasks(self):
         with self._running_count_monitor:
             self._running_task_count += 1
 
-    def decr_running_tasks(self):
+    def decr_running_tasks(self, count: int = 1):
         with self._running_count_monitor:
-            self._running_task_count -= 1
+            self._running_task_count -= count
 
     def no_running_tasks(self):
         with self._running_count_monitor:
@@ -1571,6 +2615,40 @@ class Scheduler(ControllableThread, SchedulerContext):
            Scheduler iterates the queue and assigns resources
            regardless of remaining dependencies.
         """
+        if self.tracer is not None:
+            self.tracer.task_stage(task, "spawn")
+        deferred = task_locals.deferred_spawns
+        if deferred is not None:
+            deferred.append(task)
+            return
+        self._requeue_spawned_task(task)
+        self.wake_scheduler()
+
+    @contextmanager
+    def deferred_spawns(self):
+        """Hold back the tasks spawned by the calling thread in the body of
+           the `with` and enqueue them all at once at its end, so that the
+           scheduler is not woken up for every task of a bulk spawn
+           (see parla.tasks.parallel_for).
+        """
+        if task_locals.deferred_spawns is not None:
+            yield
+            return
+        deferred = task_locals.deferred_spawns = []
+        try:
+            yield
+        finally:
+            task_locals.deferred_spawns = None
+            if deferred:
+                with self._spawned_queue_monitor:
+                    self._new_spawned_task_queue.extendleft(deferred)
+                self.wake_scheduler()
+
+    def _requeue_spawned_task(self, task: Task):
+        """Put a task back on the spawned task queue without waking
+           up the scheduler, e.g. after it failed to be mapped.
+           The scheduler retries it on the next event.
+        """
         with self._spawned_queue_monitor:
             self._new_spawned_task_queue.appendleft(task)
 
@@ -1592,7 +2670,8 @@ class Scheduler(ControllableThread, SchedulerContext):
         """
         assert task._assigned
         with self._ready_queue_monitor:
-            self._ready_queue.appendleft(task)
+            self._ready_queue.push(task)
+        self.wake_scheduler()
 
     def _dequeue_task(self, timeout=None) -> Optional[Task]:
         """Dequeue a task from the resource allocation queue.
@@ -1611,14 +2690,99 @@ class Scheduler(ControllableThread, SchedulerContext):
                     # Keep proceeding the next step.
                     return None
 
+    def _can_launch_locally(self, task: Task) -> bool:
+        """Whether a ready task can be pushed on the local queue of a worker.
+           Only CPU tasks whose devices have no slots qualify since they are
+           not bound by the launch limits of devices. The scheduler launches
+           it instead if a worker is free right now or the worker pool can
+           grow to run it.
+        """
+        return self.work_stealing and \
+            isinstance(task.req, EnvironmentRequirements) and \
+            all(d.architecture.id == "cpu" for d in task.req.devices) and \
+            not self._available_resources.limits_any_slot(task.slots) and \
+            len(self._free_worker_threads) == 0 and \
+            len(self._worker_threads) >= self.max_threads
+
+    def _steal_task(self, thief: Optional[WorkerThread] = None) -> Optional[Task]:
+        """Steal the most urgent task from the local queue of another worker.
+        """
+        if not self.work_stealing:
+            return None
+        n = len(self._worker_threads)
+        start = thief.index + 1 if thief is not None else 0
+        for i in range(n):
+            victim = self._worker_threads[(start + i) % n]
+            if victim is thief:
+                continue
+            task = victim._pop_local_task()
+            if task is not None:
+                logger.debug("[Scheduler] %r stole %r from %r", thief, task, victim)
+                return task
+        return None
+
+    def _mark_launched(self, task: Task):
+        if self.tracer is not None:
+            self.tracer.task_stage(task, "launch")
+        self.incr_running_tasks()
+        for dev in task.req.environment.placement:
+            if event_recorder.enabled:
+                event_recorder.record(tracing.LAUNCH, task.serial, self._device_positions[dev])
+            self.update_launched_task_count_mutex(task, dev, 1)
+
+    def _take_batch(self, task: Task, queue: "TaskQueue", nworkers: int) -> List[Task]:
+        """Pop the tasks which a worker can run right after `task` in the same
+           environment from the head of `queue`: ready computation tasks with
+           the same body and environment as `task`. The batch leaves a fair
+           share of the queue to each of `nworkers` workers.
+           The caller must hold the lock of the queue.
+        """
+        if self.max_batch_size <= 1 or not isinstance(task, ComputeTask) or not task.batchable:
+            return []
+        limit = min(self.max_batch_size - 1, len(queue) // nworkers)
+        if limit <= 0:
+            return []
+        code = task.code
+        environment = task.req.environment
+        batch = []
+        while len(batch) < limit and len(queue):
+            head = queue.peek()
+            if isinstance(head._state, TaskCompleted):
+                # See the comment on completed tasks in _launch_task.
+                queue.pop()
+                continue
+            if not isinstance(head, ComputeTask) or not head.batchable or \
+                    head.req.environment is not environment or head.code is not code or \
+                    not self._available_resources.acquire_slots(head.slots):
+                break
+            batch.append(queue.pop())
+        return batch
+
+    @staticmethod
+    def _task_priority(task: Task) -> Tuple:
+        """The key which orders the ready queue and the device queues.
+           Tasks with a larger key are launched first. It only depends on
+           the task, so that the simulator (see parla.sim) can use it.
+        """
+        return (task.priority,)
+
+    def _record_task_duration(self, task: ComputeTask, seconds: Optional[float]):
+        """Called when a computation task finishes with the wall time
+           its body took, or None if it raised.
+        """
+        self.policy.task_finished(task, seconds)
+        if self.task_history is not None and seconds is not None:
+            device = next(iter(task.req.devices))
+            self.task_history.record(task, device.architecture.id, seconds)
+
     def enqueue_dev_queue(self, dev, task: Task):
         """Enqueue a task on the device queue.
            Note that this enqueue has no data race.
         """
         if isinstance(task, ComputeTask):
-            self._compute_task_dev_queues[dev].append(task)
+            self._compute_task_dev_queues[dev].push(task)
         else:
-            self._datamove_task_dev_queues[dev].append(task)
+            self._datamove_task_dev_queues[dev].push(task)
 
 
     def enqueue_dev_queue_mutex(self, dev, task: Task):
@@ -1640,102 +2804,58 @@ class Scheduler(ControllableThread, SchedulerContext):
 
         # Sean: The goal of the mapper look at data locality and load balancing
         # and pick a suitable set of devices on which to run a task.
-        # Currently, it just supports single-device tasks (like everything else...)
+        # Tasks which require several devices are assigned by _assign_device_set.
         # Tasks have a set of requirements passed to them by @spawn. We need to
         # match those requirements and find the most suitable device.
-        possible_devices = task.req.devices
-        ndevices = len(possible_devices)
-        max_suitability = None
+        placement = self._placement_positions.get(task.req.devices)
+        if placement is None:
+            possible_devices = tuple(task.req.devices)
+            placement = (possible_devices,
+                         self._available_resources.device_positions(possible_devices))
+            self._placement_positions[task.req.devices] = placement
+        possible_devices, positions = placement
+
+        # First, we calculate data on each device and data to be moved to it
+        assert isinstance(task, ComputeTask)
+        local_data, total_data = self._available_resources.local_parray_nbytes(
+            task.dataflow.input + task.dataflow.inout, positions)
+        nonlocal_data = total_data - local_data
+
+        # The policy weighs data locality, load balancing, etc.
+        # into a suitability for each device.
+        view = MappingView(task, possible_devices, local_data, nonlocal_data,
+                           self._device_memory[positions],
+                           self._mapped_task_loads[positions],
+                           positions, self._available_resources)
+        suitability = self.policy.suitability(view)
+
+        if task.req.ndevices > 1:
+            return self._assign_device_set(task, possible_devices, positions, suitability)
+
+        # Take the most suitable device with enough resources for the task
+        # (ties go to the first device). If none has, make room on the first
+        # one where evicting unused copies of PArrays frees enough memory.
         best_device = None
-        best_device_local_data = 0
-        total_mapped = 0
-        for device in possible_devices:
-            total_mapped += self.get_mapped_compute_task_count(device)
-            total_mapped += self.get_mapped_datamove_task_count(device)
-
-        for device in possible_devices:
-            # First, we calculate data on the device and data to be moved to the device
-            local_data = 0
-            nonlocal_data = 0
-            assert isinstance(task, ComputeTask)
-            for parray in task.dataflow.input + task.dataflow.inout:
-                if self._available_resources.parray_is_on_device(parray, device):
-                    local_data += parray.nbytes
-                else:
-                    nonlocal_data += parray.nbytes
-
-            # Ensure that the device has enough resources for the task
-            resource_requirements = task.req.resources.copy()
-            logger.debug("%r", resource_requirements is task.req.resources)
-            if 'memory' in resource_requirements:
-                resource_requirements['memory'] += nonlocal_data
-            else:
-                resource_requirements['memory'] = nonlocal_data
-
-            if not self._available_resources.check_resources_availability(device, resource_requirements):
-                logger.debug("Not enough resources on %r", device)
-                continue
-
-            # THIS IS THE MEAT OF THE MAPPING POLICY
-            # We calculate a few constants based on data locality and load balancing
-            # We then add those together with tunable weights to determine a suitability
-            # The device with the highest suitability is the lucky winner
-
-            # These values are really big, so I'm normalizing them to the size of the
-            # device memory so my monkey brain can fathom the numbers
-            local_data /= device.resources['memory']
-            nonlocal_data /= device.resources['memory']
-
-            # Figure out whether the task has a dependency running on this device
-            this_device_owns_dependency = 0
-            for dependency in task.dependencies:
-                if device in dependency.req.devices:
-                    this_device_owns_dependency = 1
+        order = np.argsort(-suitability, kind="stable")
+        fits = self._available_resources.fitting_devices(positions, task.req.resources, nonlocal_data)
+        fitting = order[fits[order]]
+        if len(fitting):
+            best_device = possible_devices[fitting[0]]
+        else:
+            logger.debug("Not enough resources on %r", possible_devices)
+            # Evicting only helps on the devices which lack nothing but memory.
+            memory_bound = self._available_resources.fitting_devices(
+                positions, task.req.resources, except_memory=True)
+            for i in order[memory_bound[order]]:
+                device = possible_devices[i]
+                resource_requirements = task.req.resources.copy()
+                resource_requirements['memory'] = \
+                    resource_requirements.get('memory', 0) + nonlocal_data[i]
+                if self._available_resources.evict_for(device, resource_requirements['memory']) and \
+                        self._available_resources.check_resources_availability(device, resource_requirements):
+                    best_device = device
                     break
 
-            # Next we calculate the load-balancing factor
-            # For now this is just a count of tasks on the device queue (TODO (ses): better heuristics later...)
-            dev_load = self.get_mapped_compute_task_count(device)
-            dev_load += self.get_mapped_datamove_task_count(device)
-            norm_dev_load = dev_load
-
-            # Normalize this too so we have numbers between 0 and 1
-            if total_mapped > 0:
-                norm_dev_load /= total_mapped
-            else:
-                dev_load = 0
-
-            # TODO (ses): Move these magic numbers somewhere better
-            local_data_weight = 30.0
-            nonlocal_data_weight = 30.0
-            load_weight = -1 if norm_dev_load < 1/ndevices else 1 * norm_dev_load
-            dependency_weight = 0
-
-            # Calculate the suitability
-            suitability = local_data_weight * local_data \
-                - nonlocal_data_weight * nonlocal_data \
-                - load_weight \
-                + dependency_weight * this_device_owns_dependency
-
-            """
-            def myformat(num):
-                return "{:.3f}".format(num)
-
-            print(f"dev={device}", end='   ')
-            print(f"local={myformat(local_data)}", end='   ')
-            print(f"nonlocal={myformat(nonlocal_data)}", end='   ')
-            print(f"load={myformat(dev_load)}", end='   ')
-            print(
-                f"dependency_weight={myformat(this_device_owns_dependency)}", end='   ')
-            print(f"suit={myformat(suitability)}")
-            """
-
-            # Update whether or not this is the most suitable device
-            if max_suitability is None or suitability > max_suitability:
-                max_suitability = suitability
-                best_device = device
-                best_device_local_data = local_data
-
         if best_device is None:
             logger.debug(f"[Scheduler] Failed to map %r.", task)
             return False
@@ -1791,6 +2911,89 @@ class Scheduler(ControllableThread, SchedulerContext):
         return False
         """
 
+    def _device_set_candidates(self, req: DeviceSetRequirements, possible_devices: Tuple[Device, ...]) \
+            -> List[Tuple[TaskEnvironment, np.ndarray]]:
+        """The environments with `req.ndevices` of the devices `req` permits and
+           its tags, with the indices of their devices in `possible_devices`.
+        """
+        key = (req.devices, req.ndevices, req.tags)
+        candidates = self._device_set_environments.get(key)
+        if candidates is None:
+            index = {device: i for i, device in enumerate(possible_devices)}
+            # Used as an ordered set
+            environments = {}
+            for device in possible_devices:
+                for env in self._environments.find_all_ordered({device}, req.tags, exact=False):
+                    if len(env.placement) == req.ndevices and env.placement <= req.devices:
+                        environments[env] = None
+            candidates = [(env, np.fromiter((index[d] for d in env.placement), dtype=np.intp))
+                          for env in environments]
+            if not candidates:
+                logger.warning("[Scheduler] No environment has %d of the devices %r: tasks requiring them "
+                               "cannot be mapped.", req.ndevices, req.devices)
+            self._device_set_environments[key] = candidates
+        return candidates
+
+    def _assign_device_set(self, task: ComputeTask, possible_devices: Tuple[Device, ...],
+                           positions: np.ndarray, suitability: np.ndarray) -> bool:
+        """
+        Assign `task`, which requires several devices, to the environment of
+        that many devices with the highest total suitability whose devices all
+        have enough resources, making room by eviction if none has.
+
+        The memory of the task is divided evenly between the devices. Each operand
+        is moved to a device of the environment which has a copy of it, or else to
+        the first one (see _operand_device), and needs room there.
+
+        :return: True if the assignment succeeded, False otherwise.
+        """
+        candidates = self._device_set_candidates(task.req, possible_devices)
+        if not candidates:
+            return False
+        ndevices = task.req.ndevices
+        # EnvironmentRequirements hold the resources of each device.
+        resources = dict(task.req.resources)
+        memory = resources.get('memory', 0) / ndevices
+        if 'memory' in resources:
+            resources['memory'] = memory
+        dataflow = task.dataflow
+        parrays = dataflow.input + dataflow.inout + dataflow.output
+        locations = self._available_resources.parray_locations(parrays)
+        # Outputs are not moved before the task runs.
+        nmoved = len(dataflow.input) + len(dataflow.inout)
+
+        scores = np.array([suitability[members].sum() for _, members in candidates])
+        order = np.argsort(-scores, kind="stable")
+        for evict in (False, True):
+            for j in order:
+                env, members = candidates[j]
+                devices = list(env.placement)
+                member_positions = positions[members]
+                operand_devices = {}
+                nonlocal_data = np.zeros(ndevices)
+                for k, (parray, (nbytes, location)) in enumerate(zip(parrays, locations)):
+                    held = np.flatnonzero(location[member_positions]) if location is not None else ()
+                    m = held[0] if len(held) else 0
+                    if m:
+                        operand_devices[parray.parent_ID] = devices[m]
+                    if k < nmoved and not len(held):
+                        nonlocal_data[m] += nbytes
+                # Evicting only helps if the devices lack nothing but memory.
+                if evict and not (
+                        self._available_resources.fitting_devices(member_positions, resources,
+                                                                  except_memory=True).all() and
+                        all(self._available_resources.evict_for(device, memory + nonlocal_data[m])
+                            for m, device in enumerate(devices))):
+                    continue
+                if self._available_resources.fitting_devices(member_positions, resources, nonlocal_data).all():
+                    task.req = EnvironmentRequirements(resources, env, task.req.tags)
+                    task._operand_devices = operand_devices
+                    logger.debug(f"[Scheduler] Mapped %r to %r.", task, devices)
+                    return True
+                logger.debug("Not enough resources on %r", devices)
+        logger.debug(f"[Scheduler] Failed to map %r.", task)
+        return False
+
     # Random assignment policy, just used for testing
     def _random_assignment_policy(self, task: Task):
         logger.debug(f"[Scheduler] RANDOMLY Mapping %r.", task)
@@ -1824,26 +3027,31 @@ class Scheduler(ControllableThread, SchedulerContext):
             the current queue.
         """
         with self._spawned_queue_monitor:
-            if (len(self._new_spawned_task_queue) > 0):
-                new_q = self._new_spawned_task_queue
-                # Only map tasks whose dependencies are all mapped 
-                # to avoid resource deadlock. 
-                new_tasks = []
-                failed_tasks = []
-                for _ in range(len(new_q)):
-                    task = new_q.popleft()
-                    if not task.check_all_dependency_mapped():
-                        failed_tasks.append(task)
-                    else:
-                        new_tasks.append(task)
-                self._new_spawned_task_queue.extend(failed_tasks)
+            new_q = self._new_spawned_task_queue
+            candidates = [new_q.popleft() for _ in range(len(new_q))]
+        if not candidates:
+            return
+        # Only map tasks whose dependencies are all mapped 
+        # to avoid resource deadlock. 
+        # Checking them takes the dependencies' mutexes, so do it outside
+        # the queue monitor: a spawning thread enqueues while holding the
+        # mutex of a task which may be one of these dependencies.
+        new_tasks = []
+        failed_tasks = []
+        for task in candidates:
+            if not task.check_all_dependency_mapped():
+                failed_tasks.append(task)
+            else:
+                new_tasks.append(task)
+        with self._spawned_queue_monitor:
+            self._new_spawned_task_queue.extend(failed_tasks)
 
-                # Newly added tasks should be enqueued onto the
-                # right to guarantee FIFO manners.
-                # It is efficient to map higher priority tasks to devices
-                # first since Applications generally spawn
-                # tasks in priority orders.
-                self._spawned_task_queue.extend(new_tasks)
+            # Newly added tasks should be enqueued onto the
+            # right to guarantee FIFO manners.
+            # It is efficient to map higher priority tasks to devices
+            # first since Applications generally spawn
+            # tasks in priority orders.
+            self._spawned_task_queue.extend(new_tasks)
 
     def fill_curr_mapped_task_queue(self):
         """ It moves tasks on the new mapped task queue to
@@ -1880,16 +3088,14 @@ class Scheduler(ControllableThread, SchedulerContext):
 
     def update_mapped_task_count_mutex(self, task, dev, counts):
         with self._mapped_count_monitor[dev]:
-            if isinstance(task, ComputeTask):
-                self._device_mapped_compute_task_counts[dev] += counts
-            else:
-                self._device_mapped_datamove_task_counts[dev] += counts
+            self.update_mapped_task_count(task, dev, counts)
 
     def update_mapped_task_count(self, task, dev, counts):
         if isinstance(task, ComputeTask):
             self._device_mapped_compute_task_counts[dev] += counts
         else:
             self._device_mapped_datamove_task_counts[dev] += counts
+        self._mapped_task_loads[self._device_positions[dev]] += counts
 
     def get_mapped_compute_task_count(self, dev):
         with self._mapped_count_monitor[dev]:
@@ -1899,50 +3105,125 @@ class Scheduler(ControllableThread, SchedulerContext):
         with self._mapped_count_monitor[dev]:
             return self._device_mapped_datamove_task_counts[dev]
 
-    def _construct_datamove_task(self, target_data, compute_task: ComputeTask, operand_type: OperandType):
+    def _record_data_access(self, task: ComputeTask, target_data, operand_type: OperandType,
+                            dependencies: Optional[Collection[Task]] = None) -> List[Task]:
+        """
+        Record that the mapped `task` accesses `target_data`.
+
+        A write replaces the writers of the data and clears its readers. An
+        access to a subarray is also recorded on its parent PArray, where
+        writes add to the writers since they only cover part of it.
+
+        :return: The tasks among `dependencies` (if given) whose earlier accesses
+                 conflict with this one: the writers, and for a write also the readers.
+        """
+        writes = operand_type is not OperandType.IN
+        waits_for = []
+        records = self._access_records
+        with self._access_records_mutex:
+            record = records.get(target_data.ID)
+            if record is None:
+                record = records[target_data.ID] = DataAccessRecord()
+            if dependencies is not None:
+                waits_for = [t for t in record.writers if t in dependencies]
+                if writes:
+                    waits_for += [t for t in record.readers if t in dependencies]
+            if writes:
+                record.writers = {task: None}
+                record.readers = {}
+            else:
+                record.readers[task] = None
+            task._data_accesses.append(target_data.ID)
+            if target_data.parent_ID != target_data.ID:
+                parent = records.get(target_data.parent_ID)
+                if parent is None:
+                    parent = records[target_data.parent_ID] = DataAccessRecord()
+                (parent.writers if writes else parent.readers)[task] = None
+                task._data_accesses.append(target_data.parent_ID)
+        return waits_for
+
+    def _forget_data_accesses(self, task: ComputeTask):
+        """Remove the completed `task` from the DataAccessRecords, and the records which become empty."""
+        records = self._access_records
+        with self._access_records_mutex:
+            for key in task._data_accesses:
+                record = records.get(key)
+                if record is None:
+                    continue
+                record.writers.pop(task, None)
+                record.readers.pop(task, None)
+                if not record.writers and not record.readers:
+                    del records[key]
+            task._data_accesses.clear()
+
+    def _fold_datamove(self, compute_task: ComputeTask, target_data, operand_type: OperandType) -> bool:
+        """
+        If the coherence protocol says that `target_data` is already valid on the
+        device of `compute_task` it is moved to, add the movement to the operands the
+        task moves itself before running (see ComputeTask._move_operands).
+
+        The state may still change before the task runs, in which case the task
+        moves the data. The dependencies of the movement are dependencies of the
+        task, so this is always correct.
+
+        :return: True if the movement was folded into the task.
+        """
+        device = compute_task._operand_device(target_data)
+        if not target_data._is_current_on(_parray_device_index(device),
+                                          operand_type is not OperandType.IN):
+            return False
+        compute_task._operand_moves.append((target_data, operand_type))
+        return True
+
+    def _construct_datamove_task(self, compute_task: ComputeTask):
         """
-          This function constructs data movement task for target data.
-          This function consists of two steps.
-          First, it iterates all operand data of the dependency tasks
-          of the computation task (original task).
-          If any of the dependency tasks' data is overlapped with the
-          target data, then add the dependency task to the new data
-          movement task's dependency list.
-          Second, construct a data movement task.
+          This function constructs the data movement task which moves the
+          operands of the computation task (original task) to its device.
+          It waits for the dependencies of the computation task whose
+          accesses to the operands conflict with its own, as found in the
+          DataAccessRecords (see _record_data_access).
+          Movements which are no-ops are folded into the computation task
+          instead (see _fold_datamove).
         """
+        dependencies = set(compute_task.dependencies)
+        graph_node = compute_task._graph_node
+        dataflow = compute_task.dataflow
+        operands, operand_dependencies = [], []
+        # Used as an ordered set
+        waits_for_all = {}
+        for operand_type, data in ((OperandType.IN, dataflow.input), (OperandType.OUT, dataflow.output),
+                                   (OperandType.INOUT, dataflow.inout)):
+            for target_data in data:
+                waits_for = self._record_data_access(compute_task, target_data, operand_type, dependencies)
+                # Replays wait for the same tasks, whether or not they completed by now.
+                if graph_node is not None:
+                    graph_node.datamoves.append(
+                        (target_data, operand_type) + graph_node.split_dependencies(waits_for))
+                # A movement which would be a no-op (e.g. always on CPU-only runs)
+                # is not worth a task: the computation task performs it itself.
+                if not self._fold_datamove(compute_task, target_data, operand_type):
+                    operands.append((target_data, operand_type))
+                    operand_dependencies.append(waits_for)
+                    waits_for_all.update(dict.fromkeys(waits_for))
+        if not operands:
+            return None
+
         # Construct data movement task.
-        taskid = TaskID(str(compute_task.taskid)+"."+str(hex(target_data.ID))+".dmt." +
-                        str(len(task_locals.global_tasks)), (len(task_locals.global_tasks),))
-        task_locals.global_tasks += [taskid]
-        datamove_task = DataMovementTask(compute_task, taskid,
-                                         compute_task.req, target_data, operand_type,
-                                         str(compute_task.taskid) + "." +
-                                         str(hex(target_data.ID)) + ".dmt")
+        name = str(compute_task.taskid) + ".dmt"
+        serial = next_anonymous_task_id()
+        taskid = TaskID(name + "." + str(serial), (serial,))
+        datamove_task = DataMovementTask(compute_task, taskid, compute_task.req, operands, name,
+                                         self._prefetchable(operand_dependencies),
+                                         compute_task._operand_devices,
+                                         self._source_devices(compute_task.req, operands))
+        if self.tracer is not None:
+            self.tracer.task_stage(datamove_task, "map")
         for device in compute_task.req.environment.placement:
             self.update_mapped_task_count_mutex(datamove_task, device, 1)
         self.incr_active_tasks()
         compute_task._add_dependency_mutex(datamove_task)
-        target_data_id = target_data.ID
-        is_overlapped = False
-        if target_data_id in self._datablock_dict:
-            # Get task lists using the target data block.
-            dep_task_list = self._datablock_dict[target_data_id]
-            completed_tasks = []
-            for dep_task_tuple in dep_task_list:
-                dep_task_id = dep_task_tuple[0]
-                dep_task = dep_task_tuple[1]
-                # Only checks dependent tasks if they use the same data blocks.
-                if compute_task.is_dependent_on(dep_task):
-                    if not datamove_task._add_dependency_mutex(dep_task):
-                        completed_tasks.append(dep_task_id)
-            dep_task_list = [
-                tuple(dt for dt in dep_task_list if dt[0] != ft) for ft in completed_tasks]
-        self._datablock_dict[target_data_id].append(
-            (str(compute_task.taskid), compute_task))
-
-        if target_data.parent_ID != target_data_id:
-            self._datablock_dict[target_data.parent_ID].append(
-                (str(compute_task.taskid), compute_task))
+        for dep_task in waits_for_all:
+            datamove_task._add_dependency_mutex(dep_task)
 
         # If a task has no dependency after it is assigned to devices,
         # return the data movement task.
@@ -1956,8 +3237,134 @@ class Scheduler(ControllableThread, SchedulerContext):
         # 
         if not datamove_task.is_blocked_by_dependencies_mutex():
             return datamove_task
+        if datamove_task._operand_dependencies is not None:
+            self._prefetch_candidates.append(datamove_task)
         return None
 
+    def _source_devices(self, req: EnvironmentRequirements, operands: List[Tuple[Any, OperandType]]) -> List[Device]:
+        """The devices a data movement task may copy `operands` from, as far as
+           their copy_out slots matter. Call it before the moves are registered.
+        """
+        if not self._available_resources.limits_slots("copy_out"):
+            return []
+        return self._available_resources.parray_holders([target_data for target_data, _ in operands], req.devices)
+
+    def _prefetchable(self, operand_dependencies: List[List[Task]]) -> Optional[List[List[Task]]]:
+        """The operand dependencies to give a data movement task if prefetching is enabled and it has some."""
+        if self._available_resources.prefetch_budget > 0 and any(operand_dependencies):
+            return operand_dependencies
+        return None
+
+    def _replay_task(self, node: GraphNode, taskid: TaskID, dependencies: List[Task],
+                     datamove_dependencies: List[List[Task]]) -> Optional[ComputeTask]:
+        """Spawn a task like the mapped task `node` and map it to the same
+           device with the same data movement tasks, which wait for
+           `datamove_dependencies`. This skips the mapping policy and the
+           dependency search of _construct_datamove_task.
+
+        :return: The task, or None if its devices lack the resources for it now.
+                 Then it is for the caller to spawn it through the mapper.
+        """
+        req = node.mapped_req
+        if not self._allocate_task_resources(req, self._operand_placements(req, node.operand_devices,
+                                                                           node.dataflow)):
+            return None
+        task = ComputeTask(node.function, node.args, dependencies, taskid, node.req, node.dataflow,
+                           node.name, priority=node.priority, premapped=True,
+                           batchable=node.batchable)
+        task.req = req
+        task._operand_devices = node.operand_devices
+        task.rank = node.rank
+        if self.tracer is not None:
+            self.tracer.task_stage(task, "spawn")
+            self.tracer.task_stage(task, "map")
+
+        operands, operand_dependencies = [], []
+        # Used as an ordered set
+        waits_for_all = {}
+        for (target_data, operand_type, _, _), waits_for in zip(node.datamoves, datamove_dependencies):
+            self._record_data_access(task, target_data, operand_type)
+            if self._fold_datamove(task, target_data, operand_type):
+                for dependency in waits_for:
+                    task._add_dependency_mutex(dependency)
+            else:
+                operands.append((target_data, operand_type))
+                operand_dependencies.append(waits_for)
+                waits_for_all.update(dict.fromkeys(waits_for))
+        datamove_tasks = []
+        if operands:
+            name = str(taskid) + ".dmt"
+            datamove_task = DataMovementTask(task, TaskID(name, taskid.id), req, operands, name,
+                                             self._prefetchable(operand_dependencies),
+                                             task._operand_devices,
+                                             self._source_devices(req, operands))
+            # Keep it unassigned until all its dependencies are added,
+            # so that it is enqueued exactly once.
+            datamove_task._assigned = False
+            for device in req.environment.placement:
+                self.update_mapped_task_count_mutex(datamove_task, device, 1)
+            self.incr_active_tasks()
+            task._add_dependency_mutex(datamove_task)
+            for dependency in waits_for_all:
+                datamove_task._add_dependency_mutex(dependency)
+            datamove_tasks.append(datamove_task)
+
+        self._register_operand_moves(task)
+        for device in req.environment.placement:
+            self.update_mapped_task_count_mutex(task, device, 1)
+            self.policy.task_mapped(task, device, self._device_positions[device])
+
+        for t in datamove_tasks + [task]:
+            with t._mutex:
+                t._assigned = True
+                ready = not t.is_blocked_by_dependencies()
+            if ready:
+                self.enqueue_task(t)
+            elif t in datamove_tasks and t._operand_dependencies is not None:
+                self._prefetch_candidates.append(t)
+        return task
+
+    @staticmethod
+    def _operand_placements(req: EnvironmentRequirements, operand_devices: Dict[int, Device],
+                            dataflow: "Dataflow") -> List[Tuple[Any, Device]]:
+        """The operands of a task mapped to `req` with the devices they are moved to."""
+        return [(parray, _operand_device(req, operand_devices, parray))
+                for parray in dataflow.input + dataflow.inout + dataflow.output]
+
+    def _register_operand_moves(self, task: ComputeTask):
+        # The operands were pinned by _allocate_task_resources.
+        for parray, device in self._operand_placements(task.req, task._operand_devices, task.dataflow):
+            self._available_resources.register_parray_move(parray, device)
+
+    def _allocate_task_resources(self, req: EnvironmentRequirements, operands: List[Tuple[Any, Device]]) -> bool:
+        """Pin `operands` on their devices and allocate the resources of a task
+           mapped to `req` on all of its devices. Unused PArrays are spilled to
+           make room, but the scheduler never waits for resources.
+
+        :return: True on success. Otherwise nothing is pinned or allocated.
+        """
+        pool = self._available_resources
+        resources = req.resources
+        # Pin the operands first so that making room for the task does not evict them.
+        for parray, device in operands:
+            pool.pin_parrays([parray], device)
+        allocated = []
+        for device in req.devices:
+            if not pool.allocate_resources(device, resources) and \
+                    not (pool.fitting_devices(pool.device_positions([device]), resources, except_memory=True)[0] and
+                         pool.evict_for(device, resources.get('memory', 0)) and
+                         pool.allocate_resources(device, resources)):
+                logger.debug("[Scheduler] Not enough resources on %r.", device)
+                break
+            allocated.append(device)
+        else:
+            return True
+        for device in allocated:
+            pool.deallocate_resources(device, resources)
+        for parray, device in operands:
+            pool.unpin_parrays([parray], device)
+        return False
+
     def _map_tasks(self):
         # The first loop iterates a spawned task queue
         # and constructs a mapped task subgraph.
@@ -1968,6 +3375,7 @@ class Scheduler(ControllableThread, SchedulerContext):
 
         attempted_mappings = 0
         failed_mappings = 0
+        mapped_tasks = 0
 
         if len(self._spawned_task_queue) < mapping_limit:
             self.fill_curr_spawned_task_queue()
@@ -1978,65 +3386,50 @@ class Scheduler(ControllableThread, SchedulerContext):
                 if not task._assigned:
                     # This is what actually maps the task
                     attempted_mappings += 1
+                    requirements = task.req
                     is_assigned = self._assignment_policy(task)
                     # is_assigned = self._random_assignment_policy(task)  # USE THIS INSTEAD TO TEST RANDOM
                     assert isinstance(is_assigned, bool)
+                    # Allocate the resources used by this task. If they were taken
+                    # since the assignment, map it again later rather than wait.
+                    if is_assigned and not self._allocate_task_resources(
+                            task.req, self._operand_placements(task.req, task._operand_devices, task.dataflow)):
+                        task.req = requirements
+                        task._operand_devices = {}
+                        is_assigned = False
                     if not is_assigned:
-                        self.enqueue_spawned_task(task)
+                        self._requeue_spawned_task(task)
                         failed_mappings += 1
                     else:
                         assert isinstance(task, ComputeTask)
-                        # Create data movement tasks for each data
+                        # Create the data movement task of the
                         # operands of this task.
-                        # TODO(lhc): this is not good.
-                        #            will use logical values to make it easy to understand.
                         mappable_datamove_tasks = []
-                        for data in task.dataflow.input:
-                            dtask = self._construct_datamove_task(
-                                    data, task, OperandType.IN)
-                            if dtask is not None:
-                                mappable_datamove_tasks.append(dtask)
-                        for data in task.dataflow.output:
-                            dtask = self._construct_datamove_task(
-                                    data, task, OperandType.OUT)
-                            if dtask is not None:
-                                  mappable_datamove_tasks.append(dtask)
-                        for data in task.dataflow.inout:
-                            dtask = self._construct_datamove_task(
-                                    data, task, OperandType.INOUT)
-                            if dtask is not None:
-                                  mappable_datamove_tasks.append(dtask)
-
-                        # Update parray tracking and task count on the device
-                        for parray in (task.dataflow.input + task.dataflow.inout + task.dataflow.output):
-                            assert isinstance(
-                                task.req, EnvironmentRequirements)
-                            if len(task.req.environment.placement) > 1:
-                                raise NotImplementedError(
-                                    "Multidevice not supported")
-                            for device in task.req.environment.placement:
-                                self._available_resources.register_parray_move(
-                                    parray, device)
-                        # TODO(lhc): the current Parla does not support multiple devices.
-                        #            leave it as a loop for the future.
+                        dtask = self._construct_datamove_task(task)
+                        if dtask is not None:
+                            mappable_datamove_tasks.append(dtask)
+
+                        # Update parray tracking and task count on the devices
+                        assert isinstance(task.req, EnvironmentRequirements)
+                        self._register_operand_moves(task)
                         for device in task.req.environment.placement:
                             self.update_mapped_task_count_mutex(
                                 task, device, 1)
+                            self.policy.task_mapped(
+                                task, device, self._device_positions[device])
 
-                        # Allocate additional resources used by this task (blocking)
-                        for device in task.req.devices:
-                            for resource, amount in task.req.resources.items():
-                                logger.debug(
-                                    "Task %r allocating %d %s on device %r", task, amount, resource, device)
-                            self._available_resources.allocate_resources(
-                                device, task.req.resources, blocking=True)
-
+                        if self.tracer is not None:
+                            self.tracer.task_stage(task, "map")
                         for mp_dtask in mappable_datamove_tasks:
                             self.enqueue_task(mp_dtask)
 
                         # Only computation needs to set a assigned flag.
                         # Data movement task is set as assigned when it is created.
                         task.set_assigned()
+                        if task._graph_node is not None:
+                            task._graph_node.operand_devices = task._operand_devices
+                            task._graph_node.mapped_req = task.req
+                        mapped_tasks += 1
                         # If a task has no dependency after it is assigned to devices,
                         # immediately enqueue a corresponding data movement task to
                         # the ready queue.
@@ -2052,6 +3445,7 @@ class Scheduler(ControllableThread, SchedulerContext):
                 # If there is no spawned task at this moment,
                 # move to the mapped task scheduling.
                 break
+        return mapped_tasks
 
     def _schedule_tasks(self):
         """ Currently this doesn't do any intelligent scheduling (ordering).
@@ -2069,9 +3463,14 @@ class Scheduler(ControllableThread, SchedulerContext):
                 logger.debug("[Scheduler] Task %r: Failed to assign", task)
                 break
             schedule_count += 1
-            for d in task.req.devices:
-                logger.info(f"[Scheduler] Enqueuing %r to device %r", task, d)
-                self.enqueue_dev_queue_mutex(d, task)
+            if self.tracer is not None:
+                self.tracer.task_stage(task, "schedule")
+            # A task with several devices is launched once, from the queue of its first one.
+            d = next(iter(task.req.devices))
+            if event_recorder.enabled:
+                event_recorder.record(tracing.SCHEDULE, task.serial, self._device_positions[d])
+            self.enqueue_dev_queue_mutex(d, task)
+        return schedule_count
 
     # _launch_[DEVICE TYPES]_tasks launches a task by assigning it to available
     # worker threads. It manages different execution paths based on the target
@@ -2083,80 +3482,94 @@ class Scheduler(ControllableThread, SchedulerContext):
     # The mapper only maps tasks which have enough resources to run.
     # It's guaranteed for the task to have enough resources
 
-    def _launch_task(self, queue, dev: Device, is_cpu: bool, num_launched_tasks):
-        try:
-            while len(queue):
-                task = queue.pop()
-                worker = self._free_worker_threads.pop()  # grab a worker
-                #print("Worker thread:", str(worker.index))
-                logger.info(f"[Scheduler] Launching %s task, %r on %r",
-                            dev.architecture.id, task, worker)
-                # XXX(lhc): The error that tried to launch a completed task
-                # is now fixed, and just in case, I keep this if-statement
-                # with this comment.
-                # The previous error was because a data movement task could
-                # immediately start its movement while a computation task is still
-                # trying to create other data movement tasks.
-                # Therefore, the following scenario happened:
-                #   data movement task starts and completes ->
-                #   computation task wakes up (while it is creating other
-                #   data movement tasks) ->
-                #   computation task starts, and creates a new data movement
-                #   task ->
-                #   repeate the above scenarios.
-                #
-                # This error is resolved by avoiding immediate enqueueing the
-                # created data movement task until all other data movement tasks
-                # are created.
-                if isinstance(task._state, TaskCompleted):
-                    logger.info(f"This should not be passed.")
-                    continue
-                self.scheduler.incr_running_tasks() 
-                worker.assign_task(task)
-                logger.debug(f"[Scheduler] Launched %r", task)
-
-                for dev in task.req.environment.placement:
-                    self.update_launched_task_count_mutex(task, dev, 1)
-                if is_cpu is not True and num_launched_tasks < self._num_colocatable_tasks + 1:
-                    break
-        except IndexError:
-            # If failed to find available thread, reappend it.
-            self.enqueue_dev_queue(dev, task)
+    def _launch_task(self, queue):
+        launched_tasks = 0
+        # Only dequeue a task when there is a worker to run it and its
+        # devices have free slots for it, so that the queue order is kept.
+        while len(queue) and len(self._free_worker_threads):
+            task = queue.peek()
+            # XXX(lhc): The error that tried to launch a completed task
+            # is now fixed, and just in case, I keep this if-statement
+            # with this comment.
+            # The previous error was because a data movement task could
+            # immediately start its movement while a computation task is still
+            # trying to create other data movement tasks.
+            # Therefore, the following scenario happened:
+            #   data movement task starts and completes ->
+            #   computation task wakes up (while it is creating other
+            #   data movement tasks) ->
+            #   computation task starts, and creates a new data movement
+            #   task ->
+            #   repeate the above scenarios.
+            #
+            # This error is resolved by avoiding immediate enqueueing the
+            # created data movement task until all other data movement tasks
+            # are created.
+            if isinstance(task._state, TaskCompleted):
+                queue.pop()
+                continue
+            if not self._available_resources.acquire_slots(task.slots):
+                break
+            queue.pop()
+            worker = self._free_worker_threads.pop()  # grab a worker
+            batch = self._take_batch(task, queue, len(self._free_worker_threads) + 1)
+            self._mark_launched(task)
+            for batched_task in batch:
+                self._mark_launched(batched_task)
+            worker.assign_task(task, batch)
+            launched_tasks += 1 + len(batch)
+        return launched_tasks
 
     def _launch_tasks(self):
         """ Iterate through free devices and launch tasks on them
         """
         # logger.debug("[Scheduler] Launch Phase")
+        launched_tasks = 0
+        # The tasks left in the queues for lack of workers
+        waiting = 0
         for dev in self._available_resources.get_resources():
-            is_cpu = (dev.architecture.id == "cpu")
             with self._dev_queue_monitor[dev]:
                 with self._thread_queue_monitor:
-                    if len(self._free_worker_threads) == 0:
-                        break
-                    compute_queue = self._compute_task_dev_queues[dev]
-                    datamove_queue = self._datamove_task_dev_queues[dev]
-                    if len(compute_queue) > 0:
-                        num_launched_compute_task_count = self.get_launched_compute_task_count(dev)
-                        if is_cpu or num_launched_compute_task_count < (self._num_colocatable_tasks + 1):
-                            self._launch_task(compute_queue, dev, is_cpu, num_launched_compute_task_count)
-                    if len(datamove_queue) > 0:
-                        num_launched_datamove_task_count = self.get_launched_datamove_task_count(dev)
-                        if is_cpu or num_launched_datamove_task_count < (self._num_colocatable_tasks + 1):
-                            self._launch_task(datamove_queue, dev, is_cpu, num_launched_datamove_task_count)
+                    for queue in (self._compute_task_dev_queues[dev], self._datamove_task_dev_queues[dev]):
+                        if len(self._free_worker_threads):
+                            launched_tasks += self._launch_task(queue)
+                        if len(self._free_worker_threads) == 0:
+                            waiting += len(queue)
+        # Fall back to giving free workers tasks from busy workers' local queues.
+        with self._thread_queue_monitor:
+            while len(self._free_worker_threads):
+                task = self._steal_task()
+                if task is None:
+                    break
+                worker = self._free_worker_threads.pop()
+                self._mark_launched(task)
+                worker.assign_task(task)
+                launched_tasks += 1
+        # The new workers join the pool once they are initialized, which wakes
+        # the scheduler to launch the waiting tasks.
+        if waiting:
+            self._add_worker_threads(waiting)
+        return launched_tasks
 
-    def start_scheduler_callbacks(self):
-        map_succeed = True
-        schedule_succeed = True
-        launch_succeed = True
+    def _run_scheduler_phases(self) -> bool:
+        """ Run the mapping, scheduling and launching phases once.
+
+        :return: True if any of the phases made progress.
+        """
         map_succeed = self.map_tasks_callback()
         schedule_succeed = self.schedule_tasks_callback()
         launch_succeed = self.launch_tasks_callback()
-        while self.no_running_tasks():
-            if not map_succeed and not schedule_succeed and not launch_succeed:
-                break
-            map_succeed = self.map_tasks_callback()
-            schedule_succeed = self.schedule_tasks_callback()
-            launch_succeed = self.launch_tasks_callback()
+        prefetch_succeed = self.prefetch_tasks_callback()
+        return map_succeed or schedule_succeed or launch_succeed or prefetch_succeed
+
+    def start_scheduler_callbacks(self):
+        """ Run the scheduler phases once on the calling thread and hand
+            any remaining work over to the scheduler thread.
+        """
+        self._run_scheduler_phases()
+        # The phases are bounded, and a phase is skipped if another thread
+        # is running it, so let the scheduler thread drain what is left.
+        self.wake_scheduler()
 
     def map_tasks_callback(self):
         """ This is a callback function for the mapper. Called by WorkerThread and Spawn Decorator to trigger scheduler execution"""
@@ -2178,17 +3591,19 @@ class Scheduler(ControllableThread, SchedulerContext):
         condition = condition and count < mapping_limit
 
         # Acquire lock for phase (Note this is possible optional if we make map tasks GIL-less and thread safe in the future)
-        logger.info("[Mapping Callback] Start. Met condition: %s",
-                    "True" if condition else "False")
         if condition and self._mapping_phase_monitor.acquire(blocking=False):
             # Map tasks
-            self._map_tasks()
+            start_t = time.perf_counter()
+            mapped_tasks = self._map_tasks()
+            if self.tracer is not None and mapped_tasks:
+                self.tracer.phase("map", start_t, time.perf_counter(), mapped_tasks)
             self._mapping_phase_monitor.release()
-            logger.info("[Mapping Callback] Complete.")
-            return True
+            if event_recorder.enabled:
+                event_recorder.record(tracing.MAP_PASS, mapped_tasks)
+            return mapped_tasks > 0
         else:  # If the scheduler is already in mapping phase, do nothing
-            logger.info(
-                "[Mapping Callback] Failed to acquire lock. Met condition: %s", "True" if condition else "False")
+            if event_recorder.enabled:
+                event_recorder.record(tracing.MAP_SKIPPED)
             return False
 
     def schedule_tasks_callback(self):
@@ -2214,26 +3629,49 @@ class Scheduler(ControllableThread, SchedulerContext):
         condition = condition and dev_condition
         """
         # Acquire lock for phase (Note this is possible optional if we make schedule tasks GIL-less and thread safe in the future)
-        logger.info("[Scheduling Callback] Start. Met condition: %s",
-                    "True" if condition else "False")
         if condition and self._scheduling_phase_monitor.acquire(blocking=False):
             # Schedule tasks
-            self._schedule_tasks()
+            start_t = time.perf_counter()
+            scheduled_tasks = self._schedule_tasks()
+            if self.tracer is not None and scheduled_tasks:
+                self.tracer.phase("schedule", start_t, time.perf_counter(), scheduled_tasks)
             self._scheduling_phase_monitor.release()
-            logger.info("[Scheduling Callback] Complete.")
-            return True
+            if event_recorder.enabled:
+                event_recorder.record(tracing.SCHEDULE_PASS, scheduled_tasks)
+            return scheduled_tasks > 0
         else:  # If the scheduler is already in scheduling phase, do nothing
-            logger.info(
-                "[Scheduling Callback] Failed to acquire lock. Met condition: %s", "True" if condition else "False")
+            if event_recorder.enabled:
+                event_recorder.record(tracing.SCHEDULE_SKIPPED)
             return False
 
+    def prefetch_tasks_callback(self):
+        """ Start prefetching the ready operands of data movement tasks which wait for dependencies (see DataMovementTask.prefetch)."""
+        if self._prefetch_candidates and self._prefetching_phase_monitor.acquire(blocking=False):
+            start_t = time.perf_counter()
+            started = 0
+            try:
+                candidates = self._prefetch_candidates
+                for _ in range(len(candidates)):
+                    datamove_task = candidates.popleft()
+                    task_started, pending = datamove_task.prefetch(self)
+                    started += task_started
+                    if pending:
+                        candidates.append(datamove_task)
+            finally:
+                self._prefetching_phase_monitor.release()
+            if self.tracer is not None and started:
+                self.tracer.phase("prefetch", start_t, time.perf_counter(), started)
+            return started > 0
+        return False
+
     def launch_tasks_callback(self):
         """ This is a callback function for the launcher. Called by WorkerThread and Spawn Decorator to trigger scheduler execution"""
 
         # Check runtime conditions
         # Are there any tasks to launch?
-        # Are there any free worker threads?
-        condition = len(self._free_worker_threads) > 0 and self.num_active_tasks() != 0
+        # Are there any free worker threads, or can the worker pool grow?
+        condition = (len(self._free_worker_threads) > 0 or len(self._worker_threads) < self.max_threads) and \
+            self.num_active_tasks() != 0
         """
         dev_condition = False
         if condition:
@@ -2249,30 +3687,35 @@ class Scheduler(ControllableThread, SchedulerContext):
         """
 
         # Acquire lock for phase (Note this is possible optional if we make schedule tasks GIL-less and thread safe in the future)
-        logger.info("[Launching Callback] Start. Met condition: %s",
-                    "True" if condition else "False")
         if condition and self._launching_phase_monitor.acquire(blocking=False):
             # Launch tasks
-            self._launch_tasks()
+            start_t = time.perf_counter()
+            launched_tasks = self._launch_tasks()
+            if self.tracer is not None and launched_tasks:
+                self.tracer.phase("launch", start_t, time.perf_counter(), launched_tasks)
             self._launching_phase_monitor.release()
-            logger.info("[Launching Callback] Complete.")
-            return True
+            if event_recorder.enabled:
+                event_recorder.record(tracing.LAUNCH_PASS, launched_tasks)
+            return launched_tasks > 0
         else:  # If the scheduler is already in launching phase, do nothing
-            logger.info(
-                "[Launching Callback] Failed to acquire lock. Met condition: %s", "True" if condition else "False")
+            if event_recorder.enabled:
+                event_recorder.record(tracing.LAUNCH_SKIPPED)
             return False
 
     def run(self) -> None:
         # noinspection PyBroadException
         try:  # Catch all exception to report them usefully
             while self._should_run:
-                # self._map_tasks()
-                # self._schedule_tasks()
-                # self._launch_tasks()
-                # logger.debug("[Scheduler] Sleeping!")
-                # time.sleep(self.period)
-                time.sleep(0.001)
-                # logger.debug("[Scheduler] Awake!")
+                # Sleep until there is something to do.
+                with self._wakeup_monitor:
+                    if not self._wakeup_pending and self._should_run:
+                        self._wakeup_monitor.wait(self.period)
+                    self._wakeup_pending = False
+                # Keep running the phases as long as they make progress.
+                # New events which arrive meanwhile set the pending flag
+                # again, so the next wait returns immediately.
+                while self._should_run and self._run_scheduler_phases():
+                    pass
 
         except Exception:
             logger.exception("Unexpected exception in Scheduler")
@@ -2280,8 +3723,11 @@ class Scheduler(ControllableThread, SchedulerContext):
 
     def stop(self):
         super().stop()
-        for w in self._worker_threads:
-            w.stop()
+        # No workers are added once the scheduler stops (see _add_worker_threads).
+        with self._worker_pool_monitor:
+            for w in self._worker_threads:
+                w.stop()
+        self.wake_scheduler()
 
     def report_exception(self, e: BaseException):
         logger.exception("Report exception:", e)
@@ -2292,3 +3738,160 @@ class Scheduler(ControllableThread, SchedulerContext):
                 self._ready_queue, self._available_resources)
         for w in self._worker_threads:
             w.dump_status(lg)
+
+
+
+class TaskCostModel:
+    """Estimates the cost of computation tasks from their measured execution
+       times and maintains the upward ranks of tasks in the task graph.
+
+       Costs are running averages keyed by task body. Tasks which have not
+       run yet are assumed to cost their mean in the task history, if any,
+       or else the mean of all measured costs.
+    """
+
+    # Bound the work of a single rank update on very deep graphs.
+    # Ranks further up are then underestimated, but stay consistent.
+    max_rank_updates: int = 4096
+
+    def __init__(self, default_cost: float = 1.0, history: Optional[TaskHistory] = None):
+        self._monitor = threading.Lock()
+        # Serializes rank updates. It is taken without _monitor, as it is held
+        # while taking task mutexes.
+        self._ranks_monitor = threading.Lock()
+        self.default_cost = default_cost
+        # Consulted for tasks which have not run yet
+        self.history = history
+        # Code object -> (mean execution time in seconds, number of samples)
+        self._costs: Dict[object, Tuple[float, int]] = {}
+        self._total_cost = 0.0
+
+    @staticmethod
+    def _key(task: ComputeTask):
+        return task.code
+
+    def estimate(self, task: ComputeTask) -> float:
+        cost = self._costs.get(self._key(task))
+        if cost is not None:
+            return cost[0]
+        if self.history is not None:
+            cost = self.history.lookup(task)
+            if cost is not None:
+                return cost
+        if self._costs:
+            return self._total_cost / len(self._costs)
+        return self.default_cost
+
+    def record(self, task: ComputeTask, seconds: float):
+        key = self._key(task)
+        with self._monitor:
+            mean, n = self._costs.get(key, (0.0, 0))
+            new_mean = mean + (seconds - mean) / (n + 1)
+            self._total_cost += new_mean - mean
+            self._costs[key] = (new_mean, n + 1)
+
+    def update_ranks(self, task: ComputeTask) -> List[ComputeTask]:
+        """Set the rank of a newly spawned task and raise the ranks of
+           its (transitive) dependencies which are still pending.
+
+           It takes the mutex of each of these tasks in turn, so the caller
+           must not hold any task mutex.
+
+           :return: The tasks whose rank was raised.
+        """
+        raised = []
+        with self._ranks_monitor:
+            # Dependents which were spawned first have already raised the rank.
+            rank = self.estimate(task)
+            if rank > task.rank:
+                task.rank = rank
+                raised.append(task)
+            stack = [task]
+            budget = self.max_rank_updates
+            while stack and budget > 0:
+                t = stack.pop()
+                with t._mutex:
+                    dependencies = t.dependencies
+                for dependency in dependencies:
+                    with dependency._mutex:
+                        if dependency._state.is_terminal:
+                            continue
+                    rank = self.estimate(dependency) + t.rank
+                    if rank > dependency.rank:
+                        dependency.rank = rank
+                        raised.append(dependency)
+                        stack.append(dependency)
+                        budget -= 1
+        return raised
+
+
+class CriticalPathScheduler(Scheduler):
+    """A scheduler which orders the ready and device queues by the upward
+       rank of tasks (as in HEFT): the estimated length of the longest
+       path from the start of a task to the end of the task graph.
+       Manual task priorities still take precedence over ranks.
+
+       Spawned tasks are ranked by the scheduler phases, and queued tasks
+       whose rank is raised by dependents spawned later are reordered.
+
+       Tasks are mapped with the EarliestFinishTimePolicy by default.
+
+       Select it with `Parla(scheduler_class=CriticalPathScheduler)`.
+    """
+
+    def __init__(self, environments: Collection[TaskEnvironment], **kwds):
+        self.task_costs = TaskCostModel()
+        # Spawned computation tasks waiting for update_ranks
+        self._unranked_tasks: Deque[ComputeTask] = deque()
+        # Map tasks with the earliest-finish-time policy as in HEFT,
+        # unless a policy is given.
+        if kwds.get("policy") is None:
+            kwds["policy"] = "eft"
+        super().__init__(environments, **kwds)
+        self.task_costs.history = self.task_history
+
+    def _record_task_duration(self, task: ComputeTask, seconds: Optional[float]):
+        super()._record_task_duration(task, seconds)
+        if seconds is not None:
+            self.task_costs.record(task, seconds)
+
+    def enqueue_spawned_task(self, task: Task):
+        # The spawning thread holds the mutex of the task, and maybe of one
+        # of its dependencies, which update_ranks takes: rank it later.
+        if isinstance(task, ComputeTask):
+            self._unranked_tasks.append(task)
+        super().enqueue_spawned_task(task)
+
+    def _rank_spawned_tasks(self):
+        while True:
+            try:
+                task = self._unranked_tasks.popleft()
+            except IndexError:
+                return
+            for raised in self.task_costs.update_ranks(task):
+                self._rekey_task(raised)
+
+    def _rekey_task(self, task: ComputeTask):
+        """Reorder `task` in the queue which holds it, if any, after its rank changed."""
+        # Unmapped tasks wait in the spawned task queues, which are not ordered.
+        if not task._assigned:
+            return
+        with self._ready_queue_monitor:
+            if self._ready_queue.rekey(task):
+                return
+        for dev, queue in self._compute_task_dev_queues.items():
+            with self._dev_queue_monitor[dev]:
+                if queue.rekey(task):
+                    return
+        for worker in self._worker_threads:
+            with worker._local_queue_monitor:
+                if worker._local_queue.rekey(task):
+                    return
+
+    def _run_scheduler_phases(self) -> bool:
+        self._rank_spawned_tasks()
+        return super()._run_scheduler_phases()
+
+    @staticmethod
+    def _task_priority(task: Task) -> Tuple:
+        return (task.priority, task.rank)
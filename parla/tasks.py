@@ -12,8 +12,9 @@ import logging
 import threading
 import inspect
 from abc import abstractmethod, ABCMeta
+from itertools import count
 from contextlib import asynccontextmanager, contextmanager, ExitStack
-from typing import Awaitable, Collection, Iterable, Optional, Any, Union, List, FrozenSet, Dict
+from typing import Awaitable, Collection, Iterable, Optional, Any, Union, List, FrozenSet, Dict, Tuple
 
 from parla.device import Device, Architecture, get_all_devices
 from parla.task_runtime import ComputeTask, TaskID, TaskCompleted, TaskRunning, TaskAwaitTasks, TaskState, DeviceSetRequirements, Task, get_scheduler_context, task_locals, WorkerThread
@@ -30,7 +31,8 @@ except ImportError as e:
 logger = logging.getLogger(__name__)
 
 __all__ = [
-    "TaskID", "TaskSpace", "spawn", "tasks", "finish", "CompletedTaskSpace", "Task", "reserve_persistent_memory"
+    "TaskID", "TaskSpace", "spawn", "tasks", "finish", "CompletedTaskSpace", "Task", "reserve_persistent_memory",
+    "capture", "TaskGraph", "parallel_for", "DenseTaskSpace", "TaskRange"
 ]
 
 
@@ -49,12 +51,20 @@ class TaskSet(Awaitable, Collection, metaclass=ABCMeta):
         # Compute the flat dependency set (including unwrapping TaskID objects)
         dependencies = []
         for ds in self._tasks:
+            if isinstance(ds, TaskRange):
+                # Do not expand ranges into their tasks.
+                dependencies.extend(ds._flat_tasks)
+                continue
             if not isinstance(ds, Iterable):
                 ds = (ds,)
             for d in ds:
                 if hasattr(d, "task"):
-                    if d.task is not None:
-                        d = d.task
+                    task = d.task
+                    if task is not None:
+                        d = task
+                    elif isinstance(d, TaskID) and d.completed:
+                        # A released completed task is no longer a dependency.
+                        continue
                 # if not isinstance(d, task_runtime.Task):
                 #    raise TypeError("Dependencies must be TaskIDs or Tasks: " + str(d))
                 dependencies.append(d)
@@ -113,6 +123,9 @@ class TaskSpace(TaskSet):
 
     This will produce a series of tasks where each depends on all previous tasks.
 
+    A completed task is not kept alive by its `TaskID`, so the space only retains the
+    IDs themselves. `del T[...]` forgets those too, once the indices are no longer used.
+
     :note: `TaskSpace` does not support assignment to indicies.
     """
     _data: Dict[int, TaskID]
@@ -139,10 +152,132 @@ class TaskSpace(TaskSet):
             return ret[0]
         return ret
 
+    def _taskid(self, key: Tuple) -> TaskID:
+        """Get the `TaskID` of the index tuple `key`."""
+        taskid = self._data.get(key)
+        if taskid is None:
+            taskid = self._data.setdefault(key, TaskID(self._name, key))
+        return taskid
+
+    def __delitem__(self, index):
+        """Forget the `TaskID` associated with the provided indices, e.g. `del T[0:i]` once the tasks are
+        complete and no longer used as dependencies. Later uses of these indices get new TaskIDs.
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        parse_index((), index, lambda x, i: x + (i,), lambda x: self._data.pop(x, None))
+
     def __repr__(self):
         return "TaskSpace({_name}, {_data})".format(**self.__dict__)
 
 
+class _DenseTaskID(TaskID):
+    def __init__(self, name, id, completion: task_runtime.RangeCompletion):
+        super().__init__(name, id)
+        self._completion = completion
+
+    def _task_completed(self):
+        super()._task_completed()
+        self._completion.complete(self._id[0])
+
+
+class DenseTaskSpace(TaskSpace):
+    """A task space indexed by non-negative integers, backed by a list.
+
+    A slice of it, such as `T[0:i]`, is a `TaskRange`: as a dependency it stands for
+    all tasks of the range, without creating a `TaskID` or a dependency for each of
+    them. So the common pattern of depending on all previous tasks takes linear time
+    and memory in the number of tasks.
+
+    >>> T = DenseTaskSpace()
+    ... for i in range(n):
+    ...     @spawn(T[i], [T[0:i]])
+    ...     def t():
+    ...         code
+    """
+
+    def __init__(self, name=""):
+        super().__init__(name)
+        self._ids: List[Optional[TaskID]] = []
+        self._ids_mutex = threading.Lock()
+        self._completion = task_runtime.RangeCompletion()
+
+    @property
+    def _tasks(self):
+        return [taskid for taskid in self._ids if taskid is not None]
+
+    def _taskid(self, key: Tuple) -> TaskID:
+        (index,) = key
+        if index < 0:
+            raise IndexError("DenseTaskSpace indices are non-negative: {}".format(index))
+        ids = self._ids
+        with self._ids_mutex:
+            if index >= len(ids):
+                ids.extend([None] * (index + 1 - len(ids)))
+            taskid = ids[index]
+            if taskid is None:
+                taskid = ids[index] = _DenseTaskID(self._name, key, self._completion)
+        return taskid
+
+    def __getitem__(self, index):
+        """Get the `TaskID` of an index, the `TaskRange` of a slice or a list of `TaskIDs<TaskID>` otherwise."""
+        if isinstance(index, slice) and index.step in (None, 1):
+            if index.stop is None:
+                raise ValueError("Ranges of a DenseTaskSpace must have an end.")
+            return TaskRange(self, index.start or 0, index.stop)
+        if isinstance(index, Iterable):
+            ret = []
+            parse_index((), (index,), lambda x, i: x + (i,), lambda x: ret.append(self._taskid(x)))
+            return ret
+        return self._taskid((index,))
+
+    def __delitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        with self._ids_mutex:
+            def forget(key):
+                if key[0] < len(self._ids):
+                    self._ids[key[0]] = None
+            parse_index((), index, lambda x, i: x + (i,), forget)
+
+    def __repr__(self):
+        return "DenseTaskSpace({}, {} tasks, {!r})".format(self._name, len(self._tasks), self._completion)
+
+
+class TaskRange(TaskSet):
+    """
+    The tasks of the indices from `start` to `stop` of a `DenseTaskSpace`, e.g. `T[0:i]`.
+
+    As a dependency (or when awaited), it stands for the completion of all tasks of the
+    range, including those which are not spawned yet. The runtime tracks it with a single
+    internal task which completes with the last task of the range (see
+    `parla.task_runtime.RangeCompletion`).
+    """
+
+    def __init__(self, space: DenseTaskSpace, start: int, stop: int):
+        if start < 0:
+            raise IndexError("DenseTaskSpace indices are non-negative: {}".format(start))
+        self.space = space
+        self.start = start
+        self.stop = stop
+
+    @property
+    def _tasks(self) -> Collection:
+        return [self.space._taskid((i,)) for i in range(self.start, self.stop)]
+
+    @property
+    def _flat_tasks(self) -> List[Task]:
+        barrier = self.space._completion.barrier(
+            TaskID(self.space._name, ("range", self.start, self.stop)), self.start, self.stop)
+        return [] if barrier is None else [barrier]
+
+    def __len__(self) -> int:
+        return max(self.stop - self.start, 0)
+
+    def __repr__(self):
+        return "TaskRange({}[{}:{}])".format(self.space._name, self.start, self.stop)
+
+
 class CompletedTaskSpace(TaskSet):
     """
     A task space that returns completed tasks instead of unused tasks.
@@ -312,6 +447,28 @@ def _make_cell(val):
     return closure.__closure__[0]
 
 
+def _separate_body(body):
+    """
+    :return: A copy of the task body `body` which does not observe later changes of the variables it captured.
+    """
+    if inspect.iscoroutine(body):
+        # An already running coroutine does not need changes since we assume
+        # it was changed correctly when the original function was spawned.
+        return body
+    # Perform a horrifying hack to build a new function which will
+    # not be able to observe changes in the original cells in the
+    # tasks outer scope. To do this we build a new function with a
+    # replaced closure which contains new cells.
+    separated_body = type(body)(
+        body.__code__, body.__globals__, body.__name__, body.__defaults__,
+        closure=body.__closure__ and tuple(_make_cell(x.cell_contents) for x in body.__closure__))
+    separated_body.__annotations__ = body.__annotations__
+    separated_body.__doc__ = body.__doc__
+    separated_body.__kwdefaults__ = body.__kwdefaults__
+    separated_body.__module__ = body.__module__
+    return separated_body
+
+
 def spawn(taskid: Optional[TaskID] = None,
           dependencies=(), *,
           memory: int = None,
@@ -322,10 +479,12 @@ def spawn(taskid: Optional[TaskID] = None,
           data: Collection[Any] = None,
           input: Collection[Any] = (),
           output: Collection[Any] = (),
-          inout: Collection[Any] = ()
+          inout: Collection[Any] = (),
+          priority: int = 0,
+          batch: bool = True
           ):
     """
-    spawn(taskid: Optional[TaskID] = None, dependencies = (), *, memory: int = None, placement: Collection[Any] = None, ndevices: int = 1)
+    spawn(taskid: Optional[TaskID] = None, dependencies = (), *, memory: int = None, placement: Collection[Any] = None, ndevices: int = 1, priority: int = 0, batch: bool = True)
 
     Execute the body of the function as a new task. The task may start
     executing immediately, so it may execute in parallel with any
@@ -346,7 +505,14 @@ def spawn(taskid: Optional[TaskID] = None,
     :param placement: A collection of values (`~parla.device.Architecture`, `~parla.device.Device`, or array data) which \
        specify devices at which the task can be placed.
     :param ndevices: The number of devices the task will use. If `ndevices` is greater than 1, the `memory` is divided \
-       evenly between the devices. In the task: `len(get_current_devices()) == ndevices<get_current_devices>`.
+       evenly between the devices. In the task: `len(get_current_devices()) == ndevices<get_current_devices>`. \
+       The task runs in a `~parla.environments.TaskEnvironment` of the scheduler with `ndevices` of the devices \
+       in `placement`, e.g. one with a `~parla.cuda.MultiGPUComponent`. Each operand in the dataflow is moved \
+       to a device of the environment which already has a copy of it, or else to the first one.
+    :param priority: The priority of the task. When several tasks are ready to run, tasks with a higher priority \
+       are launched first. Tasks with the same priority are launched in the order they became ready.
+    :param batch: If false, the task never runs in a batch with other ready tasks with the same body \
+       (see the `max_batch_size` argument of `~parla.task_runtime.Scheduler`), e.g. because it synchronizes with them.
 
     The declared task (`t` above) can be used as a dependency for later tasks (in place of the tasks ID).
     This same value is stored into the task space used in `taskid`.
@@ -358,9 +524,8 @@ def spawn(taskid: Optional[TaskID] = None,
     # TODO: Document tags argument
 
     if not taskid:
-        taskid = TaskID("global_" + str(len(task_locals.global_tasks)),
-                        (len(task_locals.global_tasks),))
-        task_locals.global_tasks += [taskid]
+        serial = task_runtime.next_anonymous_task_id()
+        taskid = TaskID("global_" + str(serial), (serial,))
 
     def decorator(body) -> ComputeTask:
         nonlocal placement, memory
@@ -385,22 +550,7 @@ def spawn(taskid: Optional[TaskID] = None,
             raise TypeError(
                 "Spawned tasks must be normal functions or coroutines; not generators.")
 
-        if inspect.iscoroutine(body):
-            # An already running coroutine does not need changes since we assume
-            # it was changed correctly when the original function was spawned.
-            separated_body = body
-        else:
-            # Perform a horrifying hack to build a new function which will
-            # not be able to observe changes in the original cells in the
-            # tasks outer scope. To do this we build a new function with a
-            # replaced closure which contains new cells.
-            separated_body = type(body)(
-                body.__code__, body.__globals__, body.__name__, body.__defaults__,
-                closure=body.__closure__ and tuple(_make_cell(x.cell_contents) for x in body.__closure__))
-            separated_body.__annotations__ = body.__annotations__
-            separated_body.__doc__ = body.__doc__
-            separated_body.__kwdefaults__ = body.__kwdefaults__
-            separated_body.__module__ = body.__module__
+        separated_body = _separate_body(body)
 
         # Compute the flat dependency set (including unwrapping TaskID objects)
         taskid.dependencies = dependencies
@@ -426,7 +576,9 @@ def spawn(taskid: Optional[TaskID] = None,
             taskid=taskid,
             req=req,
             dataflow=dataflow,
-            name=getattr(body, "__name__", None))
+            name=getattr(body, "__name__", None),
+            priority=priority,
+            batchable=batch)
 
         logger.debug("Created: %s %r", taskid, body)
 
@@ -442,9 +594,182 @@ def spawn(taskid: Optional[TaskID] = None,
     return decorator
 
 
+class _IndexSpace:
+    """
+    The indices of a range, or the index tuples of a tuple of ranges in row-major order, by position.
+    """
+
+    def __init__(self, indices: Union[range, Tuple[range, ...]]):
+        ranges = (indices,) if isinstance(indices, range) else tuple(indices)
+        if not ranges or not all(isinstance(r, range) for r in ranges):
+            raise TypeError("parallel_for iterates over a range or a tuple of ranges, not {!r}".format(indices))
+        self.ranges = ranges
+        self.size = 1
+        for r in ranges:
+            self.size *= len(r)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position: int) -> Tuple:
+        """
+        :return: The index at `position` as a tuple.
+        """
+        index = []
+        for r in reversed(self.ranges):
+            position, i = divmod(position, len(r))
+            index.append(r[i])
+        return tuple(reversed(index))
+
+    def slice(self, start: int, stop: int) -> Iterable[Tuple]:
+        """
+        :return: The indices at the positions from `start` to `stop` as tuples.
+        """
+        if len(self.ranges) == 1:
+            return ((i,) for i in self.ranges[0][start:stop])
+        return (self[p] for p in range(start, stop))
+
+
+def parallel_for(taskspace: TaskSpace, indices: Union[range, Tuple[range, ...]], *,
+                 dependencies=(),
+                 chunk: int = 1,
+                 dynamic: bool = False,
+                 memory: int = None,
+                 vcus: float = None,
+                 placement: Union[Collection[PlacementSource], Any, None] = None,
+                 ndevices: int = 1,
+                 tags: Collection[Any] = (),
+                 input: Collection[Any] = (),
+                 output: Collection[Any] = (),
+                 inout: Collection[Any] = (),
+                 priority: int = 0,
+                 batch: bool = True):
+    """
+    Execute the body of the function for every index of `indices` in tasks of
+    `taskspace`. This spawns the tasks of the whole range at once, which is much
+    faster than spawning them one at a time with `spawn`.
+
+    >>> @parallel_for(T, range(n), dependencies=lambda i: [S[i]], placement=cpu, chunk=16)
+    ... def step(i):
+    ...     code
+
+    With `indices=(range(n), range(m))`, the body is called as `step(i, j)`.
+
+    :param taskspace: The `TaskSpace` of the tasks. A task is identified by the first index it runs, \
+       e.g. `T[i]` or `T[i, j]`. With `chunk=1`, there is a task for every index.
+    :param indices: A range or a tuple of ranges.
+    :param dependencies: The dependencies of all tasks (as for `spawn`), or a function which returns \
+       the dependencies of the task of an index. A task of several indices depends on the \
+       dependencies of all of them.
+    :param chunk: The number of consecutive indices run by each task.
+    :param dynamic: If true, one task starts with the whole range, which it runs `chunk` indices at \
+       a time. Whenever a worker thread is idle, the task splits off the second half of its remaining \
+       indices into a new task (lazy binary splitting). The task completes once all the tasks split \
+       off from it have completed. This balances the load of bodies with varying costs.
+    :param input: The operands of every task, as for `spawn` (and so are `output` and `inout`). \
+       They do not order the tasks: tasks which write the same data need `dependencies` between them.
+
+    The other parameters are those of `spawn` and apply to every task.
+
+    :return: The tasks of the range (for `dynamic`, the first task).
+    """
+    if chunk < 1:
+        raise ValueError("The chunk size must be at least 1, not {}".format(chunk))
+    space = _IndexSpace(indices)
+
+    def decorator(body) -> tasks:
+        if inspect.iscoroutinefunction(body) or inspect.isgeneratorfunction(body):
+            raise TypeError("parallel_for bodies must be normal functions.")
+        body = _separate_body(body)
+
+        resources = {}
+        if memory is not None:
+            resources["memory"] = memory
+        if vcus is not None:
+            resources["vcus"] = vcus
+        req = DeviceSetRequirements(resources, ndevices, get_placement_for_any(placement), tags)
+        dataflow = Dataflow(list(input), list(output), list(inout))
+        name = getattr(body, "__name__", None)
+
+        scheduler = get_scheduler_context()
+        if isinstance(scheduler, WorkerThread):
+            scheduler = scheduler.scheduler
+
+        # Compute the dependencies shared by all tasks once.
+        shared_dependencies = None
+        if not callable(dependencies):
+            shared_dependencies = tasks(*dependencies)._flat_tasks
+
+        def chunk_dependencies(start: int, stop: int) -> List[Union[TaskID, Task]]:
+            if shared_dependencies is not None:
+                return shared_dependencies
+            unique = {}
+            for index in space.slice(start, stop):
+                for d in tasks(*dependencies(*index))._flat_tasks:
+                    unique[id(d)] = d
+            return list(unique.values())
+
+        def spawn_chunk(function, start: int, task_dependencies) -> ComputeTask:
+            taskid = taskspace._taskid(space[start])
+            task = scheduler.spawn_task(
+                function=_task_callback,
+                args=(function,),
+                dependencies=task_dependencies,
+                taskid=taskid,
+                req=req,
+                dataflow=dataflow,
+                name=name,
+                priority=priority,
+                batchable=batch)
+            for scope in task_locals.task_scopes:
+                scope.append(task)
+            return task
+
+        def static_chunk(start: int, stop: int):
+            def run_chunk():
+                for index in space.slice(start, stop):
+                    body(*index)
+            return run_chunk
+
+        def dynamic_chunk(start: int, stop: int):
+            async def run_range():
+                lo, hi = start, stop
+                split_off = []
+                while lo < hi:
+                    if hi - lo > chunk and scheduler.has_idle_workers():
+                        middle = (lo + hi + 1) // 2
+                        # The dependencies of the split-off indices are satisfied already.
+                        split_off.append(spawn_chunk(dynamic_chunk(middle, hi), middle, ()))
+                        scheduler.start_scheduler_callbacks()
+                        hi = middle
+                    end = min(lo + chunk, hi)
+                    for index in space.slice(lo, end):
+                        body(*index)
+                    lo = end
+                if split_off:
+                    await tasks(*split_off)
+            return run_range
+
+        spawned = []
+        with scheduler.deferred_spawns():
+            if dynamic and len(space):
+                spawned.append(spawn_chunk(dynamic_chunk(0, len(space)), 0, chunk_dependencies(0, len(space))))
+            elif not dynamic:
+                for start in range(0, len(space), chunk):
+                    stop = min(start + chunk, len(space))
+                    spawned.append(spawn_chunk(static_chunk(start, stop), start, chunk_dependencies(start, stop)))
+
+        # Activate the scheduler once for all tasks
+        scheduler.start_scheduler_callbacks()
+        return tasks(*spawned)
+
+    return decorator
+
+
 @contextmanager
 def _reserve_persistent_memory(memsize, device):
     resource_pool = get_scheduler_context().scheduler._available_resources
+    resource_pool.evict_for(device, memsize)
     resource_pool.allocate_resources(
         device, {'memory': memsize}, blocking=True)
     try:
@@ -609,3 +934,150 @@ async def finish():
         removed_tasks = task_locals.task_scopes.pop()
         assert removed_tasks is my_tasks
         await tasks(my_tasks)
+
+
+_graph_serials = count()
+
+
+class TaskGraph(TaskSet):
+    """
+    A graph of tasks recorded by `capture`. Awaiting it waits for its latest instance.
+    """
+
+    def __init__(self, name="graph"):
+        self.name = name
+        # Tells apart the tasks of graphs with the same name
+        self._serial = next(_graph_serials)
+        self._nodes: List[task_runtime.GraphNode] = []
+        # The tasks of the latest instance (the captured one or the last replay)
+        self._instance: List[Task] = []
+        self._replays = 0
+        # Indices of the dependencies of each node in the graph, whether the node
+        # had dependencies outside the graph, and the nodes without dependents.
+        self._internal: Optional[List[List[int]]] = None
+        self._external: Optional[List[bool]] = None
+        self._sinks: Optional[List[int]] = None
+        # For each node, the same for each of its data movement tasks
+        self._datamove_dependencies: Optional[List[List[Tuple[List[int], bool]]]] = None
+
+    @property
+    def _tasks(self) -> Collection:
+        return self._instance
+
+    def _prepare(self):
+        positions = {node: i for i, node in enumerate(self._nodes)}
+        if self._internal is None:
+            splits = []
+            for node in self._nodes:
+                dependencies = []
+                for d in node.dependencies:
+                    if isinstance(d, TaskID):
+                        task = d.task
+                        if task is None and d.completed:
+                            # Released completed tasks cannot block a replay.
+                            continue
+                        if task is None:
+                            raise ValueError("Cannot replay a graph which depends on the unspawned task {}.".format(d))
+                        d = task
+                    dependencies.append(d)
+                splits.append(node.split_dependencies(dependencies))
+            self._internal = [[positions[n] for n in internal] for internal, _ in splits]
+            self._external = [external for _, external in splits]
+            has_dependents = {j for internal in self._internal for j in internal}
+            self._sinks = [i for i in range(len(self._nodes)) if i not in has_dependents]
+            # Only the indices are needed from now on.
+            for node in self._nodes:
+                node.dependencies = None
+        if self._datamove_dependencies is None and all(node.is_mapped for node in self._nodes):
+            self._datamove_dependencies = [
+                [([positions[n] for n in internal], external) for _, _, internal, external in node.datamoves]
+                for node in self._nodes]
+
+    def replay(self, dependencies=None) -> tasks:
+        """
+        Spawn the tasks of the graph again, with the same bodies (and so the same
+        captured variables), placements and data movement tasks.
+
+        Each replay stands for the iteration after the previous instance of the
+        graph: dependencies on tasks outside the graph are replaced by dependencies
+        on the final tasks of the previous instance, or on `dependencies` if it is given.
+
+        If all captured tasks have been mapped, the replayed tasks are mapped
+        to the same devices and get the same data movement tasks without going
+        through the mapper. Otherwise they are spawned normally, as are the
+        tasks whose devices lack the resources for them at the time.
+
+        :return: The tasks of the new instance.
+        """
+        self._prepare()
+        scheduler = get_scheduler_context().scheduler
+        if dependencies is None:
+            after = [self._instance[i] for i in self._sinks]
+        else:
+            after = tasks(*dependencies)._flat_tasks
+        replay = self._replays
+        self._replays += 1
+        instance = []
+        spawned = False
+        for i, node in enumerate(self._nodes):
+            taskid = TaskID(self.name, (self._serial, replay, i))
+            task_dependencies = [instance[j] for j in self._internal[i]]
+            if self._external[i]:
+                task_dependencies += after
+            task = None
+            if self._datamove_dependencies is not None:
+                datamove_dependencies = [[instance[j] for j in internal] + (after if external else [])
+                                         for internal, external in self._datamove_dependencies[i]]
+                task = scheduler._replay_task(node, taskid, task_dependencies, datamove_dependencies)
+            if task is None:
+                task = scheduler.spawn_task(node.function, node.args, task_dependencies, taskid,
+                                            node.req, node.dataflow, node.name, node.priority,
+                                            node.batchable)
+                spawned = True
+            instance.append(task)
+        if spawned:
+            scheduler.start_scheduler_callbacks()
+        self._instance = instance
+        return tasks(*instance)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __repr__(self):
+        return "TaskGraph({!r}, {} tasks, {} replays)".format(self.name, len(self._nodes), self._replays)
+
+
+@contextmanager
+def capture(name="graph"):
+    """
+    Record the tasks spawned by the body of the `with` (but not by those
+    tasks) into a `TaskGraph` which can be replayed. This removes the
+    cost of spawning and mapping repeated task graphs, such as the tasks
+    of a timestep loop.
+
+    >>> with capture() as step:
+    ...     for i in range(n):
+    ...         @spawn(T[0, i], [T[-1, i]], inout=[blocks[i]])
+    ...         def task():
+    ...             code
+    >>> for t in range(1, steps):
+    ...     step.replay()
+    >>> await step
+
+    The tasks run normally while they are captured. The captured bodies
+    are replayed as they are, so variables they capture keep the values
+    they had in the captured iteration.
+    """
+    graph = TaskGraph(name)
+    task_locals.capture_scopes.append(graph._nodes)
+    try:
+        yield graph
+    finally:
+        removed_nodes = task_locals.capture_scopes.pop()
+        assert removed_nodes is graph._nodes
+        graph._instance = [node.task for node in graph._nodes]
+        # Dependents spawned in the block have raised the ranks of the tasks by now.
+        # Keep the ranks for the replays, but not the tasks.
+        for node in graph._nodes:
+            node.rank = node.task.rank
+            node.task = None
@@ -0,0 +1,223 @@
+"""
+A timeline tracer for the runtime.
+
+The tracer records when every task is spawned, mapped, scheduled, launched,
+started and finished, and how long each pass of the mapping, scheduling and
+launching phases takes. `Tracer.save` writes the records as a Chrome
+trace-event JSON file, which can be opened in `chrome://tracing` or
+https://ui.perfetto.dev:
+
+* The execution of each task is a slice on the track of the worker thread
+  that ran it. Its arguments hold the times of the earlier stages.
+* Spawn, map, schedule and launch are instant events on the track of the
+  thread which performed them.
+* Each pass of a scheduler phase which handled tasks is a slice on the
+  track of the thread which ran it.
+
+Enable it with `Parla(trace="path/to/trace.json")` or by setting the
+environment variable `PARLA_TRACE` to a path. The file is written when
+the scheduler exits.
+
+For finer-grained, always-available instrumentation of the hot paths, see
+`EventRecorder` below.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+__all__ = ["Tracer", "get_tracer", "EventRecorder", "event_recorder"]
+
+def _task_name(task) -> str:
+    return task.taskid.full_name
+
+
+class Tracer:
+    """
+    Collects trace events in memory. Recording an event only appends a tuple
+    to a list; formatting is deferred until the trace is saved.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._origin = time.perf_counter()
+        # (stage, task name, thread id, time)
+        self._stages: List[Tuple[str, str, int, float]] = []
+        # (task name, category, devices, thread id, start time, end time)
+        self._runs: List[Tuple[str, str, Tuple[str, ...], int, float, float]] = []
+        # (phase, thread id, start time, end time, number of tasks handled)
+        self._phases: List[Tuple[str, int, float, float, int]] = []
+        self._thread_names = {}
+
+    def _thread(self) -> int:
+        ident = threading.get_ident()
+        if ident not in self._thread_names:
+            self._thread_names[ident] = threading.current_thread().name
+        return ident
+
+    def task_stage(self, task, stage: str):
+        """Record that `task` reached `stage` (one of spawn, map, schedule and launch) now."""
+        self._stages.append((stage, _task_name(task), self._thread(), time.perf_counter()))
+
+    def task_ran(self, task, start: float, end: float):
+        """Record the execution of a task body between `perf_counter` times `start` and `end`."""
+        category = "compute" if hasattr(task, "dataflow") else "datamove"
+        devices = tuple(str(d) for d in task.req.devices)
+        self._runs.append((_task_name(task), category, devices, self._thread(), start, end))
+
+    def phase(self, name: str, start: float, end: float, ntasks: int):
+        """Record a pass of a scheduler phase which handled `ntasks` tasks."""
+        self._phases.append((name, self._thread(), start, end, ntasks))
+
+    def _us(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 3)
+
+    def events(self) -> List[dict]:
+        """
+        :return: The trace events recorded so far in the Chrome trace-event format.
+        """
+        pid = os.getpid()
+        events = [dict(name="thread_name", ph="M", pid=pid, tid=tid, args=dict(name=name))
+                  for tid, name in list(self._thread_names.items())]
+        stage_times = {}
+        for stage, name, tid, t in list(self._stages):
+            stage_times.setdefault(name, {})[stage] = self._us(t)
+            events.append(dict(name=stage, cat="task", ph="i", s="t", pid=pid, tid=tid,
+                               ts=self._us(t), args=dict(task=name)))
+        for name, category, devices, tid, start, end in list(self._runs):
+            args = dict(devices=list(devices))
+            args.update(stage_times.get(name, {}))
+            events.append(dict(name=name, cat=category, ph="X", pid=pid, tid=tid,
+                               ts=self._us(start), dur=round((end - start) * 1e6, 3), args=args))
+        for name, tid, start, end, ntasks in list(self._phases):
+            events.append(dict(name=name, cat="scheduler", ph="X", pid=pid, tid=tid,
+                               ts=self._us(start), dur=round((end - start) * 1e6, 3),
+                               args=dict(tasks=ntasks)))
+        return events
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=self.events(), displayTimeUnit="ms"), f)
+
+    def __repr__(self):
+        return "Tracer({!r}, {} runs)".format(self.path, len(self._runs))
+
+
+def get_tracer(trace) -> Optional[Tracer]:
+    """
+    :param trace: A Tracer, a path, or None to use the path in `PARLA_TRACE` if it is set.
+    """
+    if isinstance(trace, Tracer):
+        return trace
+    trace = trace or os.environ.get("PARLA_TRACE")
+    if trace:
+        return Tracer(trace)
+    return None
+
+
+# Codes of the events of the event recorder
+TASK_START, TASK_FINISH, TASK_RUNNING, TASK_COMPLETED, TASK_EXCEPTION, DEPENDENCY_DONE, \
+    SCHEDULE, LAUNCH, ALLOCATE, DEALLOCATE, ALLOCATE_FAILED, \
+    MAP_PASS, SCHEDULE_PASS, LAUNCH_PASS, MAP_SKIPPED, SCHEDULE_SKIPPED, LAUNCH_SKIPPED = range(17)
+
+event_names = (
+    "task_start", "task_finish", "task_running", "task_completed", "task_exception", "dependency_done",
+    "schedule", "launch", "allocate", "deallocate", "allocate_failed",
+    "map_pass", "schedule_pass", "launch_pass", "map_skipped", "schedule_skipped", "launch_skipped",
+)
+
+
+class _RingBuffer:
+    __slots__ = ["records", "position", "mask", "thread_name"]
+
+    def __init__(self, size: int, thread_name: str):
+        self.records = [None] * size
+        self.position = 0
+        self.mask = size - 1
+        self.thread_name = thread_name
+
+    def __iter__(self):
+        size = len(self.records)
+        start = max(self.position - size, 0)
+        for i in range(start, self.position):
+            yield self.records[i & self.mask]
+
+
+class EventRecorder:
+    """
+    A flight recorder for the hot paths of the runtime. Each thread appends
+    compact records (event code, task serial number, device index, time in
+    nanoseconds) to its own preallocated ring buffer, which keeps the most
+    recent records and needs no lock. Unlike logging, nothing is formatted
+    until the records are dumped, and a disabled recorder costs the caller
+    only a check of `enabled`:
+
+        if event_recorder.enabled:
+            event_recorder.record(LAUNCH, task.serial, device_index)
+
+    Unused fields are -1. For the `*_pass` events, the task field holds the
+    number of tasks the pass handled.
+
+    Enable it with `event_recorder.enable()` or by setting the environment
+    variable `PARLA_EVENT_BUFFER` to the number of records kept per thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.size = 0
+        self._local = threading.local()
+        self._buffers: List[_RingBuffer] = []
+        self._monitor = threading.Lock()
+
+    def enable(self, size: int = 1 << 16):
+        """Start recording, keeping the last `size` (rounded up to a power of two) records of each thread."""
+        with self._monitor:
+            self.size = 1 << max(size - 1, 0).bit_length()
+            self._local = threading.local()
+            self._buffers = []
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording. The records so far are kept until the next `enable`."""
+        self.enabled = False
+
+    def _new_buffer(self) -> _RingBuffer:
+        buffer = _RingBuffer(self.size, threading.current_thread().name)
+        with self._monitor:
+            self._buffers.append(buffer)
+        self._local.buffer = buffer
+        return buffer
+
+    def record(self, code: int, task: int = -1, device: int = -1):
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._new_buffer()
+        buffer.records[buffer.position & buffer.mask] = (code, task, device, time.perf_counter_ns())
+        buffer.position += 1
+
+    def records(self) -> List[Tuple[str, str, int, int, int]]:
+        """
+        :return: The records of all threads as (thread name, event name, task, device, time in ns), ordered by time.
+        """
+        with self._monitor:
+            buffers = list(self._buffers)
+        records = [(buffer.thread_name, event_names[code], task, device, t)
+                   for buffer in buffers for code, task, device, t in buffer]
+        records.sort(key=lambda r: r[-1])
+        return records
+
+    def dump(self, file=None):
+        """Write the records to `file` (stderr by default), one per line."""
+        file = file or sys.stderr
+        for thread_name, name, task, device, t in self.records():
+            print("{} {} {} task={} device={}".format(t, thread_name, name, task, device), file=file)
+
+
+# The event recorder of the runtime
+event_recorder = EventRecorder()
+if os.environ.get("PARLA_EVENT_BUFFER"):
+    event_recorder.enable(int(os.environ["PARLA_EVENT_BUFFER"]))
@@ -0,0 +1,62 @@
+import json
+
+from parla import Parla
+from parla.cpu import cpu
+from parla.history import TaskHistory
+from parla.tasks import spawn, TaskSpace
+
+
+class HistoryTask:
+    def __init__(self, func, dataflow=None):
+        self.code = func.__code__
+        self.dataflow = dataflow
+
+
+def gemm(): pass
+def trsm(): pass
+
+
+def test_history_lookup():
+    history = TaskHistory()
+    history.record(HistoryTask(gemm), "cpu", 2.0)
+    history.record(HistoryTask(gemm), "cpu", 4.0)
+    history.record(HistoryTask(gemm), "gpu", 1.0)
+    assert history.lookup(HistoryTask(gemm), "cpu") == 3.0
+    assert history.lookup(HistoryTask(gemm), "gpu") == 1.0
+    assert history.lookup(HistoryTask(gemm)) == 7.0 / 3
+    assert history.lookup(HistoryTask(trsm), "cpu") is None
+
+
+def test_history_persistence(tmp_path):
+    path = str(tmp_path / "history.json")
+    history = TaskHistory(path)
+    history.record(HistoryTask(gemm), "cpu", 2.0)
+    history.save()
+    assert json.load(open(path))["entries"][0]["mean"] == 2.0
+
+    reloaded = TaskHistory(path)
+    assert len(reloaded) == 1
+    assert reloaded.lookup(HistoryTask(gemm), "cpu") == 2.0
+
+
+def test_history_corrupt_file(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text("{")
+    assert len(TaskHistory(str(path))) == 0
+
+
+def test_history_recorded_by_scheduler(tmp_path):
+    path = str(tmp_path / "history.json")
+    with Parla(history=path):
+        T = TaskSpace()
+        for i in range(3):
+            @spawn(T[i], placement=cpu)
+            def task():
+                pass
+
+    history = TaskHistory(path)
+    assert len(history) == 1
+    entry = json.load(open(path))["entries"][0]
+    assert entry["count"] == 3
+    assert entry["architecture"] == "cpu"
+    assert entry["task"].endswith("test_history_recorded_by_scheduler.<locals>.task")
@@ -87,6 +87,25 @@ def test_parray_task():
                 assert a[0] == 0
                 assert a._coherence.owner == 0
 
+
+def test_coherence_is_current():
+    coherence = Coherence(-1, 2)
+    assert coherence.is_current(-1, do_write=False)
+    assert coherence.is_current(-1, do_write=True)
+    assert not coherence.is_current(0, do_write=False)
+
+    coherence.read(0)
+    assert coherence.is_current(0, do_write=False)
+    assert not coherence.is_current(0, do_write=True)
+    # A complete copy holds all subarrays.
+    assert coherence.is_current(0, do_write=False, slices_hash=1)
+
+    coherence.write(1)
+    assert coherence.is_current(1, do_write=True)
+    assert not coherence.is_current(0, do_write=False)
+    assert not coherence.is_current(-1, do_write=False)
+
+
 if __name__=="__main__":
     test_parray_creation()
     test_parray_task()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from parla import parray
+from parla.cpu import cpu
+from parla.sim import Simulator
+from parla.task_runtime import CriticalPathScheduler
+from parla.tasks import spawn, TaskSpace
+
+
+def test_sim_chain():
+    sim = Simulator(cpus=1, gpus=2, task_time=0.5)
+    with sim:
+        T = TaskSpace("T")
+        for i in range(4):
+            @spawn(T[i], [T[i - 1]] if i else [], placement=sim.cpu)
+            def task():
+                raise AssertionError("Simulated tasks do not run")
+
+    report = sim.run()
+    assert report.makespan == 2.0
+    assert all(d.architecture.id == "cpu" for d in report.placements.values())
+    assert report.utilization[sim.cpu.devices[0]] == 1.0
+    assert report.bytes_moved == 0
+
+
+def test_sim_unconstrained_placement():
+    sim = Simulator(cpus=1, gpus=3, task_time=1.0)
+    with sim:
+        T = TaskSpace("T")
+        for i in range(8):
+            @spawn(T[i])
+            def task():
+                pass
+
+    report = sim.run("least_loaded")
+    assert report.makespan == 2.0
+    assert set(report.placements.values()) == set(sim.devices)
+
+
+def test_sim_data_movement():
+    sim = Simulator(cpus=1, gpus=4, bandwidths={("cpu", "gpu"): 1e9}, task_time=1e-3)
+    with sim:
+        T = TaskSpace("T")
+        blocks = [parray.asarray(np.zeros(125000)) for _ in range(8)]
+        for i, block in enumerate(blocks):
+            @spawn(T[i], placement=sim.gpu, inout=[block])
+            def task():
+                pass
+
+    report = sim.run("round_robin")
+    # Two tasks per GPU, each copying its 1MB block in 1ms and running for 1ms.
+    assert report.makespan == pytest.approx(4e-3)
+    assert report.bytes_moved == 8 * 1000000
+    assert all(report.bytes_moved_to[d] == 2 * 1000000 for d in sim.gpu.devices)
+    # The simulation is deterministic.
+    assert sim.run("round_robin").placements == report.placements
+
+
+@pytest.mark.parametrize("scheduler_class", [None, CriticalPathScheduler])
+def test_sim_priority(scheduler_class):
+    sim = Simulator(cpus=1, task_time=1.0)
+    with sim:
+        T = TaskSpace("T")
+        for i in range(3):
+            @spawn(T[i], placement=cpu, priority=i)
+            def task():
+                pass
+
+    report = sim.run(**({"scheduler_class": scheduler_class} if scheduler_class else {}))
+    assert report.makespan == 3.0
+    assert [T[i].task.start_time for i in range(3)] == [2.0, 1.0, 0.0]
@@ -1,6 +1,11 @@
+import threading
+
+import pytest
+
 from parla import get_all_devices, TaskEnvironment
 from parla.cpu import cpu
-from parla.task_runtime import Scheduler, Task, TaskCompleted, TaskRunning, DeviceSetRequirements
+from parla.task_runtime import Scheduler, Task, TaskCompleted, TaskRunning, DeviceSetRequirements, TaskQueue, \
+    TaskCostModel, ResourcePool
 from parla.tasks import TaskID
 
 task_id_next = 0
@@ -99,5 +104,269 @@ def test_exception_handling_state_restoration():
     test_flag_increment()
 
 
+def test_task_queue_order():
+    class PrioritizedTask:
+        def __init__(self, name, priority):
+            self.name = name
+            self.priority = priority
+    queue = TaskQueue(lambda t: (t.priority,))
+    for name, priority in [("a", 0), ("b", 2), ("c", 0), ("d", 1), ("e", 2)]:
+        queue.push(PrioritizedTask(name, priority))
+    assert len(queue) == 5
+    assert queue.peek().name == "b"
+    assert [queue.pop().name for _ in range(5)] == ["b", "e", "d", "a", "c"]
+    assert len(queue) == 0
+
+    tasks = [PrioritizedTask(name, 0) for name in "abc"]
+    for t in tasks:
+        queue.push(t)
+    tasks[2].priority = 1
+    assert queue.rekey(tasks[2])
+    assert not queue.rekey(PrioritizedTask("d", 2))
+    assert len(queue) == 3
+    assert [t.name for t in queue] == ["c", "a", "b"]
+    assert [queue.pop().name for _ in range(3)] == ["c", "a", "b"]
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_task_cost_model_ranks():
+    class GraphTask:
+        def __init__(self, func, dependencies=()):
+            self._mutex = threading.Lock()
+            self.code = func.__code__
+            self._state = TaskRunning(func, (), None)
+            self.dependencies = dependencies
+            self.rank = 0.0
+    def cheap(): pass
+    def expensive(): pass
+    costs = TaskCostModel()
+    costs.record(GraphTask(cheap), 1.0)
+    costs.record(GraphTask(expensive), 3.0)
+    costs.record(GraphTask(expensive), 5.0)
+    # A diamond: a -> (b, c) -> d
+    a = GraphTask(cheap)
+    b = GraphTask(expensive, [a])
+    c = GraphTask(cheap, [a])
+    d = GraphTask(cheap, [b, c])
+    assert costs.update_ranks(a) == [a]
+    assert costs.update_ranks(b) == [b, a]
+    assert costs.update_ranks(c) == [c]
+    assert costs.update_ranks(d) == [d, b, c, a]
+    assert [t.rank for t in (a, b, c, d)] == [6.0, 5.0, 2.0, 1.0]
+    # Unmeasured tasks cost the mean of the measured ones.
+    def unknown(): pass
+    assert costs.estimate(GraphTask(unknown)) == 2.5
+
+
+def test_resource_pool_parray_locality():
+    class HostArray:
+        def __init__(self, parent_ID, nbytes):
+            self.parent_ID = parent_ID
+            self.nbytes = nbytes
+        def exists_on_device(self, device_id):
+            return device_id == ResourcePool.CPU_INDEX
+        def nbytes_at(self, device_id):
+            return self.nbytes
+    pool = ResourcePool()
+    devices = pool.get_resources()
+    positions = pool.device_positions(devices)
+    a, b = HostArray(1, 100), HostArray(2, 50)
+    pool.track_parray(a)
+    local, total = pool.local_parray_nbytes([a, b], positions)
+    assert total == 150
+    assert [int(n) for n in local] == [100 if d.architecture == cpu else 0 for d in devices]
+    assert all(pool.parray_is_on_device(a, d) == (d.architecture == cpu) for d in devices)
+    pool.untrack_parray(a)
+    local, _ = pool.local_parray_nbytes([a, b], positions)
+    assert not local.any()
+
+
+@pytest.fixture
+def virtual_gpus(monkeypatch):
+    """Make resource pools see virtual GPUs with the given memory sizes,
+       after the host if `host` is true. Returns their architecture and them.
+    """
+    import parla.task_runtime
+    from parla.sim import VirtualArchitecture, VirtualDevice
+    gpu = VirtualArchitecture("Virtual GPU", "gpu")
+
+    def use(*memory, host=False):
+        devices = [VirtualDevice(gpu, i, memory=m) for i, m in enumerate(memory)]
+        all_devices = cpu.devices[:1] + devices if host else devices
+        monkeypatch.setattr(parla.task_runtime, "get_all_devices", lambda: all_devices)
+        return gpu, devices
+    return use
+
+
+def test_resource_pool_eviction(virtual_gpus):
+    _, (gpu,) = virtual_gpus(300)
+    evicted = []
+    class DeviceArray:
+        def __init__(self, parent_ID, on_host):
+            self.parent_ID = self.ID = parent_ID
+            self.nbytes = 100
+            self.on_host = on_host
+        def exists_on_device(self, device_id):
+            return False
+        def nbytes_at(self, device_id):
+            return self.nbytes
+        def _is_current_on(self, device_id, do_write=False):
+            return self.on_host
+        def evict(self, device_id, keep_one_copy):
+            assert device_id == 0 and keep_one_copy
+            evicted.append(self.parent_ID)
+    pool = ResourcePool()
+    a, b, c, d = DeviceArray(1, False), DeviceArray(2, True), DeviceArray(3, False), DeviceArray(4, False)
+    for parray in (a, b, c):
+        pool.pin_parrays([parray], gpu)
+        pool.register_parray_move(parray, gpu)
+    # Only unpinned copies are evicted, those valid on the host first.
+    pool.unpin_parrays([a, b], gpu)
+    assert not pool.evict_for(gpu, 250)
+    assert pool.evict_for(gpu, 150)
+    assert evicted == [2, 1]
+    assert not pool.parray_is_on_device(a, gpu) and pool.parray_is_on_device(c, gpu)
+    # Mapping a task which needs memory spills the least recently used copy.
+    for parray in (a, b):
+        pool.pin_parrays([parray], gpu)
+        pool.register_parray_move(parray, gpu)
+    pool.unpin_parrays([c], gpu)
+    pool.unpin_parrays([a], gpu)
+    pool.pin_parrays([d], gpu)
+    pool.register_parray_move(d, gpu)
+    assert pool.check_resources_availability(gpu, {"memory": 0})
+    assert not pool.check_resources_availability(gpu, {"memory": 1})
+    assert evicted == [2, 1, 3]
+    assert pool.parray_is_on_device(a, gpu) and pool.parray_is_on_device(d, gpu)
+    # A copy registered without free memory gives none back when it is removed.
+    pool.pin_parrays([a], gpu)
+    e = DeviceArray(5, False)
+    pool.register_parray_move(e, gpu)
+    assert pool.parray_is_on_device(e, gpu) and evicted == [2, 1, 3]
+    pool.remove_parray_from_device(e, gpu)
+    assert pool.available_resources(gpu)["memory"] == 0
+    # Eviction does not help tasks which lack other resources.
+    pool.unpin_parrays([a, b, d], gpu)
+    assert not pool.fitting_devices(pool.device_positions([gpu]), {"memory": 100, "vcus": 2},
+                                    except_memory=True)[0]
+
+
+def test_resource_pool_slots(virtual_gpus):
+    gpu, (gpu0, gpu1) = virtual_gpus(100, 100, host=True)
+    host = cpu.devices[0]
+    pool = ResourcePool({gpu: dict(compute=1), gpu1: dict(copy_in=None), host: dict(copy_out=1)})
+    assert pool.limits_slots("copy_out") and pool.limits_any_slot([(gpu0, "copy_in")])
+    # The host has only the slots it is given, and gpu1 has no limit on its copy_in.
+    assert not pool.limits_any_slot([(host, "compute"), (gpu1, "copy_in")])
+    assert pool.acquire_slots([(gpu0, "compute"), (host, "compute")])
+    assert not pool.acquire_slots([(gpu0, "compute")])
+    # Slots are acquired all or none.
+    assert not pool.acquire_slots([(gpu1, "compute"), (gpu0, "compute")])
+    assert pool.acquire_slots([(gpu1, "compute")])
+    for _ in range(3):
+        assert pool.acquire_slots([(gpu1, "copy_in"), (gpu0, "copy_in")])
+    assert not pool.acquire_slots([(gpu0, "copy_in"), (host, "copy_out")])
+    assert pool.acquire_slots([(host, "copy_out")])
+    pool.release_slots([(gpu0, "compute"), (gpu0, "copy_in")])
+    assert pool.acquire_slots([(gpu0, "compute"), (gpu0, "copy_in")])
+    with pytest.raises(ValueError):
+        ResourcePool({gpu: dict(copy=1)})
+
+
+def test_resource_pool_fixed_point(virtual_gpus):
+    import numpy as np
+    gpu, (gpu0, gpu1) = virtual_gpus(100, 50)
+    pool = ResourcePool({gpu1: dict(compute=None)})
+    # Fractions of vcus add up exactly, however often they are allocated.
+    for _ in range(100):
+        for _ in range(3):
+            assert pool.allocate_resources(gpu0, {"vcus": 1 / 3})
+        assert not pool.allocate_resources(gpu0, {"vcus": 1 / 3})
+        for _ in range(3):
+            pool.deallocate_resources(gpu0, {"vcus": 1 / 3})
+    assert pool.available_resources(gpu0)["vcus"] == 1
+    positions = pool.device_positions([gpu0, gpu1])
+    assert list(pool.fitting_devices(positions, {"memory": 40, "vcus": 0.5})) == [True, True]
+    assert list(pool.fitting_devices(positions, {"memory": 40}, np.array([60, 20]))) == [True, False]
+    # Only gpu0 limits its compute slots.
+    assert list(pool.fitting_devices(positions, {"compute_slots": 1})) == [True, False]
+    with pytest.raises(ValueError):
+        pool.allocate_resources(gpu1, {"compute_slots": 1})
+    with pytest.raises(ValueError):
+        pool.check_resources_availability(gpu0, {"threads": 1})
+
+
+def test_mapping_policies():
+    import numpy as np
+    from parla.mapping import MappingView, get_mapping_policy, LocalityPolicy, LeastLoadedPolicy
+    def view(local_data, load):
+        local_data = np.array(local_data, dtype=float)
+        return MappingView(None, ["d0", "d1", "d2"], local_data, local_data.max() - local_data,
+                           np.full(3, 1000.0), np.array(load))
+    def best(policy, v):
+        return int(np.argmax(policy.suitability(v)))
+    assert best(LocalityPolicy(), view([0, 500, 0], [1, 1, 1])) == 1
+    assert best(LocalityPolicy(local_data_weight=0, nonlocal_data_weight=0), view([0, 500, 0], [3, 0, 3])) == 1
+    assert best(LeastLoadedPolicy(), view([500, 0, 0], [2, 1, 1])) == 1
+    assert best(get_mapping_policy("least_loaded"), view([0, 0, 0], [2, 2, 1])) == 2
+    round_robin = get_mapping_policy("round_robin")
+    assert [best(round_robin, view([0, 0, 0], [0, 0, 0])) for _ in range(4)] == [0, 1, 2, 0]
+    assert len(get_mapping_policy("random").suitability(view([0, 0, 0], [0, 0, 0]))) == 3
+    with pytest.raises(ValueError):
+        get_mapping_policy("fastest")
+
+
+def test_earliest_finish_time_policy():
+    import numpy as np
+    from parla.mapping import MappingView, PerformanceModel, EarliestFinishTimePolicy
+    class Architecture:
+        def __init__(self, id):
+            self.id = id
+    class Device:
+        def __init__(self, architecture, index):
+            self.architecture = architecture
+            self.index = index
+    class MappedTask:
+        def __init__(self, func):
+            self.code = func.__code__
+    def gemm(): pass
+    def trsm(): pass
+    fast, slow = Architecture("fast"), Architecture("slow")
+    devices = [Device(slow, 0), Device(fast, 0), Device(fast, 1)]
+    model = PerformanceModel(bandwidths={("slow", "fast"): 1e3}, default_bandwidth=1e6)
+    policy = EarliestFinishTimePolicy(model)
+    policy.set_devices(devices)
+    positions = np.arange(3)
+    def view(task, nonlocal_data=0.0):
+        return MappingView(task, devices, np.zeros(3), np.full(3, nonlocal_data), np.ones(3), np.zeros(3), positions)
+    def best(task):
+        return int(np.argmax(policy.suitability(view(task))))
+
+    for d, t in ((0, 4.0), (1, 1.0)):
+        task = MappedTask(gemm)
+        policy.task_mapped(task, devices[d], d)
+        policy.task_finished(task, t)
+    # gemm takes 4s on slow devices and 1s on fast ones.
+    assert list(model.execution_times(MappedTask(gemm), devices)) == [4.0, 1.0, 1.0]
+    # Unknown tasks take the mean time of their architecture.
+    assert model.predict(MappedTask(trsm), "fast") == 1.0
+    # Pending work delays a device.
+    pending = MappedTask(gemm)
+    policy.task_mapped(pending, devices[1], 1)
+    assert best(MappedTask(gemm)) == 2
+    policy.task_finished(pending, None)
+    assert not model.pending_work.any()
+    # A task on several devices is pending on all of them until it finishes.
+    pending = MappedTask(gemm)
+    for d in (1, 2):
+        policy.task_mapped(pending, devices[d], d)
+    assert list(model.pending_work) == [0.0, 1.0, 1.0]
+    policy.task_finished(pending, 1.0)
+    assert not model.pending_work.any()
+    # Data on the slow device is slow to move to the fast ones.
+    assert list(model.transfer_times([(1000, np.array([True, False, False]))], positions)) == [0.0, 1.0, 1.0]
+
+
 # TODO: Add tests for ResourcePool. Sadly they will need to be multithreaded tests since correct blocking
 #  is very important. :-/ PITA.
\ No newline at end of file
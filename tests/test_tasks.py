@@ -11,6 +11,7 @@ from pytest import skip
 from parla import Parla, array, TaskEnvironment
 from parla.cpu import cpu
 from parla.tasks import *
+from parla.task_runtime import get_current_devices
 
 logger = logging.getLogger(__name__)
 
@@ -229,6 +230,472 @@ def test_dependencies(runtime_sched):
     assert task_results == [0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10]
 
 
+@pytest.mark.parametrize("work_stealing", [False, True])
+def test_work_stealing(monkeypatch, work_stealing):
+    from parla.task_runtime import Scheduler
+    task_results = []
+    local_tasks = []
+    can_launch_locally = Scheduler._can_launch_locally
+    def counting_can_launch_locally(self, task):
+        local = can_launch_locally(self, task)
+        if local:
+            local_tasks.append(task)
+        return local
+    monkeypatch.setattr(Scheduler, "_can_launch_locally", counting_can_launch_locally)
+    # The only worker is busy when its task makes the next one ready.
+    with Parla(work_stealing=work_stealing, n_threads=1):
+        @spawn()
+        async def task():
+            C = TaskSpace()
+            for c in range(4):
+                for i in range(10):
+                    @spawn(C[c, i], [C[c, i-1]] if i > 0 else [])
+                    def subtask():
+                        sleep(0.001)
+                        task_results.append((c, i))
+
+    assert len(task_results) == 40
+    for c in range(4):
+        assert [i for d, i in task_results if d == c] == list(range(10))
+    assert bool(local_tasks) == work_stealing
+
+
+@pytest.mark.parametrize("policy", ["locality", "round_robin", "least_loaded", "random", "eft"])
+def test_mapping_policy(policy):
+    task_results = []
+    with Parla(policy=policy):
+        C = TaskSpace()
+        for i in range(10):
+            @spawn(C[i], [C[i-1]] if i > 0 else [], placement=cpu)
+            def subtask():
+                task_results.append(i)
+
+    assert task_results == list(range(10))
+
+
+def test_critical_path_scheduler():
+    from parla.task_runtime import CriticalPathScheduler
+    task_results = []
+    with Parla(scheduler_class=CriticalPathScheduler):
+        C = TaskSpace()
+        for i in range(10):
+            @spawn(C[i], [C[i-1]] if i > 0 else [])
+            def subtask():
+                task_results.append(i)
+
+    assert task_results == list(range(10))
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_batching(batch):
+    from parla.task_runtime import get_scheduler_context
+    batch_sizes = []
+    with Parla(max_batch_size=8):
+        B = TaskSpace()
+
+        @spawn(B[-1])
+        def gate():
+            sleep(0.05)
+
+        for i in range(32):
+            @spawn(B[i], [B[-1]], placement=cpu, batch=batch)
+            def subtask():
+                batch_sizes.append(len(get_scheduler_context().batch))
+
+    assert len(batch_sizes) == 32
+    if batch:
+        assert max(batch_sizes) < 8
+        # With a single worker, the tasks made ready by the gate queue up behind it.
+        if len(cpu.devices) == 1:
+            assert max(batch_sizes) > 0
+    else:
+        assert max(batch_sizes) == 0
+
+
+@pytest.mark.parametrize("chunk,dynamic", [(1, False), (3, False), (2, True)])
+def test_parallel_for(chunk, dynamic):
+    results = {}
+    with Parla():
+        S = TaskSpace("S")
+        T = TaskSpace("T")
+
+        @parallel_for(S, range(10), chunk=chunk, dynamic=dynamic)
+        def first(i):
+            results[i] = i
+
+        # A dynamic range only has a task for its start, which completes after the others.
+        @parallel_for(T, (range(10), range(2)),
+                      dependencies=[first] if dynamic else lambda i, j: [S[i - i % chunk]],
+                      chunk=chunk, dynamic=dynamic)
+        def second(i, j):
+            results[i, j] = results[i] + j
+
+    assert [results[i] for i in range(10)] == list(range(10))
+    assert [results[i, j] for i in range(10) for j in range(2)] == [i + j for i in range(10) for j in range(2)]
+
+
+def test_parallel_for_dependencies():
+    task_results = []
+    with Parla():
+        T = TaskSpace("T")
+
+        @spawn(T[0])
+        def first():
+            sleep(0.05)
+            task_results.append(0)
+
+        @parallel_for(T, range(1, 5), dependencies=[T[0]])
+        def second(i):
+            task_results.append(i)
+
+    assert task_results[0] == 0
+    assert sorted(task_results) == list(range(5))
+
+
+@pytest.mark.parametrize("dynamic", [False, True])
+def test_parallel_for_operands(monkeypatch, dynamic):
+    from parla import parray
+    from parla.task_runtime import SchedulerContext
+    dataflows = []
+    spawn_task = SchedulerContext.spawn_task
+    def recording_spawn_task(self, *args, **kwargs):
+        dataflows.append(kwargs["dataflow"])
+        return spawn_task(self, *args, **kwargs)
+    monkeypatch.setattr(SchedulerContext, "spawn_task", recording_spawn_task)
+    results = []
+    with Parla():
+        @spawn()
+        async def main():
+            blocks = [parray.asarray(np.arange(4.0)), parray.asarray(np.zeros(4))]
+            dataflows.clear()
+
+            @parallel_for(TaskSpace("T"), range(4), input=blocks[:1], output=blocks[1:], dynamic=dynamic)
+            def step(i):
+                results.append(float(blocks[0][i]))
+            await step
+            assert dataflows and all(d.input == blocks[:1] and d.output == blocks[1:] and d.inout == []
+                                     for d in dataflows)
+
+    assert sorted(results) == [0, 1, 2, 3]
+
+
+def test_dense_task_space_ranges():
+    task_results = []
+    with Parla():
+        T = DenseTaskSpace("T")
+        # Depend on a range of tasks which are spawned later.
+        @spawn(T[4], [T[0:4]])
+        def last():
+            task_results.append(4)
+
+        for i in range(4):
+            @spawn(T[i], [T[0:i]])
+            def task():
+                sleep(0.01)
+                task_results.append(i)
+
+    assert task_results == [0, 1, 2, 3, 4]
+    assert len(T[0:5]) == 5 and T[2] in T[0:5]
+    assert T[0:5]._flat_tasks == []
+
+
+def test_dense_task_space_await():
+    task_results = []
+    with Parla():
+        T = DenseTaskSpace("T")
+
+        @spawn()
+        async def waiter():
+            await T[0:4]
+            task_results.append(len(task_results))
+
+        for i in range(4):
+            @spawn(T[i])
+            def task():
+                sleep(0.01)
+                task_results.append(i)
+
+    assert sorted(task_results[:4]) == [0, 1, 2, 3]
+    assert task_results[4] == 4
+
+
+def test_capture_replay():
+    from parla import parray
+    task_results = []
+    blocks = []
+    with Parla():
+        @spawn()
+        async def main():
+            blocks.extend(parray.asarray(np.zeros(1)) for _ in range(2))
+            T = TaskSpace()
+
+            @spawn(T[-1])
+            def init():
+                pass
+
+            with capture() as step:
+                # Replays of tasks which depend on tasks outside the graph
+                # wait for the previous instance.
+                for i in range(2):
+                    @spawn(T[i], [T[-1]], inout=[blocks[i]])
+                    def task():
+                        blocks[i][:] += 1
+                        task_results.append(i)
+
+                @spawn(T[2], [T[0], T[1]], input=blocks)
+                def total():
+                    task_results.append(sum(float(b[0]) for b in blocks))
+            # Once the captured tasks are mapped, replays skip the mapper.
+            await step
+            for _ in range(3):
+                step.replay()
+            await step
+            assert len(step) == 3
+
+    assert [float(b[0]) for b in blocks] == [4, 4]
+    assert task_results[2::3] == [2, 4, 6, 8]
+    assert sorted(task_results[0::3] + task_results[1::3]) == [0, 0, 0, 0, 1, 1, 1, 1]
+
+
+def test_capture_replay_ids():
+    replays = []
+    with Parla():
+        @spawn()
+        async def main():
+            graphs = []
+            for _ in range(2):
+                with capture() as graph:
+                    @spawn()
+                    def task():
+                        pass
+                graphs.append(graph)
+            await tasks(*graphs)
+            for graph in graphs:
+                replays.append(graph.replay())
+            await tasks(*replays)
+
+    names = [t.taskid.full_name for replay in replays for t in replay._flat_tasks]
+    assert len(set(names)) == 2
+
+
+def test_completed_tasks_released():
+    import gc
+    from parla.task_runtime import ComputeTask
+
+    def live_tasks(name):
+        gc.collect()
+        return [o for o in gc.get_objects() if isinstance(o, ComputeTask) and o.name == name]
+
+    with Parla():
+        T = TaskSpace("released")
+        for i in range(20):
+            @spawn(T[i], [T[i - 1]] if i > 0 else [])
+            def chained():
+                return i
+
+        @spawn()
+        def anonymous():
+            pass
+
+    # Only the last task, still bound to `chained`, is kept alive.
+    assert [t.taskid.id for t in live_tasks("chained")] == [(19,)]
+    assert T[19].task.result == 19
+    del chained
+    assert not live_tasks("chained")
+    assert T[19].task is None and T[19].completed
+    del anonymous
+    assert not live_tasks("anonymous")
+
+    # Released tasks still satisfy later dependencies.
+    with Parla():
+        @spawn(T[20], [T[19], T[0:19]])
+        async def after():
+            await T[18]
+            return 20
+    assert after.result == 20
+
+
+def test_data_access_records():
+    from parla import parray
+    from parla.task_runtime import get_scheduler_context
+    task_results = []
+    with Parla():
+        @spawn()
+        async def main():
+            a = parray.asarray(np.zeros(4))
+            T = TaskSpace("T")
+            for i in range(4):
+                @spawn(T[i], [T[i - 1]] if i > 0 else [], inout=[a[i:i + 1]])
+                def write():
+                    a[i:i + 1] += i
+
+            @spawn(T[4], [T[0:4]], input=[a])
+            def read():
+                task_results.append([float(x) for x in a])
+
+            await T[4]
+            # Completed tasks are dropped from the records of the data.
+            task_results.append(len(get_scheduler_context().scheduler._access_records))
+
+    assert task_results == [[0, 1, 2, 3], 0]
+
+
+def test_noop_data_movement_folded():
+    from parla import parray
+    from parla.tracing import Tracer
+    tracer = Tracer()
+    task_results = []
+    with Parla(trace=tracer):
+        a = parray.asarray(np.zeros(2))
+        T = TaskSpace("T")
+        for i in range(3):
+            @spawn(T[i], [T[i - 1]] if i > 0 else [], placement=cpu, inout=[a], input=[a[0:1]])
+            def task():
+                a[1:2] += 1
+                task_results.append(float(a[1]))
+
+    assert task_results == [1, 2, 3]
+    # The data is always valid on the CPU, so no data movement task runs.
+    assert [run for run in tracer._runs if run[1] == "datamove"] == []
+
+
+@pytest.fixture
+def recorded_moves(monkeypatch):
+    """Record (PArray ID, do_write, thread name, time) for each move of a PArray.
+       No data is valid on the device, so that tasks get data movement tasks.
+    """
+    import threading
+    import time
+    from parla.parray.core import PArray
+    moves = []
+    auto_move = PArray._auto_move
+
+    def recording_auto_move(self, device_id=None, do_write=False):
+        moves.append((self.ID, do_write, threading.current_thread().name, time.perf_counter()))
+        auto_move(self, device_id, do_write)
+
+    monkeypatch.setattr(PArray, "_is_current_on", lambda self, device_id, do_write=False: False)
+    monkeypatch.setattr(PArray, "_auto_move", recording_auto_move)
+    return moves
+
+
+def test_coalesced_data_movement(recorded_moves):
+    from parla import parray
+    from parla.tracing import Tracer
+    tracer = Tracer()
+    task_results = []
+    with Parla(trace=tracer):
+        a, b, c = (parray.asarray(np.full(2, i)) for i in range(3))
+
+        @spawn(placement=cpu, input=[a, b], inout=[c, c[0:1]])
+        def task():
+            c[0:2] += a.array + b.array
+            task_results.append(c.array.tolist())
+
+    assert task_results == [[3, 3]]
+    # One movement task copies all operands.
+    assert len([run for run in tracer._runs if run[1] == "datamove"]) == 1
+    moves = [move[:3] for move in recorded_moves]
+    assert sorted((ID, do_write) for ID, do_write, _ in moves) == \
+        sorted([(a.ID, False), (b.ID, False), (c.ID, True), (c[0:1].ID, True)])
+    # The operands of c are moved in order, by the same thread.
+    c_moves = [m for m in moves if m[0] in (c.ID, c[0:1].ID)]
+    assert [m[0] for m in c_moves] == [c.ID, c[0:1].ID] and c_moves[0][2] == c_moves[1][2]
+    assert any(name.startswith("parla-transfer") for _, _, name in moves)
+
+
+@pytest.mark.parametrize("prefetch_budget", [0, 1 << 20])
+def test_prefetch(recorded_moves, prefetch_budget):
+    import time
+    from parla import parray
+    finished = []
+    with Parla(prefetch_budget=prefetch_budget) as scheduler:
+        a, b = parray.asarray(np.zeros(2)), parray.asarray(np.ones(2))
+        T = TaskSpace("T")
+
+        @spawn(T[0], placement=cpu, inout=[a])
+        def write():
+            sleep(0.2)
+            a[0:2] += 1
+            finished.append(time.perf_counter())
+
+        @spawn(T[1], [T[0]], placement=cpu, input=[a, b])
+        def read():
+            finished.append(float(a[0] + b[0]))
+
+    assert finished[1] == 2
+    first_b_move = min(t for ID, _, _, t in recorded_moves if ID == b.ID)
+    # With a budget, b is moved while the task waits for the writer of a.
+    assert (first_b_move < finished[0]) == (prefetch_budget > 0)
+    assert all(nbytes == 0 for nbytes in scheduler._available_resources._prefetched_bytes.values())
+
+
+def test_concurrency_slots():
+    import threading
+    device = cpu.devices[0]
+    lock = threading.Lock()
+    running, done = [], []
+    peak = [0]
+    # A device runs as many tasks at a time as it has compute slots.
+    with Parla(slots={cpu: dict(compute=1)}) as scheduler:
+        for i in range(8):
+            @spawn(placement=device)
+            def task():
+                with lock:
+                    running.append(i)
+                    peak[0] = max(peak[0], len(running))
+                sleep(0.01)
+                with lock:
+                    running.remove(i)
+                done.append(i)
+    assert len(done) == 8 and peak == [1]
+    assert scheduler._available_resources.available_resources(device)["compute_slots"] == 1
+
+
+def test_continuation_resources():
+    device = cpu.devices[0]
+    task_results = []
+    # The resources of a task are released once, however often it awaits.
+    with Parla() as scheduler:
+        pool = scheduler._available_resources
+        available = pool.available_resources(device)
+
+        @spawn(placement=device, memory=1000, vcus=0.5)
+        async def task():
+            for i in range(3):
+                @spawn(placement=device)
+                def subtask():
+                    task_results.append(i)
+                await subtask
+    assert task_results == [0, 1, 2]
+    assert pool.available_resources(device) == available
+
+
+def test_elastic_worker_pool():
+    import threading
+    lock = threading.Lock()
+    running, done = [], []
+    peak = [0]
+    with Parla(n_threads=4, idle_timeout=0.1) as scheduler:
+        # The pool starts with one worker and grows while tasks wait for workers.
+        assert len(scheduler._worker_threads) == 1
+        for i in range(4):
+            @spawn(placement=cpu.devices[0])
+            def task():
+                with lock:
+                    running.append(i)
+                    peak[0] = max(peak[0], len(running))
+                sleep(0.1)
+                with lock:
+                    running.remove(i)
+                done.append(i)
+        sleep_until(lambda: len(done) == 4)
+        assert 1 < len(scheduler._worker_threads) <= 4
+        # Idle workers retire.
+        sleep_until(lambda: len(scheduler._worker_threads) == 1)
+    assert peak[0] > 1
+
+
 def test_closure_detachment(runtime_sched):
     task_results = []
     @spawn()
@@ -350,7 +817,7 @@ def test_placement_options_memory(runtime_sched):
         assert task_results.count(cpu(1)) == 2
 
 
-@pytest.mark.skipif(len(cpu.devices) < 4, reason="Run with PARLA_CPU_ARCHITECTURE=cores")
+@pytest.mark.skipif(len(cpu.devices) < 5, reason="Run with PARLA_CPU_ARCHITECTURE=cores")
 def test_placement_multi():
     # Dummy environments with no components for testing.
     environments = [TaskEnvironment(placement=d, components=[]) for d in combinations(cpu.devices, 2)]
@@ -367,6 +834,30 @@ def test_placement_multi():
             assert task_results == devices
 
 
+@pytest.mark.skipif(len(cpu.devices) < 2, reason="Run with PARLA_CPU_ARCHITECTURE=cores")
+def test_multi_device_task_resources():
+    from parla.task_runtime import get_scheduler_context
+    pair = frozenset((cpu(0), cpu(1)))
+    # The default components, which the environment of the pair combines.
+    environments = [TaskEnvironment(placement=[d]) for d in cpu.devices] + [TaskEnvironment(placement=pair)]
+    with Parla(environments):
+        resources = get_scheduler_context().scheduler._available_resources
+        # More memory than one device has: it is divided between the two.
+        memory = 1.5 * cpu(0).available_memory
+        task_results = []
+        @spawn(placement=pair, ndevices=2, memory=memory)
+        def task():
+            task_results.append((frozenset(get_current_devices()),
+                                 [resources.available_resources(d)["memory"] for d in pair]))
+        sleep_until(lambda: len(task_results) == 1)
+        sleep(0.1)
+    # It ran once, on both devices, with half of its memory on each.
+    assert len(task_results) == 1
+    devices, available = task_results[0]
+    assert devices == pair
+    assert available == [pytest.approx(cpu(0).available_memory - memory / 2)] * 2
+
+
 @pytest.mark.skipif(len(cpu.devices) < 3, reason="Run with PARLA_CPU_ARCHITECTURE=cores")
 def test_placement_await(runtime_sched):
     devices = [cpu(0), cpu(1), cpu(2)]
@@ -0,0 +1,66 @@
+import json
+
+from parla import Parla
+from parla.cpu import cpu
+from parla import tracing
+from parla.tasks import spawn, TaskSpace
+from parla.tracing import EventRecorder, event_recorder
+
+
+def test_trace_records_tasks_and_phases(tmp_path):
+    path = str(tmp_path / "trace.json")
+    with Parla(trace=path):
+        T = TaskSpace("T")
+        for i in range(3):
+            @spawn(T[i], [T[i - 1]] if i else [], placement=cpu)
+            def task():
+                pass
+
+    events = json.load(open(path))["traceEvents"]
+    runs = {e["name"]: e for e in events if e.get("cat") == "compute"}
+    assert sorted(runs) == ["T_0", "T_1", "T_2"]
+    for run in runs.values():
+        assert run["ph"] == "X" and run["dur"] >= 0
+        args = run["args"]
+        assert args["spawn"] <= args["map"] <= args["schedule"] <= args["launch"] <= run["ts"]
+    # Dependent tasks start after their dependencies finish.
+    assert runs["T_0"]["ts"] + runs["T_0"]["dur"] <= runs["T_1"]["ts"]
+
+    phases = {e["name"] for e in events if e.get("cat") == "scheduler"}
+    assert phases == {"map", "schedule", "launch"}
+    # Passes which found nothing to do are not recorded.
+    assert all(e["args"]["tasks"] > 0 for e in events if e.get("cat") == "scheduler")
+    assert any(e["ph"] == "M" for e in events)
+
+
+def test_event_recorder_ring_buffer():
+    recorder = EventRecorder()
+    recorder.enable(5)
+    assert recorder.size == 8
+    for i in range(20):
+        recorder.record(tracing.LAUNCH, i, 0)
+    records = recorder.records()
+    assert [task for _, _, task, _, _ in records] == list(range(12, 20))
+    assert all(name == "launch" for _, name, _, _, _ in records)
+
+
+def test_event_recorder_records_tasks():
+    event_recorder.enable()
+    try:
+        with Parla():
+            T = TaskSpace("T")
+            serials = []
+            for i in range(3):
+                @spawn(T[i], [T[i - 1]] if i else [], placement=cpu)
+                def task():
+                    pass
+                serials.append(task.serial)
+    finally:
+        event_recorder.disable()
+
+    events = {}
+    for _, name, task, _, _ in event_recorder.records():
+        events.setdefault(task, []).append(name)
+    for serial in serials:
+        assert events[serial].index("task_start") < events[serial].index("task_finish")
+        assert "task_completed" in events[serial]